@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import os.path
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthrepo import SyntheticRepoGenerator
+from gitrisk.gitrisk import GitRisk
+
+# Benchmarks whose time grows by more than this factor over the baseline are
+# reported as regressions by --compare.
+DEFAULT_REGRESSION_THRESHOLD = 1.25
+
+def _timeRuns(aFunction, aRuns):
+  times = []
+  for run in range(aRuns):
+    start = time.time()
+    aFunction()
+    times.append(time.time() - start)
+
+  times.sort()
+  return {
+    'runs': times,
+    'min': times[0],
+    'median': times[len(times) // 2]
+  }
+
+class BenchmarkSuite:
+  mRepoPath = None
+  mRuns = 5
+  mResults = None
+
+  def __init__(self, aRepoPath, runs=5):
+    self.mRepoPath = aRepoPath
+    self.mRuns = runs
+    self.mResults = {}
+
+  def getResults(self):
+    return self.mResults
+
+  def _newGitRisk(self, objectBackend='git'):
+    # Every run starts from a new GitRisk object, so that nothing extracted or
+    # loaded by an earlier run is reused.
+    return GitRisk(repo=self.mRepoPath, cacheMode='bypass', objectBackend=objectBackend)
+
+  def _git(self, *aArgs):
+    output = subprocess.check_output(('git',) + aArgs, cwd=self.mRepoPath)
+    return output.decode('utf-8').split()
+
+  def run(self):
+    merges = self._git('rev-list', '--merges', 'HEAD')
+    octopusMerges = self._git('rev-list', '--min-parents=3', 'HEAD')
+    rootCommit = self._git('rev-list', '--max-parents=0', 'HEAD')[0]
+    newestMerge = merges[0]
+    mergeParents = self._git('rev-list', '--parents', '-n1', newestMerge)[1:]
+    middleCommit = self._git('rev-list', '--first-parent', 'HEAD')[len(merges) // 2]
+
+    self._benchmark('GitRisk.__init__', lambda: self._newGitRisk())
+    self._benchmark('getMergeBase', lambda: self._newGitRisk().getMergeBase(*mergeParents))
+    if octopusMerges:
+      octopusParents = self._git('rev-list', '--parents', '-n1', octopusMerges[0])[1:]
+      self._benchmark('getMergeBase (octopus)', lambda: self._newGitRisk().getMergeBase(*octopusParents))
+
+    def findSuspectCommits():
+      gitRisk = self._newGitRisk()
+      gitRisk.findSuspectCommits(gitRisk.getCommitFromHash('HEAD'), gitRisk.getCommitFromHash(rootCommit))
+
+    self._benchmark('findSuspectCommits', findSuspectCommits)
+    self._benchmark('getAllSuspectCommitsFromMerge',
+                    lambda: self._newGitRisk().getAllSuspectCommitsFromMerge(newestMerge))
+    self._benchmark('checkMerge', lambda: self._newGitRisk().checkMerge(newestMerge))
+    if octopusMerges:
+      self._benchmark('checkMerge (octopus)', lambda: self._newGitRisk().checkMerge(octopusMerges[0]))
+    self._benchmark('checkCommitRange', lambda: self._newGitRisk().checkCommitRange('HEAD', middleCommit))
+    self._benchmark('checkCommits (all merges)',
+                    lambda: list(self._newGitRisk().checkCommits(merges)))
+
+    # Reading commit messages through git, and straight from the object store.
+    # Both have to find exactly the same tickets.
+    allCommits = self._git('rev-list', '--all')
+    for objectBackend in ['git', 'mmap']:
+      self._benchmark('checkCommitRange (all commits, ' + objectBackend + ' objects)',
+                      lambda: self._newGitRisk(objectBackend).checkCommitRange('HEAD', allCommits[-1]))
+      self._benchmark('checkCommits (all merges, ' + objectBackend + ' objects)',
+                      lambda: list(self._newGitRisk(objectBackend).checkCommits(merges)))
+    self._checkObjectBackendsMatch(merges)
+
+    self._benchmark('cli --help', lambda: self._runCli(['--help']))
+    self._benchmark('cli -c <merge>', lambda: self._runCli(['-c', newestMerge]))
+    self._benchmark('cli --merges', lambda: self._runCli(['--merges', middleCommit + '..HEAD']))
+    return self.mResults
+
+  def _checkObjectBackendsMatch(self, aMerges):
+    results = {}
+    for objectBackend in ['git', 'mmap']:
+      gitRisk = self._newGitRisk(objectBackend)
+      results[objectBackend] = [(commitHash, sorted(tickets), sorted(commit.hexsha for commit in commitsWithoutTickets))
+                                for (commitHash, tickets, commitsWithoutTickets) in gitRisk.checkCommits(aMerges)]
+      gitRisk.close()
+
+    if results['git'] != results['mmap']:
+      raise Exception("the mmap object backend found different tickets than the git one")
+
+  def _benchmark(self, aName, aFunction):
+    sys.stderr.write("benchmarking " + aName + "...\n")
+    self.mResults[aName] = _timeRuns(aFunction, self.mRuns)
+
+  def _runCli(self, aArgs):
+    script = 'import sys; from gitrisk.gitrisk import main; sys.argv = ["git-risk"] + sys.argv[1:]; sys.exit(main())'
+    with open(os.devnull, 'w') as devnull:
+      subprocess.call([sys.executable, '-c', script, '-r', self.mRepoPath] + aArgs, stdout=devnull,
+                      cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def compareResults(aBaseline, aCurrent, aThreshold):
+  # Returns a list of (name, baseline, current) for every benchmark whose
+  # fastest time got slower by more than aThreshold.
+  regressions = []
+  for (name, result) in sorted(aCurrent['results'].items()):
+    baseline = aBaseline['results'].get(name)
+    if baseline and result['min'] > baseline['min'] * aThreshold:
+      regressions.append((name, baseline['min'], result['min']))
+
+  return regressions
+
+def createParser():
+  parser = argparse.ArgumentParser(description='''
+  Benchmark git-risk against a synthetic repository
+  ''', add_help=True)
+  parser.add_argument('--repository', dest='repo', help='Benchmark an existing repository instead of generating one', default=None)
+  parser.add_argument('--commits', dest='commits', type=int, default=5000, help='Approximate number of commits to generate')
+  parser.add_argument('--fan-out', dest='fanOut', type=int, default=4, help='Number of topic branches forked in each round')
+  parser.add_argument('--octopus-rate', dest='octopusRate', type=float, default=0.1, help='Fraction of rounds merged with a single octopus merge')
+  parser.add_argument('--message-lines', dest='messageLines', type=int, default=3, help='Number of lines in each commit message')
+  parser.add_argument('--ticket-density', dest='ticketDensity', type=float, default=0.7, help='Fraction of commits that reference a ticket')
+  parser.add_argument('--seed', dest='seed', type=int, default=1, help='Random seed for the generated repository')
+  parser.add_argument('--commit-graph', dest='commitGraph', action='store_true', default=False, help="Write git's commit-graph file in the generated repository")
+  parser.add_argument('--runs', dest='runs', type=int, default=5, help='Number of times to run each benchmark')
+  parser.add_argument('-o', '--output', dest='output', help='Write results (as JSON) to this file instead of standard output', default=None)
+  parser.add_argument('--compare', dest='baseline', help='Compare the results against those in this file, and exit with a non-zero status if any regressed', default=None)
+  parser.add_argument('--threshold', dest='threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD, help='Slowdown factor over the baseline that counts as a regression')
+  return parser
+
+def main():
+  parsedArgs = createParser().parse_args(sys.argv[1:])
+
+  tempDir = None
+  repoPath = parsedArgs.repo
+  parameters = {'repository': repoPath}
+  if not repoPath:
+    tempDir = tempfile.mkdtemp(prefix='gitRiskBenchmark')
+    repoPath = os.path.join(tempDir, 'repo')
+    generator = SyntheticRepoGenerator(repoPath, commits=parsedArgs.commits, fanOut=parsedArgs.fanOut,
+                                       octopusRate=parsedArgs.octopusRate,
+                                       messageLines=parsedArgs.messageLines,
+                                       ticketDensity=parsedArgs.ticketDensity, seed=parsedArgs.seed)
+    sys.stderr.write("generating repository in " + repoPath + "...\n")
+    generator.generate(parsedArgs.commitGraph)
+    parameters = generator.getParameters()
+    parameters['seed'] = parsedArgs.seed
+    parameters['commitGraph'] = parsedArgs.commitGraph
+
+  try:
+    results = BenchmarkSuite(repoPath, runs=parsedArgs.runs).run()
+  finally:
+    if tempDir:
+      shutil.rmtree(tempDir)
+
+  report = {
+    'parameters': parameters,
+    'environment': {
+      'python': platform.python_version(),
+      'platform': platform.platform(),
+      'git': subprocess.check_output(['git', '--version']).decode('utf-8').strip()
+    },
+    'timestamp': int(time.time()),
+    'results': results
+  }
+
+  reportJson = json.dumps(report, indent=2, sort_keys=True)
+  if parsedArgs.output:
+    with open(parsedArgs.output, 'w') as outputFile:
+      outputFile.write(reportJson + "\n")
+  else:
+    print(reportJson)
+
+  if parsedArgs.baseline:
+    with open(parsedArgs.baseline) as baselineFile:
+      baseline = json.load(baselineFile)
+
+    regressions = compareResults(baseline, report, parsedArgs.threshold)
+    for (name, baselineTime, currentTime) in regressions:
+      sys.stderr.write("regression: %s took %.4fs (baseline %.4fs)\n" % (name, currentTime, baselineTime))
+    if regressions:
+      return 1
+
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
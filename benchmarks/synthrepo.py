@@ -0,0 +1,187 @@
+import argparse
+import os
+import os.path
+import random
+import subprocess
+import sys
+
+# Ticket configuration written into every generated repository, matching
+# conf/default.conf.
+TICKET_REGEX = '^(\\W)*(Bug)(\\ )*((\\#)*[0-9]+)'
+TICKET_REGEX_GROUP = 4
+
+WORDS = ['add', 'remove', 'refactor', 'thing', 'maker', 'searcher', 'widget', 'parser',
+         'cache', 'makefile', 'readme', 'output', 'binary', 'class', 'name', 'file',
+         'support', 'cleanup', 'font', 'shaper', 'binding', 'document', 'reference']
+
+class SyntheticRepoGenerator:
+  mPath = None
+  mCommitCount = 0
+  mFanOut = 1
+  mOctopusRate = 0.0
+  mMessageLines = 1
+  mTicketDensity = 0.5
+  mMaxBranchLength = 1
+  mFileCount = 1
+  mRandom = None
+  mNextMark = 1
+  mTime = 0
+
+  def __init__(self, aPath, commits=1000, fanOut=4, octopusRate=0.1, messageLines=3,
+               ticketDensity=0.7, maxBranchLength=8, files=200, seed=1):
+    self.mPath = aPath
+    self.mCommitCount = commits
+    self.mFanOut = max(1, fanOut)
+    self.mOctopusRate = octopusRate
+    self.mMessageLines = max(1, messageLines)
+    self.mTicketDensity = ticketDensity
+    self.mMaxBranchLength = max(1, maxBranchLength)
+    self.mFileCount = max(1, files)
+
+    # A fixed seed (and fixed timestamps) makes the generated repository, and so
+    # every SHA in it, identical from one run to the next.
+    self.mRandom = random.Random(seed)
+
+  def getParameters(self):
+    return {
+      'commits': self.mCommitCount,
+      'fanOut': self.mFanOut,
+      'octopusRate': self.mOctopusRate,
+      'messageLines': self.mMessageLines,
+      'ticketDensity': self.mTicketDensity,
+      'maxBranchLength': self.mMaxBranchLength,
+      'files': self.mFileCount
+    }
+
+  def generate(self, aWriteCommitGraph=False):
+    if not os.path.isdir(self.mPath):
+      os.makedirs(self.mPath)
+
+    self._git('init', '-q', '.')
+    self._git('config', 'gitrisk.ticketRegex', TICKET_REGEX)
+    self._git('config', 'gitrisk.ticketNumberRegexGroup', str(TICKET_REGEX_GROUP))
+
+    proc = subprocess.Popen(['git', 'fast-import', '--quiet', '--done'], cwd=self.mPath,
+                            stdin=subprocess.PIPE)
+    try:
+      self._writeHistory(proc.stdin)
+      proc.stdin.write(b'done\n')
+    finally:
+      proc.stdin.close()
+      if proc.wait() != 0:
+        raise Exception("git fast-import failed")
+
+    self._git('reset', '-q', '--hard', 'master')
+    if aWriteCommitGraph:
+      self._git('commit-graph', 'write', '--reachable', '--changed-paths')
+
+  def _git(self, *aArgs):
+    subprocess.check_call(('git',) + aArgs, cwd=self.mPath)
+
+  def _writeHistory(self, aStream):
+    # The history is a mainline onto which rounds of topic branches are merged.
+    # Each round forks mFanOut branches from the current tip of the mainline,
+    # and then merges them back, either one at a time or (with probability
+    # mOctopusRate) all at once in a single octopus merge.
+    self.mNextMark = 1
+    self.mTime = 1400000000
+    mainline = self._writeCommit(aStream, [], self._message(False), 'root')
+    commitCount = 1
+
+    while commitCount < self.mCommitCount:
+      branchTips = []
+      for branch in range(self.mFanOut):
+        tip = mainline
+        for commit in range(self.mRandom.randint(1, self.mMaxBranchLength)):
+          tip = self._writeCommit(aStream, [tip], self._message(self._hasTicket()))
+          commitCount = commitCount + 1
+        branchTips.append(tip)
+
+      if len(branchTips) > 1 and self.mRandom.random() < self.mOctopusRate:
+        mainline = self._writeCommit(aStream, [mainline] + branchTips, "Merge octopus\n")
+        commitCount = commitCount + 1
+      else:
+        for (branch, tip) in enumerate(branchTips):
+          # Also add some work directly on the mainline, so that both sides of
+          # each merge have commits of their own.
+          if self.mRandom.random() < 0.5:
+            mainline = self._writeCommit(aStream, [mainline], self._message(self._hasTicket()))
+            commitCount = commitCount + 1
+
+          mainline = self._writeCommit(aStream, [mainline, tip],
+                                       "Merge branch 'topic-%d'\n" % branch)
+          commitCount = commitCount + 1
+
+    aStream.write(('reset refs/heads/master\nfrom :%d\n\n' % mainline).encode('utf-8'))
+
+  def _hasTicket(self):
+    return self.mRandom.random() < self.mTicketDensity
+
+  def _message(self, aHasTicket):
+    words = ' '.join(self.mRandom.choice(WORDS) for word in range(6))
+    if aHasTicket:
+      subject = 'Bug %d: %s' % (self.mRandom.randint(1, 1000000), words)
+    else:
+      subject = '(No Ticket): %s' % words
+
+    body = ['']
+    for line in range(self.mMessageLines - 1):
+      body.append(' '.join(self.mRandom.choice(WORDS) for word in range(10)))
+
+    return subject + '\n' + '\n'.join(body) + '\n'
+
+  def _writeCommit(self, aStream, aParents, aMessage, aPath=None):
+    mark = self.mNextMark
+    self.mNextMark = mark + 1
+    self.mTime = self.mTime + 60
+
+    if aPath is None:
+      aPath = 'dir%d/file%d.txt' % (self.mRandom.randint(0, self.mFileCount // 10),
+                                    self.mRandom.randint(0, self.mFileCount))
+    content = ('%d\n' % mark).encode('utf-8')
+    message = aMessage.encode('utf-8')
+
+    lines = ['commit refs/heads/master',
+             'mark :%d' % mark,
+             'committer git-risk <git-risk@example.com> %d +0000' % self.mTime,
+             'data %d' % len(message)]
+    aStream.write(('\n'.join(lines) + '\n').encode('utf-8') + message + b'\n')
+
+    if aParents:
+      aStream.write(('from :%d\n' % aParents[0]).encode('utf-8'))
+    for parent in aParents[1:]:
+      aStream.write(('merge :%d\n' % parent).encode('utf-8'))
+
+    aStream.write(('M 100644 inline %s\ndata %d\n' % (aPath, len(content))).encode('utf-8'))
+    aStream.write(content + b'\n')
+    return mark
+
+def createParser():
+  parser = argparse.ArgumentParser(description='''
+  Generate a synthetic git repository for benchmarking git-risk
+  ''', add_help=True)
+  parser.add_argument('path', help='Directory in which to create the repository')
+  parser.add_argument('--commits', dest='commits', type=int, default=1000, help='Approximate number of commits to generate')
+  parser.add_argument('--fan-out', dest='fanOut', type=int, default=4, help='Number of topic branches forked in each round')
+  parser.add_argument('--octopus-rate', dest='octopusRate', type=float, default=0.1, help='Fraction of rounds merged with a single octopus merge')
+  parser.add_argument('--message-lines', dest='messageLines', type=int, default=3, help='Number of lines in each commit message')
+  parser.add_argument('--ticket-density', dest='ticketDensity', type=float, default=0.7, help='Fraction of commits that reference a ticket')
+  parser.add_argument('--max-branch-length', dest='maxBranchLength', type=int, default=8, help='Maximum number of commits on each topic branch')
+  parser.add_argument('--files', dest='files', type=int, default=200, help='Number of distinct files touched by the history')
+  parser.add_argument('--seed', dest='seed', type=int, default=1, help='Random seed')
+  parser.add_argument('--commit-graph', dest='commitGraph', action='store_true', default=False, help="Write git's commit-graph file (with changed-path filters)")
+  return parser
+
+def main():
+  parsedArgs = createParser().parse_args(sys.argv[1:])
+  generator = SyntheticRepoGenerator(parsedArgs.path, commits=parsedArgs.commits,
+                                     fanOut=parsedArgs.fanOut, octopusRate=parsedArgs.octopusRate,
+                                     messageLines=parsedArgs.messageLines,
+                                     ticketDensity=parsedArgs.ticketDensity,
+                                     maxBranchLength=parsedArgs.maxBranchLength,
+                                     files=parsedArgs.files, seed=parsedArgs.seed)
+  generator.generate(parsedArgs.commitGraph)
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
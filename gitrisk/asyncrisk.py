@@ -0,0 +1,248 @@
+import asyncio
+import binascii
+
+from gitrisk.commitrecord import CommitRecord
+from gitrisk.daemon import DAEMON_MEMO_SIZE
+from gitrisk.gitrisk import COMMIT_RECORD_FORMAT
+from gitrisk.lrucache import LruCache
+from gitrisk.riskresult import RiskResult
+from gitrisk.ticketmatcher import TicketMatcher
+
+# An asyncio interface to git-risk, for services that need to check merges
+# without blocking their event loop. It requires Python 3.5 or later, unlike the
+# rest of git-risk, and so is never imported by it.
+
+class GitCommandError(Exception):
+  def __init__(self, aCommand, aStatus, aStderr):
+    Exception.__init__(self, "'" + " ".join(aCommand) + "' failed with status " + str(aStatus) +
+                       ": " + aStderr.strip())
+    self.command = aCommand
+    self.status = aStatus
+    self.stderr = aStderr
+
+class AsyncGitRisk:
+  # Answers the same questions as GitRisk's checkMerge, checkCommitRange and
+  # checkCommit, with the same results, but runs git through asyncio
+  # subprocesses rather than GitPython, so that many checks can be in progress
+  # on one event loop. At most mMaxConcurrency git processes are run at once,
+  # however many checks are in progress, and checks of the same commits that
+  # overlap in time share a single result.
+  #
+  # The commits without tickets are given as CommitRecords, as GitRisk does
+  # with asRecords (see GitRisk.checkCommits), since loading GitPython commits
+  # would block.
+  mRepoPath = "."
+  mSpecStrings = None
+  mRegexGroup = None
+  mTicketMatcher = None
+  mMaxConcurrency = 4
+  mSemaphore = None
+  mTicketMemo = None
+  mPendingChecks = None
+
+  def __init__(self, aSpecString=None, repo=".", regexGroup=None, maxConcurrency=4, memoSize=DAEMON_MEMO_SIZE):
+    # As with GitRisk, the ticket regular expression(s), and the group of
+    # them holding the ticket, are read from the repository's git
+    # configuration unless they're given. That happens on the first check, so
+    # that nothing here blocks.
+    self.mRepoPath = repo
+    self.mRegexGroup = regexGroup
+    self.mMaxConcurrency = max(1, int(maxConcurrency))
+
+    if isinstance(aSpecString, (list, tuple)):
+      self.mSpecStrings = list(aSpecString)
+    elif aSpecString:
+      self.mSpecStrings = [aSpecString]
+
+    # CommitRecords already extracted, by binary SHA. Like a daemon's, the memo
+    # is bounded to memoSize records, since it lives as long as the service.
+    self.mTicketMemo = LruCache(memoSize)
+    self.mPendingChecks = {}
+
+  def getRepoPath(self):
+    return self.mRepoPath
+
+  def getMaxConcurrency(self):
+    return self.mMaxConcurrency
+
+  async def getTicketMatcher(self):
+    if not self.mTicketMatcher:
+      regexGroup = 0
+      specStrings = self.mSpecStrings
+      if specStrings is None:
+        groups = await self._getConfigValues('gitrisk.ticketNumberRegexGroup')
+        if groups:
+          regexGroup = groups[-1]
+
+        specStrings = await self._getConfigValues('gitrisk.ticketRegex')
+        if not specStrings:
+          raise Exception("A `ticketRegex` option was not found in the git configuration for this repository. You will need to add one to the `gitrisk` section.")
+
+        # `git config` has already undone any escapes and quotes, just as
+        # GitRisk does, so these are the expressions as they're meant.
+        specStrings = [specString for specString in specStrings if specString]
+
+      if self.mRegexGroup is not None:
+        regexGroup = self.mRegexGroup
+
+      self.mTicketMatcher = TicketMatcher(specStrings, regexGroup)
+
+    return self.mTicketMatcher
+
+  async def checkMerge(self, aShaHash):
+    # Returns a RiskResult of (tickets, recordsWithoutTickets) for a merge.
+    return await self._shareCheck(('merge', aShaHash), lambda: self._checkMerge(aShaHash))
+
+  async def checkCommitRange(self, aStartCommit, aEndCommit):
+    return await self._shareCheck(('range', aStartCommit, aEndCommit),
+                                  lambda: self._checkCommitRange(aStartCommit, aEndCommit))
+
+  async def checkCommit(self, aCommitHash):
+    # If the commit is a merge commit, then we'll check the merge. Otherwise,
+    # we'll check for a range HEAD..<commit>
+    (commitSha, parentShas) = await self._getParents(aCommitHash)
+    if len(parentShas) > 1:
+      return await self.checkMerge(commitSha)
+    else:
+      return await self.checkCommitRange('HEAD', commitSha)
+
+  async def checkCommits(self, aCommitHashes):
+    # Checks all of the given commits concurrently, and returns a list of
+    # (commitHash, tickets, recordsWithoutTickets) RiskResults in the same
+    # order.
+    results = await asyncio.gather(*[self.checkCommit(commitHash) for commitHash in aCommitHashes])
+    return [RiskResult((commitHash,) + tuple(result), result.truncatedBy, result.commitCount)
+            for (commitHash, result) in zip(aCommitHashes, results)]
+
+  async def _shareCheck(self, aKey, aStartCheck):
+    task = self.mPendingChecks.get(aKey)
+    if task is None:
+      task = asyncio.ensure_future(aStartCheck())
+      self.mPendingChecks[aKey] = task
+      task.add_done_callback(lambda aTask: self.mPendingChecks.pop(aKey, None))
+
+    # One caller giving up on the check (e.g. because its request timed out)
+    # shouldn't cancel it for everyone else waiting on it.
+    return await asyncio.shield(task)
+
+  async def _checkMerge(self, aShaHash):
+    (commitSha, parentShas) = await self._getParents(aShaHash)
+
+    # The shaHash should be a merge commit
+    assert len(parentShas) > 1, "commit " + aShaHash + " is not a merge commit"
+
+    mergeBaseSha = await self._getMergeBase(parentShas)
+    suspectShas = await self._getSuspectShas(parentShas, mergeBaseSha)
+
+    # We also need to check this merge commit, in the event that someone added
+    # something to the merge that related to a ticket.
+    suspectShas.append(commitSha)
+    return await self._checkSuspectShas(suspectShas)
+
+  async def _checkCommitRange(self, aStartCommit, aEndCommit):
+    output = await self._git('rev-parse', '--verify', aStartCommit + '^{commit}')
+    startSha = output.decode('ascii').strip()
+    output = await self._git('rev-parse', '--verify', aEndCommit + '^{commit}')
+    endSha = output.decode('ascii').strip()
+
+    mergeBaseSha = await self._getMergeBase([startSha, endSha])
+    return await self._checkSuspectShas(await self._getSuspectShas([startSha, endSha], mergeBaseSha))
+
+  async def _getParents(self, aCommitHash):
+    output = await self._git('rev-list', '--parents', '-n1', aCommitHash + '^{commit}')
+    shas = output.decode('ascii').split()
+    return (shas[0], shas[1:])
+
+  async def _getMergeBase(self, aCommitShas):
+    # Like GitRisk.getMergeBase, the octopus merge base is used when there are
+    # more than two commits, to be conservative.
+    if len(aCommitShas) > 2:
+      output = await self._git('merge-base', '--octopus', *aCommitShas)
+    else:
+      output = await self._git('merge-base', *aCommitShas)
+
+    mergeBaseShas = output.decode('ascii').split()
+
+    # This should not be able to happen...
+    assert mergeBaseShas, "there was no merge base found for the commits"
+    return mergeBaseShas[0]
+
+  async def _getSuspectShas(self, aTipShas, aMergeBaseSha):
+    # Every commit reachable from the tips but not the merge base, and the merge
+    # base itself.
+    output = await self._git('rev-list', '--stdin',
+                             stdin=("\n".join(list(aTipShas) + ['^' + aMergeBaseSha]) + "\n").encode('ascii'))
+    return output.decode('ascii').split() + [aMergeBaseSha]
+
+  async def _checkSuspectShas(self, aSuspectShas):
+    allTickets = set()
+    recordsWithoutTickets = set()
+    records = await self._getCommitRecords([binascii.unhexlify(commitSha) for commitSha in aSuspectShas])
+    for record in records:
+      if not record.tickets:
+        if not record.isMerge:
+          recordsWithoutTickets.add(record)
+      else:
+        allTickets.update(record.tickets)
+
+    return RiskResult((allTickets, recordsWithoutTickets), None, len(records))
+
+  async def _getCommitRecords(self, aCommitBinShas):
+    # Reads the messages of every commit not extracted before from a single git
+    # log process, as GitRisk does.
+    matcher = await self.getTicketMatcher()
+    records = {}
+    for commitBinSha in aCommitBinShas:
+      record = self.mTicketMemo.get(commitBinSha)
+      if record is not None:
+        records[commitBinSha] = record
+
+    # The records read here are kept aside as well as memoised, since there
+    # can be more of them than the memo holds.
+    uncachedShas = [commitBinSha for commitBinSha in aCommitBinShas if commitBinSha not in records]
+    if uncachedShas:
+      output = await self._git('log', '--stdin', '--no-walk=unsorted', '-z', '--format=' + COMMIT_RECORD_FORMAT,
+                               stdin=b"".join(binascii.hexlify(commitBinSha) + b"\n"
+                                              for commitBinSha in uncachedShas))
+
+      # Every field, including the last, is terminated by a NUL byte.
+      fields = output.split(b'\0')
+      for index in range(0, len(fields) - 2, 3):
+        (commitSha, parents, commitMessage) = fields[index:index + 3]
+        record = CommitRecord(binascii.unhexlify(commitSha), len(parents.split()) > 1,
+                              matcher.matchMessage(commitMessage.decode('utf-8', 'replace')))
+        records[record.binsha] = record
+        self.mTicketMemo[record.binsha] = record
+
+    return [records[commitBinSha] for commitBinSha in aCommitBinShas]
+
+  async def _getConfigValues(self, aName):
+    try:
+      output = await self._git('config', '-z', '--get-all', aName)
+    except GitCommandError as error:
+      # `git config` exits with status 1 when the option isn't set.
+      if error.status == 1:
+        return []
+      raise
+
+    return [value.decode('utf-8') for value in output.split(b'\0') if value]
+
+  async def _git(self, *aArgs, stdin=None):
+    # The semaphore is created on first use, so that it belongs to the event
+    # loop the checks are run on.
+    if self.mSemaphore is None:
+      self.mSemaphore = asyncio.Semaphore(self.mMaxConcurrency)
+
+    command = ('git',) + aArgs
+    async with self.mSemaphore:
+      proc = await asyncio.create_subprocess_exec(*command, cwd=self.mRepoPath,
+                                                  stdin=asyncio.subprocess.PIPE if stdin is not None
+                                                  else asyncio.subprocess.DEVNULL,
+                                                  stdout=asyncio.subprocess.PIPE,
+                                                  stderr=asyncio.subprocess.PIPE)
+      (output, errorOutput) = await proc.communicate(stdin)
+
+    if proc.returncode != 0:
+      raise GitCommandError(command, proc.returncode, errorOutput.decode('utf-8', 'replace'))
+
+    return output
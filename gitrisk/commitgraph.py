@@ -0,0 +1,637 @@
+from __future__ import absolute_import
+import binascii
+import heapq
+import mmap
+import os.path
+import struct
+
+from gitrisk.profiler import NULL_PHASE, PHASE_GRAPH
+
+# Layout of git's commit-graph file, see Documentation/technical/commit-graph-format.txt
+# in the git sources.
+_GRAPH_SIGNATURE = b'CGPH'
+_GRAPH_VERSION = 1
+_GRAPH_HASH_VERSION_SHA1 = 1
+_GRAPH_HASH_LENGTH = 20
+_GRAPH_CHUNK_FANOUT = b'OIDF'
+_GRAPH_CHUNK_OID_LOOKUP = b'OIDL'
+_GRAPH_CHUNK_DATA = b'CDAT'
+_GRAPH_CHUNK_EXTRA_EDGES = b'EDGE'
+_GRAPH_CHUNK_BLOOM_INDEXES = b'BIDX'
+_GRAPH_CHUNK_BLOOM_DATA = b'BDAT'
+_GRAPH_PARENT_NONE = 0x70000000
+_GRAPH_EXTRA_EDGES_NEEDED = 0x80000000
+_GRAPH_LAST_EDGE = 0x80000000
+_GRAPH_DATA_WIDTH = _GRAPH_HASH_LENGTH + 16
+
+# Changed-path Bloom filters (written by `git commit-graph write --changed-paths`),
+# see Documentation/technical/commit-graph-format.txt and bloom.c in the git
+# sources. Version 1 filters were hashed with a murmur3 that sign-extended bytes
+# above 0x7f; version 2 fixed that.
+_BLOOM_HEADER_LENGTH = 12
+_BLOOM_SEED_1 = 0x293ae76f
+_BLOOM_SEED_2 = 0x7e646e2c
+_BLOOM_HASH_VERSIONS = (1, 2)
+
+def _rotateLeft(aValue, aCount):
+  return ((aValue << aCount) | (aValue >> (32 - aCount))) & 0xffffffff
+
+def _murmur3(aData, aSeed, aSignedBytes):
+  data = bytearray(aData)
+  if aSignedBytes:
+    byteValues = [byte | 0xffffff00 if byte & 0x80 else byte for byte in data]
+  else:
+    byteValues = list(data)
+
+  seed = aSeed
+  blockCount = len(byteValues) // 4
+  for block in range(blockCount):
+    (byte1, byte2, byte3, byte4) = byteValues[block * 4:block * 4 + 4]
+    k = (byte1 | (byte2 << 8) | (byte3 << 16) | (byte4 << 24)) & 0xffffffff
+    k = (k * 0xcc9e2d51) & 0xffffffff
+    k = _rotateLeft(k, 15)
+    k = (k * 0x1b873593) & 0xffffffff
+    seed = seed ^ k
+    seed = (_rotateLeft(seed, 13) * 5 + 0xe6546b64) & 0xffffffff
+
+  tail = byteValues[blockCount * 4:]
+  if tail:
+    k = 0
+    for (position, byte) in enumerate(tail):
+      k = k ^ ((byte << (8 * position)) & 0xffffffff)
+    k = (k * 0xcc9e2d51) & 0xffffffff
+    k = _rotateLeft(k, 15)
+    k = (k * 0x1b873593) & 0xffffffff
+    seed = seed ^ k
+
+  seed = seed ^ len(byteValues)
+  seed = seed ^ (seed >> 16)
+  seed = (seed * 0x85ebca6b) & 0xffffffff
+  seed = seed ^ (seed >> 13)
+  seed = (seed * 0xc2b2ae35) & 0xffffffff
+  seed = seed ^ (seed >> 16)
+  return seed
+
+# Flags used while painting the graph in getMergeBases(). These mirror the ones
+# used by git itself in commit-reach.c.
+_PARENT1 = 1
+_PARENT2 = 2
+_STALE = 4
+_RESULT = 8
+
+# Flag used when walking ranges in iterRange().
+_UNINTERESTING = 1
+
+def _finishProcess(aProc, aStoppedEarly):
+  if aStoppedEarly and aProc.poll() is None:
+    aProc.terminate()
+    aProc.proc.wait()
+  else:
+    aProc.wait()
+
+class CommitGraph:
+  mRepo = None
+  mProfiler = None
+  mLazy = False
+  mIndex = None
+  mShas = None
+  mParents = None
+  mGenerations = None
+  mDates = None
+  mGraphFileLoaded = False
+  mGraphData = None
+  mGraphCommitCount = 0
+  mBloomIndexOffset = None
+  mBloomDataOffset = None
+  mBloomHashVersion = None
+  mBloomHashCount = 0
+
+  def __init__(self, aRepo, aUseGraphFile=True, profiler=None):
+    # Commits are identified internally by small integers, indexing into the
+    # mShas (binary SHA), mParents (tuple of parent ids), mGenerations and
+    # mDates (commit timestamp) arrays. mIndex maps a binary SHA to its id.
+    #
+    # A commit's parents (and date) are None until it has been loaded, and its
+    # generation is None until all of its ancestors have been too. Merge bases
+    # and ranges are only worked out here for commits with a generation; for
+    # any others, git is asked instead.
+    self.mRepo = aRepo
+    self.mProfiler = profiler
+    self.mIndex = {}
+    self.mShas = []
+    self.mParents = []
+    self.mGenerations = []
+    self.mDates = []
+
+    if aUseGraphFile:
+      with self._phase(PHASE_GRAPH):
+        self.mGraphFileLoaded = self._loadGraphFile(self.getGraphFilePath())
+
+    # Without a commit-graph file, loading a commit's ancestors means reading
+    # the whole history behind it, so commits are loaded one at a time instead,
+    # as they're asked about, and queries about them cost no more than asking
+    # git would.
+    self.mLazy = not self.mGraphFileLoaded
+
+  def _phase(self, aPhase):
+    # Loading commits is profiled (see PhaseProfiler) as a phase of its own,
+    # wherever it's needed.
+    if self.mProfiler:
+      return self.mProfiler.phase(aPhase)
+
+    return NULL_PHASE
+
+  def getGraphFilePath(self):
+    return os.path.join(self.mRepo.common_dir, 'objects', 'info', 'commit-graph')
+
+  def isGraphFileLoaded(self):
+    return self.mGraphFileLoaded
+
+  def getCommitCount(self):
+    return len(self.mShas)
+
+  def getId(self, aHexSha):
+    return self.getIds([aHexSha])[0]
+
+  def getIds(self, aHexShas):
+    hexShas = list(aHexShas)
+    missing = [hexSha for hexSha in hexShas if not self._isKnown(binascii.unhexlify(hexSha))]
+    if missing:
+      with self._phase(PHASE_GRAPH):
+        if self.mLazy:
+          self._loadCommits(missing)
+        else:
+          self._loadHistory(missing, [binascii.unhexlify(hexSha) for hexSha in missing])
+
+    return [self.mIndex[binascii.unhexlify(hexSha)] for hexSha in hexShas]
+
+  def _isKnown(self, aBinSha):
+    # Whether the commit is loaded, and, unless commits are loaded lazily, all
+    # of its ancestors too.
+    commitId = self.mIndex.get(aBinSha)
+    if commitId is None:
+      return False
+
+    if self.mLazy:
+      return self.mParents[commitId] is not None
+
+    return self._hasGeneration(aBinSha)
+
+  def _hasGeneration(self, aBinSha):
+    commitId = self.mIndex.get(aBinSha)
+    return commitId is not None and self.mGenerations[commitId] is not None
+
+  def _isComplete(self, aIds):
+    # Whether all of the ancestors of the given commits are loaded.
+    for commitId in aIds:
+      if self.mGenerations[commitId] is None:
+        return False
+
+    return True
+
+  def getBinSha(self, aId):
+    return self.mShas[aId]
+
+  def getHexSha(self, aId):
+    return str(binascii.hexlify(self.mShas[aId]).decode('ascii'))
+
+  def getParentIds(self, aId):
+    return self.mParents[aId]
+
+  def getGeneration(self, aId):
+    return self.mGenerations[aId]
+
+  def getCommitDate(self, aId):
+    return self.mDates[aId]
+
+  def isMerge(self, aId):
+    return len(self.mParents[aId]) > 1
+
+  def _addCommit(self, aBinSha, aParents, aDate, aGeneration=None):
+    # Adds a commit, or fills in one that was only known as a parent so far.
+    commitId = self.mIndex.get(aBinSha)
+    if commitId is not None:
+      self.mParents[commitId] = aParents
+      self.mDates[commitId] = aDate
+      return commitId
+
+    commitId = len(self.mShas)
+    self.mIndex[aBinSha] = commitId
+    self.mShas.append(aBinSha)
+    self.mParents.append(aParents)
+    self.mGenerations.append(aGeneration)
+    self.mDates.append(aDate)
+    return commitId
+
+  def _getParentId(self, aBinSha):
+    commitId = self.mIndex.get(aBinSha)
+    if commitId is None:
+      commitId = self._addCommit(aBinSha, None, None)
+
+    return commitId
+
+  def _addRevListCommit(self, aFields):
+    # Adds the commit of a `git rev-list --timestamp --parents` line, unless
+    # it's already loaded, and returns its id.
+    binSha = binascii.unhexlify(aFields[1].lstrip(b'-'))
+    commitId = self.mIndex.get(binSha)
+    if commitId is not None and self.mParents[commitId] is not None:
+      return commitId
+
+    parents = tuple(self._getParentId(binascii.unhexlify(parent)) for parent in aFields[2:])
+    return self._addCommit(binSha, parents, int(aFields[0]))
+
+  def _loadGraphFile(self, aPath):
+    # Read every commit in git's commit-graph file, if there is one. This gives
+    # us parents, commit dates and generation numbers without asking git about
+    # each commit. Split commit-graph chains and SHA-256 repositories aren't
+    # supported, and are loaded lazily through git instead.
+    if not os.path.isfile(aPath):
+      return False
+
+    with open(aPath, 'rb') as graphFile:
+      try:
+        data = mmap.mmap(graphFile.fileno(), 0, access=mmap.ACCESS_READ)
+      except (ValueError, mmap.error):
+        return False
+
+    try:
+      return self._parseGraphFile(data)
+    finally:
+      # The changed-path filters are read straight from the mapping as they're
+      # needed, so it's kept open if there are any.
+      if self.mBloomIndexOffset is None:
+        data.close()
+      else:
+        self.mGraphData = data
+
+  def close(self):
+    if self.mGraphData is not None:
+      self.mGraphData.close()
+      self.mGraphData = None
+      self.mBloomIndexOffset = None
+
+  def _parseGraphFile(self, aData):
+    if len(aData) < 8 or aData[0:4] != _GRAPH_SIGNATURE:
+      return False
+
+    (version, hashVersion, chunkCount, baseGraphCount) = struct.unpack_from('>BBBB', aData, 4)
+    if version != _GRAPH_VERSION or hashVersion != _GRAPH_HASH_VERSION_SHA1 or baseGraphCount != 0:
+      return False
+
+    chunks = {}
+    for chunk in range(chunkCount):
+      (chunkId, offset) = struct.unpack_from('>4sQ', aData, 8 + 12 * chunk)
+      chunks[chunkId] = offset
+
+    if _GRAPH_CHUNK_FANOUT not in chunks or _GRAPH_CHUNK_OID_LOOKUP not in chunks \
+       or _GRAPH_CHUNK_DATA not in chunks:
+      return False
+
+    commitCount = struct.unpack_from('>I', aData, chunks[_GRAPH_CHUNK_FANOUT] + 255 * 4)[0]
+    lookupOffset = chunks[_GRAPH_CHUNK_OID_LOOKUP]
+    dataOffset = chunks[_GRAPH_CHUNK_DATA]
+    edgesOffset = chunks.get(_GRAPH_CHUNK_EXTRA_EDGES)
+
+    # Commits are given ids in the order of the file, so that parent positions
+    # in the file can be used as ids directly.
+    assert not self.mShas, "the commit-graph file must be loaded before any other commits"
+    for position in range(commitCount):
+      start = lookupOffset + position * _GRAPH_HASH_LENGTH
+      self._addCommit(aData[start:start + _GRAPH_HASH_LENGTH], None, 0)
+
+    needsGenerations = False
+    for position in range(commitCount):
+      (parent1, parent2, generationAndDate, dateLow) = struct.unpack_from(
+        '>IIII', aData, dataOffset + position * _GRAPH_DATA_WIDTH + _GRAPH_HASH_LENGTH)
+
+      parents = []
+      if parent1 != _GRAPH_PARENT_NONE:
+        parents.append(parent1)
+
+      if parent2 & _GRAPH_EXTRA_EDGES_NEEDED:
+        edge = parent2 & ~_GRAPH_EXTRA_EDGES_NEEDED
+        while True:
+          value = struct.unpack_from('>I', aData, edgesOffset + edge * 4)[0]
+          parents.append(value & ~_GRAPH_LAST_EDGE)
+          if value & _GRAPH_LAST_EDGE:
+            break
+          edge = edge + 1
+      elif parent2 != _GRAPH_PARENT_NONE:
+        parents.append(parent2)
+
+      self.mParents[position] = tuple(parents)
+      self.mDates[position] = ((generationAndDate & 0x3) << 32) | dateLow
+      self.mGenerations[position] = generationAndDate >> 2
+      if self.mGenerations[position] == 0:
+        # Written by a version of git that didn't compute generation numbers.
+        needsGenerations = True
+
+    if needsGenerations:
+      for commitId in range(commitCount):
+        self.mGenerations[commitId] = None
+      self._computeGenerations(range(commitCount))
+
+    self.mGraphCommitCount = commitCount
+    if _GRAPH_CHUNK_BLOOM_INDEXES in chunks and _GRAPH_CHUNK_BLOOM_DATA in chunks:
+      (hashVersion, hashCount) = struct.unpack_from('>II', aData, chunks[_GRAPH_CHUNK_BLOOM_DATA])
+      if hashVersion in _BLOOM_HASH_VERSIONS and hashCount > 0:
+        self.mBloomIndexOffset = chunks[_GRAPH_CHUNK_BLOOM_INDEXES]
+        self.mBloomDataOffset = chunks[_GRAPH_CHUNK_BLOOM_DATA] + _BLOOM_HEADER_LENGTH
+        self.mBloomHashVersion = hashVersion
+        self.mBloomHashCount = hashCount
+
+    return True
+
+  def hasChangedPathFilters(self):
+    return self.mBloomIndexOffset is not None
+
+  def getChangedPathKeys(self, aPaths):
+    # Returns the Bloom filter keys for the given paths (as bytes, relative to
+    # the top of the repository), to be passed to mightHaveChangedPaths().
+    # Hashing is comparatively slow, so it's best done once per path.
+    signedBytes = self.mBloomHashVersion == 1
+    keys = []
+    for path in aPaths:
+      hash1 = _murmur3(path, _BLOOM_SEED_1, signedBytes)
+      hash2 = _murmur3(path, _BLOOM_SEED_2, signedBytes)
+      keys.append([(hash1 + index * hash2) & 0xffffffff for index in range(self.mBloomHashCount)])
+
+    return keys
+
+  def mightHaveChangedPaths(self, aId, aKeys):
+    # Returns False if the commit's changed-path filter shows it can't have
+    # changed any of the paths aKeys were made from (compared to its first
+    # parent), and True if it might have, or if there's no filter to ask.
+    if self.mBloomIndexOffset is None or aId >= self.mGraphCommitCount:
+      return True
+
+    end = struct.unpack_from('>I', self.mGraphData, self.mBloomIndexOffset + aId * 4)[0]
+    start = 0
+    if aId > 0:
+      start = struct.unpack_from('>I', self.mGraphData, self.mBloomIndexOffset + (aId - 1) * 4)[0]
+
+    # An empty filter means git didn't compute one for this commit.
+    if end <= start:
+      return True
+
+    bloomFilter = bytearray(self.mGraphData[self.mBloomDataOffset + start:self.mBloomDataOffset + end])
+    bitCount = len(bloomFilter) * 8
+    for key in aKeys:
+      for keyHash in key:
+        bit = keyHash % bitCount
+        if not bloomFilter[bit >> 3] & (1 << (bit & 7)):
+          break
+      else:
+        return True
+
+    return False
+
+  def loadAll(self):
+    # Load every commit reachable from any ref in one go, so that later queries
+    # don't need to ask git about anything.
+    with self._phase(PHASE_GRAPH):
+      self._loadHistory(['--all'], None)
+    self.mLazy = False
+
+  def loadAncestors(self, aHexShas):
+    # Load the given commits and all of their ancestors, e.g. before analysing
+    # many merges, so that queries about them are answered in-process. From
+    # then on, commits are no longer loaded lazily, since loading a commit's
+    # ancestors only means reading the part of the history that isn't loaded.
+    with self._phase(PHASE_GRAPH):
+      self._loadHistory(aHexShas, [binascii.unhexlify(hexSha) for hexSha in aHexShas])
+    self.mLazy = False
+
+  def _loadCommits(self, aHexShas):
+    # Load just the given commits, without any of their ancestors.
+    proc = self.mRepo.git.rev_list('--no-walk=unsorted', '--timestamp', '--parents', *aHexShas, as_process=True)
+    try:
+      for line in proc.stdout:
+        self._addRevListCommit(line.split())
+    finally:
+      _finishProcess(proc, False)
+
+  def _loadHistory(self, aRevs, aNeeded):
+    # Load the given commits, and every ancestor of theirs we don't know about
+    # yet, from a single `git rev-list` process. If aNeeded is given, the walk is
+    # stopped as soon as all of those commits, and every parent we've seen, are
+    # known, so only the new part of the history is read.
+    needed = None
+    if aNeeded is not None:
+      needed = set(binSha for binSha in aNeeded if not self._hasGeneration(binSha))
+      if not needed:
+        return
+
+    pendingParents = {}
+    proc = self.mRepo.git.rev_list('--timestamp', '--parents', *aRevs, as_process=True)
+    stoppedEarly = False
+    try:
+      for line in proc.stdout:
+        fields = line.split()
+        binSha = binascii.unhexlify(fields[1])
+        if self._hasGeneration(binSha):
+          continue
+
+        parentShas = [binascii.unhexlify(parent) for parent in fields[2:]]
+        commitId = self._addCommit(binSha, None, int(fields[0]))
+        pendingParents[commitId] = parentShas
+        if needed is None:
+          continue
+
+        needed.discard(binSha)
+        for parentSha in parentShas:
+          if not self._hasGeneration(parentSha) and self.mIndex.get(parentSha) not in pendingParents:
+            needed.add(parentSha)
+
+        if not needed:
+          stoppedEarly = True
+          break
+    finally:
+      _finishProcess(proc, stoppedEarly)
+
+    assert not needed, "unable to load the history of: " + ", ".join(aRevs)
+
+    for (commitId, parentShas) in pendingParents.items():
+      self.mParents[commitId] = tuple(self.mIndex[parentSha] for parentSha in parentShas)
+
+    self._computeGenerations(pendingParents)
+
+  def _computeGenerations(self, aIds):
+    # A commit's generation number is one more than the largest generation of
+    # its parents (and 1 for root commits). Ancestors always have a smaller
+    # generation than their descendants.
+    for commitId in aIds:
+      if self.mGenerations[commitId] is not None:
+        continue
+
+      stack = [commitId]
+      while stack:
+        top = stack[-1]
+        pending = [parent for parent in self.mParents[top] if self.mGenerations[parent] is None]
+        if pending:
+          stack.extend(pending)
+          continue
+
+        stack.pop()
+        generation = 0
+        for parent in self.mParents[top]:
+          generation = max(generation, self.mGenerations[parent])
+        self.mGenerations[top] = generation + 1
+
+  def _queueKey(self, aId):
+    # Commits are processed from the highest generation down, so that a commit
+    # is only ever processed once all of its descendants in the walk have been.
+    return (-self.mGenerations[aId], -self.mDates[aId], aId)
+
+  def getMergeBases(self, aOne, aTwos):
+    # Returns the best common ancestors of aOne and every commit in aTwos,
+    # newest first, like `git merge-base --all`.
+    if not self._isComplete([aOne] + list(aTwos)):
+      return self._getMergeBasesFromGit([aOne] + list(aTwos))
+
+    flags = {}
+    queue = []
+    nonStaleCount = [0]
+
+    def addFlags(aId, aFlags):
+      oldFlags = flags.get(aId)
+      if oldFlags is None:
+        flags[aId] = aFlags
+        heapq.heappush(queue, self._queueKey(aId))
+        if not aFlags & _STALE:
+          nonStaleCount[0] += 1
+      elif oldFlags | aFlags != oldFlags:
+        flags[aId] = oldFlags | aFlags
+        if aFlags & _STALE and not oldFlags & _STALE:
+          nonStaleCount[0] -= 1
+
+    addFlags(aOne, _PARENT1)
+    for two in aTwos:
+      addFlags(two, _PARENT2)
+
+    results = []
+    while nonStaleCount[0] > 0:
+      commitId = heapq.heappop(queue)[2]
+      commitFlags = flags[commitId]
+      if not commitFlags & _STALE:
+        nonStaleCount[0] -= 1
+
+      if commitFlags & (_PARENT1 | _PARENT2) == (_PARENT1 | _PARENT2) and not commitFlags & _STALE:
+        flags[commitId] = commitFlags | _RESULT
+        results.append(commitId)
+        commitFlags = commitFlags | _STALE
+
+      for parent in self.mParents[commitId]:
+        addFlags(parent, commitFlags & (_PARENT1 | _PARENT2 | _STALE))
+
+    results.sort(key=lambda commitId: -self.mDates[commitId])
+    return results
+
+  def _getMergeBasesFromGit(self, aIds, octopus=False):
+    args = ['--all']
+    if octopus:
+      args.append('--octopus')
+
+    # git merge-base fails (without any output) if there is no merge base.
+    output = self.mRepo.git.merge_base(*(args + [self.getHexSha(commitId) for commitId in aIds]),
+                                       with_exceptions=False)
+    results = self.getIds(output.split())
+    results.sort(key=lambda commitId: -self.mDates[commitId])
+    return results
+
+  def getMergeBase(self, aOne, aTwo):
+    bases = self.getMergeBases(aOne, [aTwo])
+    if not bases:
+      return None
+
+    return bases[0]
+
+  def getOctopusMergeBases(self, aIds):
+    # Same algorithm as git's get_octopus_merge_bases(): fold each commit into
+    # the merge bases of everything before it.
+    if not aIds:
+      return []
+
+    if not self._isComplete(aIds):
+      return self._getMergeBasesFromGit(aIds, octopus=True)
+
+    bases = [aIds[0]]
+    for commitId in aIds[1:]:
+      newBases = []
+      for base in bases:
+        newBases.extend(self.getMergeBases(commitId, [base]))
+      bases = newBases
+
+    return bases
+
+  def iterRange(self, aTips, aExcludes=(), minDate=None):
+    # Yields the ids of every commit reachable from one of aTips but not from
+    # any of aExcludes (`git rev-list <tips> --not <excludes>`), each exactly
+    # once, from the highest generation down. Since commits are processed in
+    # generation order, a commit's flags are final by the time it is reached.
+    #
+    # With minDate (a timestamp), the walk doesn't go past commits older than
+    # it, as with `git rev-list --max-age`: they are still yielded, so that the
+    # caller can tell the walk was cut short, but their parents aren't.
+    if not self._isComplete(list(aTips) + list(aExcludes)):
+      for commitId in self._iterRangeFromGit(aTips, aExcludes, minDate):
+        yield commitId
+      return
+
+    flags = {}
+    queue = []
+    interestingCount = [0]
+
+    def addCommit(aId, aFlags):
+      oldFlags = flags.get(aId)
+      if oldFlags is None:
+        flags[aId] = aFlags
+        heapq.heappush(queue, self._queueKey(aId))
+        if not aFlags & _UNINTERESTING:
+          interestingCount[0] += 1
+      elif aFlags & _UNINTERESTING and not oldFlags & _UNINTERESTING:
+        flags[aId] = oldFlags | _UNINTERESTING
+        interestingCount[0] -= 1
+
+    for exclude in aExcludes:
+      addCommit(exclude, _UNINTERESTING)
+    for tip in aTips:
+      addCommit(tip, 0)
+
+    while interestingCount[0] > 0:
+      commitId = heapq.heappop(queue)[2]
+      commitFlags = flags[commitId]
+      if not commitFlags & _UNINTERESTING:
+        interestingCount[0] -= 1
+        yield commitId
+
+        if minDate is not None and self.mDates[commitId] < minDate:
+          continue
+
+      for parent in self.mParents[commitId]:
+        addCommit(parent, commitFlags)
+
+  def _iterRangeFromGit(self, aTips, aExcludes, aMinDate=None):
+    # The same walk, done by `git rev-list` (which produces commits newest
+    # first instead), loading each commit as it goes. git leaves the commits
+    # older than --max-age out altogether, so they're asked for as boundary
+    # commits (along with the excluded ones, which are skipped).
+    args = ['--timestamp', '--parents']
+    if aMinDate is not None:
+      args = args + ['--max-age=%d' % aMinDate, '--boundary']
+    args = args + [self.getHexSha(tip) for tip in aTips]
+    if aExcludes:
+      args = args + ['--not'] + [self.getHexSha(exclude) for exclude in aExcludes]
+
+    proc = self.mRepo.git.rev_list(*args, as_process=True)
+    finished = False
+    try:
+      for line in proc.stdout:
+        fields = line.split()
+        commitId = self._addRevListCommit(fields)
+        if not fields[1].startswith(b'-') or self.mDates[commitId] < aMinDate:
+          yield commitId
+      finished = True
+    finally:
+      _finishProcess(proc, not finished)
@@ -0,0 +1,35 @@
+import binascii
+
+class CommitRecord(object):
+  # A compact stand-in for a GitPython Commit, holding only what the suspect and
+  # ticket pipeline needs: the binary SHA, whether the commit is a merge and the
+  # tickets its message references (None if it doesn't reference any). Large
+  # histories keep one of these per commit for the lifetime of a GitRisk
+  # object, so they use __slots__ rather than a dictionary per instance.
+  __slots__ = ('binsha', 'isMerge', 'tickets')
+
+  def __init__(self, aBinSha, aIsMerge, aTickets):
+    self.binsha = aBinSha
+    self.isMerge = aIsMerge
+    self.tickets = aTickets
+
+  @property
+  def hexsha(self):
+    return str(binascii.hexlify(self.binsha).decode('ascii'))
+
+  def __eq__(self, aOther):
+    return isinstance(aOther, CommitRecord) and self.binsha == aOther.binsha
+
+  def __ne__(self, aOther):
+    return not self.__eq__(aOther)
+
+  def __hash__(self):
+    return hash(self.binsha)
+
+  def __reduce__(self):
+    # Records are sent between worker processes, and objects with __slots__
+    # can't be pickled with the default protocol on Python 2.
+    return (CommitRecord, (self.binsha, self.isMerge, self.tickets))
+
+  def __repr__(self):
+    return '<CommitRecord ' + self.hexsha + '>'
@@ -0,0 +1,346 @@
+from __future__ import absolute_import
+import json
+import os
+import os.path
+import socket
+import subprocess
+import time
+
+# The daemon for a repository listens on a Unix socket next to the ticket cache
+# and index, in .git/gitrisk.
+DAEMON_SOCKET_NAME = 'daemon.sock'
+
+# How many commit records (see GitRisk's memoSize) and check results (its
+# resultCacheSize) a daemon's GitRisk keeps by default.
+DAEMON_MEMO_SIZE = 200000
+DAEMON_RESULT_CACHE_SIZE = 4096
+
+# The protocol is one JSON object per line in each direction. A client sends a
+# request, e.g.
+#
+#   {"command": "check", "commits": ["9cfed13"], "summaries": true, ...}
+#
+# and the daemon answers with a {"record": ...} line for each result (as given
+# by GitRisk.getResultRecord), followed by a line with "done" set. That line
+# holds an "error" if the request failed, and "fallback" is also set if the
+# client should run the check itself instead (e.g. because the daemon was
+# started with different options).
+COMMAND_CHECK = 'check'
+COMMAND_PING = 'ping'
+COMMAND_SHUTDOWN = 'shutdown'
+
+def getGitDir(aRepoPath):
+  # Finds the git directory of a repository by asking git, for the daemon
+  # itself (clients use findGitDir, which doesn't run anything). Returns None
+  # if it isn't a repository.
+  try:
+    proc = subprocess.Popen(['git', 'rev-parse', '--git-dir'], cwd=aRepoPath,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output = proc.communicate()[0]
+  except OSError:
+    return None
+
+  if proc.returncode != 0:
+    return None
+
+  return os.path.join(os.path.abspath(aRepoPath), output.decode('utf-8').strip())
+
+def findGitDir(aRepoPath):
+  # Finds the git directory of a repository the way git does, but without
+  # running anything, so that a git-risk run can tell whether a daemon is
+  # running for nothing more than a few stat calls: $GIT_DIR if it's set, or
+  # else the first of aRepoPath and its parents that has a .git directory (or
+  # a .git file pointing to one, as in a linked worktree) or is a bare
+  # repository itself. Returns None if there's none.
+  if os.environ.get('GIT_DIR'):
+    return os.path.abspath(os.environ['GIT_DIR'])
+
+  path = os.path.abspath(aRepoPath)
+  while True:
+    dotGit = os.path.join(path, '.git')
+    if os.path.isdir(dotGit):
+      return dotGit
+
+    if os.path.isfile(dotGit):
+      try:
+        with open(dotGit, 'r') as dotGitFile:
+          line = dotGitFile.readline().strip()
+      except (IOError, OSError):
+        return None
+
+      if not line.startswith('gitdir:'):
+        return None
+
+      return os.path.join(path, line[len('gitdir:'):].strip())
+
+    if all(os.path.exists(os.path.join(path, name)) for name in ['HEAD', 'objects', 'refs']):
+      return path
+
+    parent = os.path.dirname(path)
+    if parent == path:
+      return None
+    path = parent
+
+def getSocketPath(aGitDir):
+  return os.path.join(aGitDir, 'gitrisk', DAEMON_SOCKET_NAME)
+
+def _writeMessage(aFile, aMessage):
+  aFile.write((json.dumps(aMessage, sort_keys=True) + "\n").encode('utf-8'))
+  aFile.flush()
+
+def _iterMessages(aFile):
+  for line in iter(aFile.readline, b''):
+    if line.strip():
+      yield json.loads(line.decode('utf-8'))
+
+class RiskDaemon:
+  # Answers git-risk checks for a single repository over a Unix socket, keeping
+  # its GitRisk object (and with it the Repo, commit graph, commit records
+  # already extracted and results of earlier checks) between requests, so that
+  # hooks and CI steps don't pay for building all of that up again on every
+  # run.
+  #
+  # Requests are answered one at a time, since a GitRisk object can only be used
+  # by one thread at once; the work within a request can still be spread across
+  # worker processes (see GitRisk's jobs).
+  mFactory = None
+  mGitRisk = None
+  mGitDir = None
+  mSocketPath = None
+  mTicketSpec = None
+  mConfigStamp = None
+  mStopped = False
+
+  def __init__(self, aFactory, aRepoPath, ticketSpec=None):
+    # aFactory is called to create the GitRisk object for the repository at
+    # aRepoPath, and again whenever its git configuration changes. ticketSpec
+    # is the ticket regular expression it was given, if any, which a client's
+    # must match for the daemon to answer it.
+    self.mFactory = aFactory
+    self.mTicketSpec = ticketSpec
+    self.mGitDir = getGitDir(aRepoPath)
+    if not self.mGitDir:
+      raise Exception(aRepoPath + " is not a git repository")
+
+    self.mSocketPath = getSocketPath(self.mGitDir)
+    self.mConfigStamp = self._getConfigStamp()
+    self.mGitRisk = self.mFactory()
+
+  def getSocketPath(self):
+    return self.mSocketPath
+
+  def getGitRisk(self):
+    return self.mGitRisk
+
+  def getResultCache(self):
+    return self.mGitRisk.getResultCache()
+
+  def stop(self):
+    self.mStopped = True
+
+  def serve(self, aListening=None):
+    # Answers requests until a shutdown request is received (or the process is
+    # interrupted). aListening, if given, is called once the socket is ready.
+    listener = self._listen()
+    try:
+      if aListening:
+        aListening()
+
+      while not self.mStopped:
+        connection = listener.accept()[0]
+        try:
+          self._handleConnection(connection)
+        except (IOError, socket.error):
+          # The client went away before it had its answer.
+          pass
+        finally:
+          connection.close()
+    finally:
+      listener.close()
+      if os.path.exists(self.mSocketPath):
+        os.remove(self.mSocketPath)
+      self.mGitRisk.close()
+
+  def _listen(self):
+    socketDir = os.path.dirname(self.mSocketPath)
+    if not os.path.isdir(socketDir):
+      os.makedirs(socketDir)
+
+    # A socket left behind by a daemon that didn't exit cleanly is replaced, but
+    # one that's still being served is not.
+    if os.path.exists(self.mSocketPath):
+      client = DaemonClient(self.mSocketPath)
+      if client.connect():
+        client.close()
+        raise Exception("a git-risk daemon is already serving " + self.mSocketPath)
+      os.remove(self.mSocketPath)
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(self.mSocketPath)
+    listener.listen(16)
+    return listener
+
+  def _handleConnection(self, aConnection):
+    reader = aConnection.makefile('rb')
+    writer = aConnection.makefile('wb')
+    try:
+      for request in _iterMessages(reader):
+        for response in self.iterResponses(request):
+          _writeMessage(writer, response)
+        if self.mStopped:
+          break
+    finally:
+      reader.close()
+      writer.close()
+
+  def iterResponses(self, aRequest):
+    # Yields the responses to a single request, the last of which has "done"
+    # set.
+    command = aRequest.get('command')
+    try:
+      if command == COMMAND_CHECK:
+        for response in self._iterCheckResponses(aRequest):
+          yield response
+      elif command == COMMAND_PING:
+        yield {'done': True, 'gitDir': self.mGitDir, 'pid': os.getpid()}
+      elif command == COMMAND_SHUTDOWN:
+        self.stop()
+        yield {'done': True}
+      else:
+        yield {'done': True, 'error': "unknown command: " + str(command)}
+    except Exception as error:
+      yield {'done': True, 'error': error.__class__.__name__ + ": " + str(error)}
+
+  def _iterCheckResponses(self, aRequest):
+    self._reloadIfConfigChanged()
+    mismatch = self._getOptionMismatch(aRequest)
+    if mismatch:
+      yield {'done': True, 'error': mismatch, 'fallback': True}
+      return
+
+    gitRisk = self.mGitRisk
+    if aRequest.get('refUpdates') is not None:
+      commitHashes = gitRisk.getMergesInPush([tuple(refUpdate) for refUpdate in aRequest['refUpdates']])
+    elif aRequest.get('merges'):
+      commitHashes = gitRisk.getMergesInRange(aRequest['merges'])
+    else:
+      commitHashes = aRequest.get('commits') or ['HEAD']
+
+    ticketSet = None
+    if aRequest.get('ticketsFile'):
+      ticketSet = gitRisk.getTicketSetFromFile(aRequest['ticketsFile'])
+
+    # One line summaries are only worked out if the client is going to show
+    # them.
+    needsSummaries = aRequest.get('summaries', True)
+    gitRisk.setInQuietMode(not needsSummaries)
+
+    deadline = None
+    if aRequest.get('timeBudget') is not None:
+      deadline = time.time() + aRequest['timeBudget']
+
+    mismatchCount = len(gitRisk.getCacheMismatches())
+    checkedCount = 0
+    for record in self._iterRecords(commitHashes, deadline, aRequest.get('maxCommits'),
+                                    aRequest.get('maxAge')):
+      if ticketSet is not None:
+        record['tickets'] = sorted(gitRisk.getAtRiskTickets(record['tickets'], ticketSet))
+      yield {'record': record}
+      checkedCount = checkedCount + 1
+
+    yield {'done': True, 'unchecked': commitHashes[checkedCount:],
+           'mismatches': gitRisk.getCacheMismatches()[mismatchCount:]}
+
+  def _iterRecords(self, aCommitHashes, aDeadline, aMaxCommits, aMaxAge):
+    # Yields the result record of each commit in turn. They're checked
+    # together, so that they share the work (and worker processes) of
+    # GitRisk.checkCommits, whose result cache answers whatever was checked
+    # before.
+    gitRisk = self.mGitRisk
+    timeBudget = None
+    if aDeadline is not None:
+      timeBudget = max(0, aDeadline - time.time())
+
+    for result in gitRisk.checkCommits(aCommitHashes, asRecords=True, timeBudget=timeBudget,
+                                       maxCommits=aMaxCommits, maxAge=aMaxAge):
+      (commitHash, tickets, recordsWithoutTickets) = result
+      yield gitRisk.getResultRecord(commitHash, tickets, recordsWithoutTickets, result.truncatedBy,
+                                    result.commitCount)
+
+  def _getOptionMismatch(self, aRequest):
+    # The options that change the results, rather than how they're worked out,
+    # have to be the same as the daemon's.
+    gitRisk = self.mGitRisk
+    if aRequest.get('ticketSpec') != self.mTicketSpec:
+      return "the daemon was started with a different ticket regular expression"
+    if bool(aRequest.get('pathScoped')) != gitRisk.isPathScoped():
+      return "the daemon was started with a different --path-scoped setting"
+    if aRequest.get('cacheMode') not in (None, gitRisk.getCacheMode()):
+      return "the daemon was started with a different --cache mode"
+
+    return None
+
+  def _getConfigStamp(self):
+    # The modification times of the git configuration files the ticket
+    # configuration (and cache setting) can come from.
+    paths = [os.path.join(self.mGitDir, 'config'), os.path.expanduser('~/.gitconfig'),
+             os.path.join(os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config'), 'git', 'config')]
+    stamp = []
+    for path in paths:
+      try:
+        stamp.append(os.stat(path).st_mtime)
+      except OSError:
+        stamp.append(None)
+
+    return tuple(stamp)
+
+  def _reloadIfConfigChanged(self):
+    configStamp = self._getConfigStamp()
+    if configStamp != self.mConfigStamp:
+      self.mGitRisk.close()
+      self.mGitRisk = self.mFactory()
+      self.mConfigStamp = configStamp
+
+class DaemonClient:
+  # The client side of the protocol described above.
+  mSocketPath = None
+  mSocket = None
+
+  def __init__(self, aSocketPath):
+    self.mSocketPath = aSocketPath
+
+  def connect(self):
+    # Returns whether a daemon is listening on the socket.
+    if not os.path.exists(self.mSocketPath):
+      return False
+
+    self.mSocket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+      self.mSocket.connect(self.mSocketPath)
+    except socket.error:
+      self.close()
+      return False
+
+    return True
+
+  def iterResponses(self, aRequest):
+    # Sends a request and yields the responses to it, up to and including the
+    # one with "done" set.
+    writer = self.mSocket.makefile('wb')
+    reader = self.mSocket.makefile('rb')
+    try:
+      _writeMessage(writer, aRequest)
+      for response in _iterMessages(reader):
+        yield response
+        if response.get('done'):
+          return
+    finally:
+      writer.close()
+      reader.close()
+
+    raise IOError("the git-risk daemon closed the connection")
+
+  def close(self):
+    if self.mSocket:
+      self.mSocket.close()
+      self.mSocket = None
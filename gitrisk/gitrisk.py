@@ -1,107 +1,466 @@
+from __future__ import absolute_import
 import argparse
-import configparser
 import sys
-import re
 import os
 import os.path
-import pkg_resources
-from git import *
+import binascii
+import json
+import mmap
+import re
+import tempfile
+from gitrisk.commitgraph import CommitGraph
+from gitrisk.commitrecord import CommitRecord
+from gitrisk.ticketmatcher import TicketMatcher
+from gitrisk.ticketindex import TicketIndex
+from gitrisk.ticketcache import TicketCache, CACHE_MODES, CACHE_MODE_USE, \
+                               CACHE_MODE_WARM, CACHE_MODE_VERIFY, CACHE_MODE_BYPASS
+from gitrisk.resultwriter import ResultWriter, OUTPUT_FORMATS, OUTPUT_FORMAT_TEXT
+from gitrisk.riskresult import RiskResult
+from gitrisk.lrucache import LruCache
+from gitrisk.resultcache import ResultCache, ResultStore, RESULT_CACHE_SIZE
+from gitrisk.objectreader import ObjectReader, OBJECT_BACKENDS, OBJECT_BACKEND_GIT, OBJECT_BACKEND_MMAP, \
+                                 hasReplacedObjects
+from gitrisk.repopool import RepoPool
+from gitrisk.multirepo import MultiRepoRisk
+from gitrisk.daemon import RiskDaemon, DaemonClient, DAEMON_MEMO_SIZE, DAEMON_RESULT_CACHE_SIZE, COMMAND_CHECK, \
+                           findGitDir, getSocketPath
+from gitrisk.walklimits import WalkLimits, LIMIT_TIME_BUDGET
+from gitrisk.profiler import PhaseProfiler, NULL_PHASE, PHASE_CONFIG, PHASE_GRAPH, PHASE_MERGE_BASE, \
+                             PHASE_WALK, PHASE_EXTRACT, PHASE_OUTPUT
+
+# Format used to stream commit records out of `git log -z`: the full SHA, the
+# parent SHAs and the raw commit message, separated (and, because of -z,
+# terminated) by NUL bytes. Commit messages cannot contain NUL bytes.
+COMMIT_RECORD_FORMAT = '%H%x00%P%x00%B'
+
+# Format used to produce one line summaries of many commits at once, matching
+# what `git log --oneline` shows for each of them.
+ONELINE_RECORD_FORMAT = '%H%x00%h %s'
+
+# The SHA given for the old (or new) value of a ref that is being created (or
+# deleted) in the input of pre-receive and post-receive hooks.
+NULL_SHA = '0' * 40
+
+HOOK_PRE_RECEIVE = 'pre-receive'
+HOOK_POST_RECEIVE = 'post-receive'
+HOOKS = [HOOK_PRE_RECEIVE, HOOK_POST_RECEIVE]
+
+def _iterNulRecords(aStream, aFieldCount, aChunkSize=65536):
+  # Split a stream of NUL separated fields into tuples of aFieldCount fields,
+  # without reading the whole stream into memory.
+  fields = []
+  pending = b''
+  while True:
+    chunk = aStream.read(aChunkSize)
+    if not chunk:
+      break
+
+    parts = (pending + chunk).split(b'\0')
+    pending = parts.pop()
+    for part in parts:
+      fields.append(part)
+      if len(fields) == aFieldCount:
+        yield tuple(fields)
+        fields = []
+
+  if pending:
+    fields.append(pending)
+
+  if len(fields) == aFieldCount:
+    yield tuple(fields)
+
+# Suspect sets are only split across worker processes when each worker gets at
+# least this many commits, since below that the cost of the worker's own git log
+# process outweighs the time saved.
+PARALLEL_SHARD_SIZE = 2000
+
+# Without a commit-graph file, the commit graph only loads what each check needs
+# (see CommitGraph), at the cost of a few git processes per check. When at least
+# this many commits are checked together, the history behind them is loaded up
+# front instead, which costs a single walk over it.
+GRAPH_PRELOAD_COMMIT_COUNT = 16
+
+# How many new entries of the persistent ticket cache are written at once.
+TICKET_CACHE_WRITE_BATCH_SIZE = 1000
+
+# In path-scoped mode, commits are only ruled out using changed-path Bloom filters
+# when the other sides of the merge changed at most this many paths, since every
+# path has to be tested against each commit's filter.
+PATH_SCOPE_BLOOM_MAX_PATHS = 1000
+
+# The GitRisk object used by each worker process of a parallel run.
+_workerGitRisk = None
+
+def _initWorker(aSpecStrings, aRegexGroup, aRepoPath, aCacheMode, aPathScoped, aMemoSize, aObjectBackend,
+                aResultCacheSize):
+  global _workerGitRisk
+  _workerGitRisk = GitRisk(aSpecStrings, repo=aRepoPath, cacheMode=aCacheMode, regexGroup=aRegexGroup,
+                           pathScoped=aPathScoped, memoSize=aMemoSize, objectBackend=aObjectBackend,
+                           resultCacheSize=aResultCacheSize)
+
+def _takeWorkerCacheMismatches():
+  # Cache mismatches found in a worker are reported back to the parent process
+  # along with each result.
+  mismatches = _workerGitRisk.mCacheMismatches
+  _workerGitRisk.mCacheMismatches = []
+  return mismatches
+
+def _checkCommitInWorker(aArgs):
+  (commitHash, limits, preloadHistory) = aArgs
+  if preloadHistory:
+    _workerGitRisk._preloadHistory([commitHash])
+  result = _workerGitRisk._checkCommit(commitHash, limits)
+  (tickets, recordsWithoutTickets) = result
+  return (RiskResult((commitHash, tickets, list(recordsWithoutTickets)), result.truncatedBy, result.commitCount),
+          _takeWorkerCacheMismatches())
+
+def _extractTicketsInWorker(aCommitBinShas):
+  records = list(_workerGitRisk._iterCommitTickets(aCommitBinShas))
+  return (records, _takeWorkerCacheMismatches())
+
+# The escape sequences git allows in configuration values, and what they stand
+# for (any other character after a backslash is kept as is, backslash and all).
+# Quotes that aren't escaped only delimit (parts of) the value.
+_CONFIG_ESCAPES = {'\\': '\\', '"': '"', 'n': '\n', 't': '\t', 'b': '\b'}
+_CONFIG_ESCAPE_REGEX = re.compile(r'\\(.)|"', re.DOTALL)
+
+def _unescapeConfigValue(aValue):
+  # GitPython hands out configuration values as they're written in the file, so
+  # escapes and quotes are undone here, as `git config` would. Only those are
+  # touched, so that the rest of the value (which may well not be ASCII) comes
+  # through unchanged.
+  return _CONFIG_ESCAPE_REGEX.sub(_unescapeConfigMatch, aValue)
+
+def _unescapeConfigMatch(aMatch):
+  if aMatch.group(1) is None:
+    return ''
+
+  return _CONFIG_ESCAPES.get(aMatch.group(1), aMatch.group(0))
+
+def _iterFileLines(aFileName):
+  # Yields the lines of a (possibly very large) file without reading it all
+  # into memory, by mapping it rather than going through a read buffer. Empty
+  # files can't be mapped, so those are simply read.
+  with open(aFileName, 'rb') as ticketFile:
+    try:
+      mappedFile = mmap.mmap(ticketFile.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, mmap.error):
+      mappedFile = None
+
+    if mappedFile is None:
+      lines = iter(ticketFile)
+    else:
+      lines = iter(mappedFile.readline, b'')
+
+    try:
+      for line in lines:
+        yield line.decode('utf-8', 'replace').rstrip("\r\n")
+    finally:
+      if mappedFile is not None:
+        mappedFile.close()
+
+def _toHexSha(aBinSha):
+  return str(binascii.hexlify(aBinSha).decode('ascii'))
 
 class GitRisk:
   mSpecString = None
+  mSpecStrings = None
+  mTicketMatcher = None
   mRepoPath = "."
   mRepo = None
   mDebugMode = False
-  mQuietMode = False
+  mCacheMode = CACHE_MODE_BYPASS
+  mTicketCache = None
+  mTicketIndex = None
+  mCacheMismatches = None
+  mCommitGraph = None
+  mTicketMemo = None
+  mJobs = 1
+  mWorkerPool = None
+  mResultWriter = None
+  mProfiler = None
+  mPathScoped = False
+  mMemoSize = None
+  mObjectBackend = OBJECT_BACKEND_GIT
+  mObjectReader = None
+  mResultCacheSize = RESULT_CACHE_SIZE
+  mResultCache = None
+
+  def __init__(self, aSpecString=None, repo=".", debug=False, quiet=False, cacheMode=None,
+               jobs=1, regexGroup=None, outputFormat=OUTPUT_FORMAT_TEXT, profiler=None,
+               pathScoped=False, memoSize=None, objectBackend=None, resultCacheSize=RESULT_CACHE_SIZE):
+
+    # profiler, if given, is a PhaseProfiler that records the time spent (and
+    # git processes run) in each phase of the analysis.
+    self.mProfiler = profiler
+    with self._phase(PHASE_CONFIG):
+      self.mRepoPath = repo
+      self.mDebugMode = debug
+      # GitPython is only imported once it's needed, so that e.g. `git-risk --help`
+      # doesn't pay for loading it.
+      from git import Repo
+      self.mRepo = Repo(self.mRepoPath)
+      if self.mProfiler:
+        self.mProfiler.instrumentRepo(self.mRepo)
+      self.mRegexGroup = 0
+      self.mCacheMismatches = []
+      self.mJobs = max(1, int(jobs))
+
+      # In path-scoped mode, a commit on one side of a merge is only a suspect
+      # if it changed a path that was also changed on another side.
+      self.mPathScoped = pathScoped
+
+      self.mResultWriter = ResultWriter(outputFormat, quiet)
+
+      # CommitRecords already extracted by this object, by binary SHA, so that
+      # overlapping suspect sets (e.g. when checking many merges) only ever read
+      # each commit once. A long-running process (see gitrisk.daemon) can bound
+      # it to memoSize records, keeping the most recently used.
+      self.mTicketMemo = {}
+      self.mResultCacheSize = resultCacheSize
+      self.mMemoSize = memoSize
+      if memoSize:
+        self.mTicketMemo = LruCache(memoSize)
+
+      # The persistent ticket cache is opt-in, either with `gitrisk.cache = true`
+      # in the git configuration or explicitly from the caller.
+      if not cacheMode:
+        cacheMode = CACHE_MODE_BYPASS
+        if self.mRepo.config_reader().get_value('gitrisk', 'cache', False) in (True, 'true', 'yes', 'on', 1):
+          cacheMode = CACHE_MODE_USE
+
+      assert cacheMode in CACHE_MODES, "unknown cache mode: " + str(cacheMode)
+      self.mCacheMode = cacheMode
+
+      # Commit messages are read through `git log`, unless the mmap backend is
+      # chosen, either with `gitrisk.objectBackend = mmap` in the git
+      # configuration or explicitly from the caller.
+      if not objectBackend:
+        objectBackend = self.mRepo.config_reader().get_value('gitrisk', 'objectBackend', OBJECT_BACKEND_GIT)
+
+      assert objectBackend in OBJECT_BACKENDS, "unknown object backend: " + str(objectBackend)
+      self.mObjectBackend = objectBackend
+
+      if not aSpecString:
+        configReader = self.mRepo.config_reader()
+
+        if not configReader.has_section('gitrisk'):
+          print("A `gitrisk` section was not found in the git configuration for this repository. You will need to add one.")
+          sys.exit(1)
+
+        if not configReader.has_option('gitrisk', 'ticketRegex'):
+          print("A `ticketRegex` option was not found in the git configuration for this repository. You will need to add one to the `gitrisk` section.")
+          sys.exit(1)
+
+        if configReader.has_option('gitrisk', 'ticketNumberRegexGroup'):
+            self.mRegexGroup = configReader.get_value('gitrisk', 'ticketNumberRegexGroup')
+
+        # Several ticket formats can be in use in the same repository, so
+        # ticketRegex may be given more than once.
+        self.mSpecStrings = []
+        for specString in configReader.get_values('gitrisk', 'ticketRegex'):
+          specString = _unescapeConfigValue(specString)
+          if specString:
+            self.mSpecStrings.append(specString)
+
+        if not self.mSpecStrings:
+          raise Exception("Unable to find a regular expression for searching tickets")
+      elif isinstance(aSpecString, (list, tuple)):
+        self.mSpecStrings = list(aSpecString)
+      else:
+        self.mSpecStrings = [aSpecString]
 
-  def __init__(self, aSpecString=None, repo=".", debug=False, quiet=False):
+      if regexGroup is not None:
+        self.mRegexGroup = regexGroup
 
-    self.mRepoPath = repo
-    self.mDebugMode = debug
-    self.mRepo = Repo(self.mRepoPath)
-    self.mQuietMode = quiet
-    self.mRegexGroup = 0
+      self.mSpecString = self.mSpecStrings[0]
+      self.mTicketMatcher = TicketMatcher(self.mSpecStrings, self.mRegexGroup)
 
-    if not aSpecString:
-      configReader = self.mRepo.config_reader()
+  def isInQuietMode(self):
+    return self.mResultWriter.isInQuietMode()
 
-      if not configReader.has_section('gitrisk'):
-        print "A `gitrisk` section was not found in the git configuration for this repository. You will need to add one."
-        sys.exit(1)
+  def setInQuietMode(self, aQuiet):
+    self.mResultWriter.setInQuietMode(aQuiet)
 
-      if not configReader.has_option('gitrisk', 'ticketRegex'):
-        print "A `ticketRegex` option was not found in the git configuration for this repository. You will need to add one to the `gitrisk` section."
-        sys.exit(1)
+  def getTicketRegex(self):
+    return self.mSpecString
 
-      if configReader.has_option('gitrisk', 'ticketNumberRegexGroup'):
-          self.mRegexGroup = configReader.get_value('gitrisk', 'ticketNumberRegexGroup')
+  def getTicketRegexes(self):
+    return list(self.mSpecStrings)
 
-      self.mSpecString = configReader.get_value('gitrisk', 'ticketRegex')
+  def getTicketMatcher(self):
+    return self.mTicketMatcher
 
-      self.mSpecString = self.mSpecString.decode('string-escape')
-      self.mSpecString = self.mSpecString.replace('"', '')
-      if not self.mSpecString:
-        raise Exception("Unable to find a regular expression for searching tickets")
-    else:
-      self.mSpecString = aSpecString
+  def getJobs(self):
+    return self.mJobs
 
-  def isInQuietMode(self):
-    return self.mQuietMode
+  def isPathScoped(self):
+    return self.mPathScoped
 
-  def setInQuietMode(self, aQuiet):
-    self.mQuietMode = aQuiet
+  def _getWorkerPool(self):
+    # Each worker has its own GitRisk object, and thus its own Repo, configured
+    # exactly like this one.
+    if not self.mWorkerPool:
+      import multiprocessing
+      self.mWorkerPool = multiprocessing.Pool(self.mJobs, _initWorker,
+                                              (self.mSpecStrings, self.mRegexGroup,
+                                               self.getRepoPath(), self.mCacheMode,
+                                               self.mPathScoped, self.mMemoSize, self.mObjectBackend,
+                                               self.mResultCacheSize))
 
-  def getTicketRegex(self):
-    return self.mSpecString
+    return self.mWorkerPool
 
-  def getTicketNamesFromCommit(self, aCommitObj):
-    tickets = set()
-    commitsWithoutTickets = set()
-    commitMessage = aCommitObj.message
-    resultFoundForCommit = False
-    for line in commitMessage.split("\n"):
-      # Find the first instance of the particular ticket
-      if len(line.lstrip().rstrip()) != 0:
-        result = self.getTicketNamesFromLine(line)
-        if result:
-          tickets.add(result)
-          resultFoundForCommit = True
-
-    if resultFoundForCommit:
-      return tickets
-    else:
+  def close(self):
+    if self.mWorkerPool:
+      self.mWorkerPool.terminate()
+      self.mWorkerPool.join()
+      self.mWorkerPool = None
+
+    if self.mTicketCache:
+      self.mTicketCache.close()
+      self.mTicketCache = None
+
+    if self.mResultCache:
+      self.mResultCache.close()
+      self.mResultCache = None
+
+    if self.mTicketIndex:
+      self.mTicketIndex.close()
+      self.mTicketIndex = None
+
+    if self.mCommitGraph:
+      self.mCommitGraph.close()
+
+    if self.mObjectReader:
+      self.mObjectReader.close()
+      self.mObjectReader = None
+
+    # This stops the persistent `git cat-file` processes GitPython reads objects
+    # through (they're started again if the repository is used after all).
+    self.mRepo.close()
+
+  def getProfiler(self):
+    return self.mProfiler
+
+  def _phase(self, aPhase):
+    if self.mProfiler:
+      return self.mProfiler.phase(aPhase)
+
+    return NULL_PHASE
+
+  def _iterPhase(self, aPhase, aIterable):
+    if self.mProfiler:
+      return self.mProfiler.iterPhase(aPhase, aIterable)
+
+    return aIterable
+
+  def getCacheMode(self):
+    return self.mCacheMode
+
+  def getObjectBackend(self):
+    return self.mObjectBackend
+
+  def getObjectReader(self):
+    # The ObjectReader commit messages are read through with the mmap backend,
+    # or None if they're read through git. Replaced objects are only visible
+    # through git, so it's always used for repositories that have any.
+    if self.mObjectBackend != OBJECT_BACKEND_MMAP:
+      return None
+
+    if not self.mObjectReader:
+      if hasReplacedObjects(self.mRepo.common_dir):
+        self.mObjectBackend = OBJECT_BACKEND_GIT
+        return None
+      self.mObjectReader = ObjectReader.openForRepo(self.mRepo)
+
+    return self.mObjectReader
+
+  def getTicketCache(self):
+    if self.mCacheMode == CACHE_MODE_BYPASS:
       return None
 
+    if not self.mTicketCache:
+      self.mTicketCache = TicketCache.openForRepo(self.mRepo, self.mSpecStrings, self.mRegexGroup)
+
+    return self.mTicketCache
+
+  def getResultCache(self):
+    # The ResultCache holding the results of the merges and ranges checked so
+    # far (see _checkWithResultCache), or None if resultCacheSize was 0. Its
+    # persistent layer follows the cache mode, like the ticket cache.
+    if not self.mResultCacheSize:
+      return None
+
+    if not self.mResultCache:
+      store = None
+      if self.mCacheMode != CACHE_MODE_BYPASS:
+        store = ResultStore.openForRepo(self.mRepo, self.mSpecStrings, self.mRegexGroup)
+      self.mResultCache = ResultCache(self.mResultCacheSize, store=store, cacheMode=self.mCacheMode)
+
+    return self.mResultCache
+
+  def getCacheMismatches(self):
+    # In verify mode, every (sha, cachedEntry, computedEntry) for which the
+    # cache disagreed with a fresh extraction of the commit's tickets.
+    return list(self.mCacheMismatches)
+
+  def getTicketNamesFromCommit(self, aCommitObj):
+    return self.getTicketNamesFromMessage(aCommitObj.message)
+
+  def getTicketNamesFromMessage(self, aMessage):
+    return self.mTicketMatcher.matchMessage(aMessage)
+
   def getTicketNamesFromFile(self, aFileName):
-    f = open(aFileName)
-    results = []
-    for line in f:
-      if len(line.lstrip().rstrip()) != 0:
-        results.append(self.getTicketNamesFromLine(line))
+    with open(aFileName) as f:
+      results = self.mTicketMatcher.matchMany(line for line in f if line.strip())
 
     if self.mDebugMode:
       print("getTicketNamesFromFile: " + str(results))
 
     return results
 
+  def iterTicketNamesFromFile(self, aFileName, includeUnmatched=False):
+    # Yields the ticket found on each line of the file, skipping lines without
+    # one. With includeUnmatched, such lines are instead yielded as they are
+    # (less surrounding whitespace), so that files that list bare ticket ids
+    # work as well as ones that list full ticket titles.
+    for line in _iterFileLines(aFileName):
+      if not line.strip():
+        continue
+
+      ticket = self.mTicketMatcher.match(line)
+      if ticket:
+        yield ticket
+      elif includeUnmatched:
+        yield line.strip()
+
+  def getTicketSetFromFile(self, aFileName):
+    return set(self.iterTicketNamesFromFile(aFileName, includeUnmatched=True))
+
+  def getTicketName(self, aText):
+    # The ticket aText references, if the ticket regexes match it, and otherwise
+    # aText itself, taken to be a bare ticket id.
+    return self.mTicketMatcher.match(aText) or aText.strip()
+
+  def getAtRiskTickets(self, aTickets, aTicketSet):
+    # Returns the subset of aTickets (e.g. the tickets found by checkMerge) that
+    # are also in aTicketSet (e.g. from getTicketSetFromFile). Each ticket is a
+    # single hash lookup, so this is linear in the number of tickets found,
+    # however long the list being checked against is.
+    if not isinstance(aTicketSet, (set, frozenset)):
+      aTicketSet = set(aTicketSet)
+
+    return set(ticket for ticket in aTickets if ticket in aTicketSet)
+
   def getTicketNamesFromLine(self, aLine):
+    result = self.mTicketMatcher.match(aLine)
     if self.mDebugMode:
-      print("***** DEBUG: Spec String: " + self.mSpecString)
+      print("***** DEBUG: Spec Strings: " + str(self.mSpecStrings))
       print("***** DEBUG: aLine: " + aLine)
       print("***** DEBUG: ticket group: " + str(self.mRegexGroup))
+      print("***** DEBUG: Result: " + str(result))
 
-    result = re.search(self.mSpecString, aLine)
-    if not result and self.mDebugMode:
-      print("***** DEBUG: Line was empty")
-    elif self.mDebugMode:
-      print("***** DEBUG: Result: " + str(result.group(self.mRegexGroup)))
-
-    # Handle the case where nothing was found in the commit message that
-    # matched the specification.
-    if not result:
-      return None
-
-    return result.group(self.mRegexGroup).rstrip().lstrip()
+    return result
 
   def isMergeCommit(self, aCommit):
     if (type(aCommit) is str):
@@ -118,62 +477,114 @@ class GitRisk:
     if (self.mDebugMode):
       print("Commit hash: " + str(commitHash))
 
-    commit = self.mRepo.commit(commitHash)
+    # Resolving commits is profiled along with loading them into the commit
+    # graph.
+    with self._phase(PHASE_GRAPH):
+      commit = self.mRepo.commit(commitHash)
     return commit
 
+  def getCommitGraph(self):
+    # The commit graph is loaded lazily, and then kept for the lifetime of this
+    # object, so that merge bases and suspect ranges are computed in-process
+    # rather than by running git for every query.
+    if not self.mCommitGraph:
+      self.mCommitGraph = CommitGraph(self.mRepo, profiler=self.mProfiler)
+
+    return self.mCommitGraph
+
+  def _getCommitId(self, aCommit):
+    hexSha = getattr(aCommit, 'hexsha', None)
+    if hexSha is None:
+      hexSha = self.getCommitFromHash(aCommit).hexsha
+
+    return self.getCommitGraph().getId(hexSha)
+
+  def _getCommitFromId(self, aCommitId):
+    return self._getCommitFromBinSha(self.getCommitGraph().getBinSha(aCommitId))
+
+  def _getCommitFromBinSha(self, aBinSha):
+    # Creating the commit object directly doesn't involve git at all; its data is
+    # only read if the caller asks for it.
+    from git.objects.commit import Commit
+    return Commit(self.mRepo, aBinSha)
+
   def getMergeBase(self, *commitHashes):
     assert type(commitHashes) is tuple, 'commitHashes should be passed as a tuple'
 
     if (self.mDebugMode):
       print("Type of commitHashes is: " + str(type(commitHashes)))
 
-    # If we don't have any commits, then we can't get the
-    # merge base.
-    if len(commitHashes) == 0:
-      return None
+    with self._phase(PHASE_MERGE_BASE):
+      if self.mProfiler:
+        self.mProfiler.addCommits(len(commitHashes))
 
-    # If there's only one commit, then it's its own merge base.
-    if len(commitHashes) == 1:
-      (commitHash,) = commitHashes
-      return self.getCommitFromHash(commitHash)
+      # If we don't have any commits, then we can't get the
+      # merge base.
+      if len(commitHashes) == 0:
+        return None
 
-    # If there are exactly two commits, then we use git-merge in the
-    # normal way.
-    if len(commitHashes) == 2:
-      output = self.mRepo.git.merge_base(commitHashes)
-    else:
-      # If there are more than two commits, then we want to find the
-      # octopus merge base because we don't want to consider a hypothetical
-      # merge base (we're being conservative)
-      output = self.mRepo.git.merge_base(commitHashes, octopus=True)
+      # If there's only one commit, then it's its own merge base.
+      if len(commitHashes) == 1:
+        (commitHash,) = commitHashes
+        return self.getCommitFromHash(commitHash)
+
+      graph = self.getCommitGraph()
+      commitIds = [self._getCommitId(commitHash) for commitHash in commitHashes]
+
+      # If there are exactly two commits, then we find the merge base in the
+      # normal way (as `git merge-base` would).
+      if len(commitIds) == 2:
+        mergeBases = graph.getMergeBases(commitIds[0], commitIds[1:])
+      else:
+        # If there are more than two commits, then we want to find the
+        # octopus merge base because we don't want to consider a hypothetical
+        # merge base (we're being conservative)
+        mergeBases = graph.getOctopusMergeBases(commitIds)
+
+      if not mergeBases:
+        return None
 
-    return self.getCommitFromHash(output)
+      return self._getCommitFromId(mergeBases[0])
 
   def findSuspectCommits(self, aCommitObj, aAncestorCommitObj):
     if self.mDebugMode:
       print("***** findSuspectCommits - commits: " + aCommitObj.hexsha + ", " + aAncestorCommitObj.hexsha)
 
-    commitRange = aAncestorCommitObj.hexsha + ".." + aCommitObj.hexsha
-    commitList = [ x for x in self.mRepo.iter_commits(commitRange) ]
-    if self.mDebugMode:
-      print("Commit range string: " + commitRange)
-      print("Commit list prior to appending: " + str(commitList))
-    commitList.append(aAncestorCommitObj)
-    if self.mDebugMode:
-      print("Commit range: " + str(commitList))
+    with self._phase(PHASE_WALK):
+      graph = self.getCommitGraph()
+      commitIds = graph.iterRange([self._getCommitId(aCommitObj)], [self._getCommitId(aAncestorCommitObj)])
+      commitList = [self._getCommitFromId(commitId) for commitId in commitIds]
+      if self.mDebugMode:
+        print("Commit list prior to appending: " + str(commitList))
+      commitList.append(aAncestorCommitObj)
+      if self.mDebugMode:
+        print("Commit range: " + str(commitList))
+
+      if self.mProfiler:
+        self.mProfiler.addCommits(len(commitList))
 
-    return set(commitList)
+      return set(commitList)
 
   def getAllSuspectCommitsFromMerge(self, shaHash):
+    return set(self.iterAllSuspectCommitsFromMerge(shaHash))
+
+  def iterAllSuspectCommitsFromMerge(self, shaHash):
+    suspectIds = self._iterPhase(PHASE_WALK, self._iterSuspectIdsFromMerge(shaHash))
+    return (self._getCommitFromId(commitId) for commitId in suspectIds)
+
+  def _iterSuspectIdsFromMerge(self, shaHash, pathScoped=None, minDate=None):
     commit = self.getCommitFromHash(shaHash)
 
     # There should be a commit that exists with this shaHash
     assert commit, "there is no commit with shaHash: " + shaHash
 
+    graph = self.getCommitGraph()
+    commitId = self._getCommitId(commit)
+
     # The shaHash should also be a merge commit
-    assert len(commit.parents) > 1, "commit " + shaHash + " is not a merge commit"
+    assert graph.isMerge(commitId), "commit " + shaHash + " is not a merge commit"
 
-    commitParentShas = [parent.hexsha for parent in commit.parents]
+    commitParentShas = [graph.getHexSha(parent) for parent in graph.getParentIds(commitId)]
 
     if self.mDebugMode:
       print("getAllSuspectCommitsFromMerge - parents: " + str(commitParentShas))
@@ -182,19 +593,23 @@ class GitRisk:
     # This should not be able to happen...
     assert mergeBase, "there was no merge base found for the commits"
 
-    suspectCommits = set()
-    for parent in commitParentShas:
-      singlePathSuspects = self.findSuspectCommits(self.getCommitFromHash(parent), mergeBase)
-      suspectCommits = suspectCommits.union(singlePathSuspects)
+    for suspectId in self._iterSuspectIds(graph.getParentIds(commitId), self._getCommitId(mergeBase),
+                                          pathScoped, minDate):
+      yield suspectId
 
     # We also need to check this merge commit, in the event that someone added
     # something to the merge that related to a ticket (probably not a good idea,
     # but people are crazy).
-    suspectCommits.add(self.getCommitFromHash(shaHash))
-
-    return suspectCommits
+    yield commitId
 
   def getAllSuspectCommitsInRange(self, aFromHash, aToHash):
+    return set(self.iterAllSuspectCommitsInRange(aFromHash, aToHash))
+
+  def iterAllSuspectCommitsInRange(self, aFromHash, aToHash):
+    suspectIds = self._iterPhase(PHASE_WALK, self._iterSuspectIdsInRange(aFromHash, aToHash))
+    return (self._getCommitFromId(commitId) for commitId in suspectIds)
+
+  def _iterSuspectIdsInRange(self, aFromHash, aToHash, minDate=None):
     commitFrom = self.getCommitFromHash(aFromHash)
     commitTo = self.getCommitFromHash(aToHash)
 
@@ -209,39 +624,585 @@ class GitRisk:
     # This should not be able to happen...
     assert mergeBase, "there was no merge base found for the commits"
 
-    suspectCommits = set()
-    for commit in initialRange:
-      singlePathSuspects = self.findSuspectCommits(self.getCommitFromHash(commit), mergeBase)
-      suspectCommits = suspectCommits.union(singlePathSuspects)
-
-    return suspectCommits
+    tipIds = [self._getCommitId(commit) for commit in initialRange]
+    for suspectId in self._iterSuspectIds(tipIds, self._getCommitId(mergeBase), minDate=minDate):
+      yield suspectId
 
-  def checkCommitRange(self, aStartCommit, aEndCommit):
-      suspects = self.getAllSuspectCommitsInRange(aStartCommit, aEndCommit)
-      return self._checkSuspectCommits(suspects)
+  def _iterSuspectIds(self, aTipIds, aMergeBaseId, pathScoped=None, minDate=None):
+    # With minDate, the walk stops at commits older than it (see
+    # CommitGraph.iterRange), rather than going all the way to the merge base.
+    if pathScoped is None:
+      pathScoped = self.mPathScoped
 
-  def checkMerge(self, shaHash):
+    if pathScoped and len(aTipIds) > 1:
+      for commitId in self._iterPathScopedSuspectIds(aTipIds, aMergeBaseId, minDate):
+        yield commitId
+    else:
+      # Walk from all of the tips at once, down to (and including) the merge
+      # base. Each commit is produced exactly once, however many of the tips it
+      # can be reached from, and nothing is materialised along the way.
+      graph = self.getCommitGraph()
+      for commitId in graph.iterRange(aTipIds, [aMergeBaseId], minDate=minDate):
+        yield commitId
+
+    yield aMergeBaseId
+
+  def _iterPathScopedSuspectIds(self, aTipIds, aMergeBaseId, aMinDate=None):
+    # Walk each side of the merge separately, to find out which of the sides
+    # every commit is on (a commit can be on several).
+    graph = self.getCommitGraph()
+    commitSides = {}
+    commitIds = []
+    for (side, tipId) in enumerate(aTipIds):
+      for commitId in graph.iterRange([tipId], [aMergeBaseId], minDate=aMinDate):
+        if commitId not in commitSides:
+          commitSides[commitId] = 0
+          commitIds.append(commitId)
+        commitSides[commitId] = commitSides[commitId] | (1 << side)
+
+    # What each side changed as a whole, relative to the merge base.
+    mergeBaseSha = graph.getHexSha(aMergeBaseId)
+    sidePaths = self._getChangedPaths([(graph.getHexSha(tipId), mergeBaseSha) for tipId in aTipIds])
+    allSides = (1 << len(aTipIds)) - 1
+
+    # The paths changed on the sides a commit is not on, and their Bloom filter
+    # keys, only depend on which sides it is on.
+    otherPaths = {}
+    otherKeys = {}
+    useBloomFilters = graph.hasChangedPathFilters()
+
+    candidateIds = []
+    for commitId in commitIds:
+      sides = commitSides[commitId]
+
+      # Merges are kept regardless (as they are when not path-scoped), as is
+      # anything that's on every side, since nothing can conflict with it.
+      if graph.isMerge(commitId) or sides == allSides:
+        yield commitId
+        continue
+
+      if sides not in otherPaths:
+        paths = set()
+        for side in range(len(aTipIds)):
+          if not sides & (1 << side):
+            paths.update(sidePaths[side])
+        otherPaths[sides] = paths
+        if useBloomFilters and len(paths) <= PATH_SCOPE_BLOOM_MAX_PATHS:
+          otherKeys[sides] = graph.getChangedPathKeys(paths)
+
+      if not otherPaths[sides]:
+        continue
+
+      # The changed-path filter (if there is one) can rule a commit out without
+      # asking git, but false positives still need to be checked.
+      if sides in otherKeys and not graph.mightHaveChangedPaths(commitId, otherKeys[sides]):
+        continue
+
+      candidateIds.append(commitId)
+
+    commitPaths = self._getChangedPaths([graph.getHexSha(commitId) for commitId in candidateIds])
+    for (commitId, paths) in zip(candidateIds, commitPaths):
+      if not paths.isdisjoint(otherPaths[commitSides[commitId]]):
+        yield commitId
+
+  def _getChangedPaths(self, aItems):
+    # Returns the set of paths (as bytes) changed by each of aItems, in order,
+    # using a single `git diff-tree --stdin` process. Each item is either the
+    # SHA of a (non-merge) commit, compared to its parent, or a (SHA, SHA) tuple
+    # to compare two commits with each other. Either way, git starts the output
+    # for an item with the first SHA given for it.
+    if not aItems:
+      return []
+
+    changedPaths = [set() for item in aItems]
+    itemPositions = {}
+    itemFile = tempfile.TemporaryFile()
+    try:
+      for (position, item) in enumerate(aItems):
+        if not isinstance(item, tuple):
+          item = (item,)
+        itemFile.write((" ".join(item) + "\n").encode('ascii'))
+        itemPositions.setdefault(item[0].encode('ascii'), []).append(position)
+
+      itemFile.seek(0)
+      proc = self.mRepo.git.diff_tree('--stdin', '-r', '--root', '--no-renames', '--name-only', '-z',
+                                      as_process=True, istream=itemFile)
+
+      # Nothing at all is output for items that didn't change anything, so a
+      # SHA starts whichever of its items comes next, if any are still to come.
+      position = -1
+      for (field,) in _iterNulRecords(proc.stdout, 1):
+        positions = itemPositions.get(field, [])
+        while positions and positions[0] <= position:
+          positions.pop(0)
+
+        if positions:
+          position = positions.pop(0)
+        elif position >= 0:
+          changedPaths[position].add(field)
+      proc.wait()
+    finally:
+      itemFile.close()
+
+    return changedPaths
+
+  def _getCommitsFromRecords(self, aRecords):
+    # The suspect and ticket pipeline works with CommitRecords throughout; they
+    # are only turned into GitPython commits for callers of the public API.
+    return set(self._getCommitFromBinSha(record.binsha) for record in aRecords)
+
+  def _getPublicResult(self, aResult):
+    (tickets, recordsWithoutTickets) = aResult
+    return RiskResult((tickets, self._getCommitsFromRecords(recordsWithoutTickets)),
+                      aResult.truncatedBy, aResult.commitCount)
+
+  def checkCommitRange(self, aStartCommit, aEndCommit, maxCommits=None, maxAge=None, timeBudget=None):
+    # See checkMerge for the limits.
+    limits = WalkLimits(maxCommits=maxCommits, maxAge=maxAge, timeBudget=timeBudget)
+    return self._getPublicResult(self._checkCommitRange(aStartCommit, aEndCommit, limits))
+
+  def _checkCommitRange(self, aStartCommit, aEndCommit, aLimits=None):
+    startSha = self.getCommitFromHash(aStartCommit).hexsha
+    endSha = self.getCommitFromHash(aEndCommit).hexsha
+    return self._checkWithResultCache(('range', startSha, endSha, self.mPathScoped),
+                                      lambda minDate: self._iterSuspectIdsInRange(startSha, endSha, minDate=minDate),
+                                      aLimits)
+
+  def checkCommit(self, aCommitHash, maxCommits=None, maxAge=None, timeBudget=None):
+    # See checkMerge for the limits.
+    limits = WalkLimits(maxCommits=maxCommits, maxAge=maxAge, timeBudget=timeBudget)
+    return self._getPublicResult(self._checkCommit(aCommitHash, limits))
+
+  def _checkCommit(self, aCommitHash, aLimits=None):
+    # If the commit is a merge commit, then we'll check the merge. Otherwise,
+    # we'll check for a range HEAD..<commit>
+    graph = self.getCommitGraph()
+    if graph.isMerge(self._getCommitId(aCommitHash)):
+      return self._checkMerge(aCommitHash, aLimits)
+    else:
+      return self._checkCommitRange('HEAD', aCommitHash, aLimits)
+
+  def checkCommits(self, aCommitHashes, asRecords=False, timeBudget=None, maxCommits=None, maxAge=None):
+    # Check each of the given commits in turn, yielding a
+    # (commitHash, tickets, commitsWithoutTickets) tuple for each one. All of
+    # the checks share this object's commit graph and extracted tickets, so
+    # history common to several of the commits is only read once.
+    #
+    # When running with more than one job, the commits are spread across a pool
+    # of worker processes instead. Results are still produced in the order the
+    # commits were given, however many jobs there are.
+    #
+    # With asRecords, the commits without tickets are given as CommitRecords
+    # rather than GitPython commits, which is all outputResults needs.
+    #
+    # If timeBudget (in seconds) is given, no further commits are checked once
+    # that much time has passed, so fewer results than commits may be produced.
+    # The commit being checked when it runs out is cut short, as are the checks
+    # of each commit by maxCommits and maxAge (see checkMerge). Each result is a
+    # RiskResult, saying whether that happened.
+    limits = WalkLimits(maxCommits=maxCommits, maxAge=maxAge, timeBudget=timeBudget)
+    for result in self._iterCheckResults(aCommitHashes, limits):
+      (commitHash, tickets, recordsWithoutTickets) = result
+      if not asRecords:
+        result = RiskResult((commitHash, tickets, self._getCommitsFromRecords(recordsWithoutTickets)),
+                            result.truncatedBy, result.commitCount)
+      yield result
+
+      if limits.isPastDeadline():
+        return
+
+  def _iterCheckResults(self, aCommitHashes, aLimits):
+    commitHashes = list(aCommitHashes)
+    preloadHistory = len(commitHashes) >= GRAPH_PRELOAD_COMMIT_COUNT
+    if self.mJobs > 1:
+      pool = self._getWorkerPool()
+      for (result, mismatches) in pool.imap(_checkCommitInWorker,
+                                            ((commitHash, aLimits, preloadHistory)
+                                             for commitHash in commitHashes)):
+        self.mCacheMismatches.extend(mismatches)
+        (commitHash, tickets, recordsWithoutTickets) = result
+        yield RiskResult((commitHash, tickets, set(recordsWithoutTickets)), result.truncatedBy,
+                         result.commitCount)
+      return
+
+    if preloadHistory:
+      self._preloadHistory(commitHashes)
+
+    for commitHash in commitHashes:
+      result = self._checkCommit(commitHash, aLimits)
+      (tickets, recordsWithoutTickets) = result
+      yield RiskResult((commitHash, tickets, recordsWithoutTickets), result.truncatedBy, result.commitCount)
+
+  def _preloadHistory(self, aCommitHashes):
+    # Loads the history behind the given commits into the commit graph, if it
+    # isn't already (see GRAPH_PRELOAD_COMMIT_COUNT).
+    graph = self.getCommitGraph()
+    if not graph.isGraphFileLoaded():
+      graph.loadAncestors([self.getCommitFromHash(commitHash).hexsha for commitHash in aCommitHashes])
+
+  def getMergesInRange(self, aRange):
+    # Returns the SHAs of the merge commits in a range given as `A..B`, `A...B`
+    # (the merges reachable from either A or B, but not from both) or just `B`
+    # (every merge reachable from B), newest first, as `git rev-list --merges`
+    # would list them. Either end of a range defaults to HEAD.
+    graph = self.getCommitGraph()
+    if '...' in aRange:
+      tipIds = [self._getCommitId(tipHash or 'HEAD') for tipHash in aRange.split('...', 1)]
+      with self._phase(PHASE_MERGE_BASE):
+        excludeIds = graph.getMergeBases(tipIds[0], tipIds[1:])
+    elif '..' in aRange:
+      (excludeHash, tipHash) = aRange.split('..', 1)
+      tipIds = [self._getCommitId(tipHash or 'HEAD')]
+      excludeIds = [self._getCommitId(excludeHash or 'HEAD')]
+    else:
+      tipIds = [self._getCommitId(aRange)]
+      excludeIds = []
+
+    with self._phase(PHASE_WALK):
+      return [graph.getHexSha(commitId) for commitId in graph.iterRange(tipIds, excludeIds)
+              if graph.isMerge(commitId)]
+
+  def getMergesInPush(self, aRefUpdates):
+    # Returns the SHAs of the merge commits a push introduces, newest first.
+    # aRefUpdates is a list of (oldSha, newSha, refName) tuples, as given to the
+    # pre-receive and post-receive hooks on standard input.
+    #
+    # All of the updated refs are handled by a single walk, so a merge is only
+    # reported once however many of them it was pushed to. Anything reachable
+    # from the old value of an updated ref, or from any ref the push didn't
+    # touch, was already in the repository (and so analysed by an earlier push),
+    # and is skipped. This works for both hooks: in pre-receive no ref has been
+    # updated yet, and in post-receive only the updated refs have moved.
+    updatedRefs = set(refName for (oldSha, newSha, refName) in aRefUpdates)
+    revs = [newSha for (oldSha, newSha, refName) in aRefUpdates if newSha != NULL_SHA]
+    if not revs:
+      return []
+
+    revs.extend('^' + oldSha for (oldSha, newSha, refName) in aRefUpdates if oldSha != NULL_SHA)
+    for line in self.mRepo.git.for_each_ref(format='%(objectname) %(refname)').splitlines():
+      (refSha, refName) = line.split(' ', 1)
+      if refName not in updatedRefs:
+        revs.append('^' + refSha)
+
+    # git does the walk itself, since it only needs to read the new part of the
+    # history, however much there is behind it. The revisions are given on
+    # stdin, since a repository can easily have too many refs to pass on the
+    # command line.
+    revFile = tempfile.TemporaryFile()
+    try:
+      revFile.write(("\n".join(revs) + "\n").encode('ascii'))
+      revFile.seek(0)
+      with self._phase(PHASE_WALK):
+        return self.mRepo.git.rev_list('--stdin', '--merges', istream=revFile).split()
+    finally:
+      revFile.close()
+
+  def getTicketIndex(self):
+    if not self.mTicketIndex:
+      self.mTicketIndex = TicketIndex.openForRepo(self.mRepo, self.mSpecStrings, self.mRegexGroup)
+
+    return self.mTicketIndex
+
+  def updateTicketIndex(self):
+    # Brings the ticket index up to date with every ref in the repository, and
+    # returns the number of commits that were added to it. Only commits that
+    # aren't reachable from the tips indexed last time are read, so keeping the
+    # index up to date costs little more than a single `git rev-list` when
+    # nothing has changed.
+    index = self.getTicketIndex()
+    tipShas = self.mRepo.git.for_each_ref(format='%(objectname)').split()
+    oldTipShas = index.getTips()
+
+    # A tip indexed last time may no longer exist (after a forced update and
+    # gc), so it's ignored rather than failing the walk; the commits that
+    # could only be reached from it are found by the pruning below.
+    newShas = self._revListFromStdin(tipShas + ['^' + tipSha for tipSha in oldTipShas])
+
+    # Tickets are extracted exactly as checkMerge extracts them (sharing its
+    # memo and the persistent ticket cache), and each new merge is indexed
+    # under its whole (never path-scoped) suspect set, so that looking a ticket up finds the same
+    # merges as running checkMerge on every merge would. Only the suspects
+    # that reference a ticket are stored, since lookups never need the others.
+    graph = self.getCommitGraph()
+    records = list(self._iterCommitTickets(binascii.unhexlify(commitSha) for commitSha in newShas))
+    index.addCommitTickets((record.hexsha, record.tickets) for record in records if record.tickets)
+    for record in records:
+      if record.isMerge:
+        suspectIds = self._iterSuspectIdsFromMerge(record.hexsha, pathScoped=False)
+        index.addMergeSuspects(record.hexsha, (graph.getHexSha(suspectId) for suspectId in suspectIds))
+
+    self._pruneTicketIndex(index, tipShas, oldTipShas)
+    index.setTips(tipShas)
+    return len(records)
+
+  def _pruneTicketIndex(self, aIndex, aTipShas, aOldTipShas):
+    # Forgets the indexed commits that are no longer reachable from any ref.
+    # Those are the commits reachable from the old tips but not the new ones,
+    # unless one of the old tips is gone altogether, in which case whatever is
+    # indexed is checked against everything that is still reachable.
+    if self._getMissingObjects(aOldTipShas):
+      reachableShas = set(self._revListFromStdin(aTipShas))
+      aIndex.removeCommits(sha for sha in aIndex.getIndexedCommits() if sha not in reachableShas)
+    elif set(aOldTipShas) - set(aTipShas):
+      aIndex.removeCommits(self._revListFromStdin(aOldTipShas + ['^' + tipSha for tipSha in aTipShas]))
+
+  def _revListFromStdin(self, aRevs):
+    # Lists the commits `git rev-list` lists for aRevs, which are given on its
+    # standard input since there can be more of them than fit on a command
+    # line.
+    if not [rev for rev in aRevs if not rev.startswith('^')]:
+      return []
+
+    revFile = tempfile.TemporaryFile()
+    try:
+      revFile.write(("\n".join(aRevs) + "\n").encode('ascii'))
+      revFile.seek(0)
+      return self.mRepo.git.rev_list('--ignore-missing', '--stdin', istream=revFile).split()
+    finally:
+      revFile.close()
+
+  def _getMissingObjects(self, aShas):
+    if not aShas:
+      return []
+
+    shaFile = tempfile.TemporaryFile()
+    try:
+      shaFile.write(("\n".join(aShas) + "\n").encode('ascii'))
+      shaFile.seek(0)
+      output = self.mRepo.git.cat_file('--batch-check', istream=shaFile)
+    finally:
+      shaFile.close()
+
+    return [line.split()[0] for line in output.splitlines() if line.endswith(' missing')]
+
+  def lookupTicket(self, aTicket, update=True):
+    # Returns (commits, merges, relatedTickets) for a ticket: the SHAs of the
+    # commits that reference it, of the merges that put it at risk, and the
+    # other tickets put at risk by those same merges.
+    if update:
+      self.updateTicketIndex()
+
+    index = self.getTicketIndex()
+    commitShas = index.getCommitsForTicket(aTicket)
+    mergeShas = index.getMergesForCommits(commitShas)
+    relatedTickets = [related for related in index.getTicketsForMerges(mergeShas) if related != aTicket]
+    return (commitShas, mergeShas, relatedTickets)
+
+  def outputTicketLookup(self, aTicket, aCommitShas, aMergeShas, aRelatedTickets):
+    summaries = self.getOneLineCommitMessages(aCommitShas + aMergeShas)
+    if self.getOutputFormat() != OUTPUT_FORMAT_TEXT:
+      record = {
+        'ticket': aTicket,
+        'commits': [{'commit': sha, 'summary': summaries.get(sha)} for sha in aCommitShas],
+        'merges': [{'commit': sha, 'summary': summaries.get(sha)} for sha in aMergeShas],
+        'relatedTickets': aRelatedTickets
+      }
+      sys.stdout.write(json.dumps(record, sort_keys=True) + "\n")
+      sys.stdout.flush()
+      return
+
+    if self.isInQuietMode():
+      for sha in aMergeShas:
+        print(sha)
+      return
+
+    print("Commits referencing " + aTicket + ":")
+    for sha in aCommitShas:
+      print(summaries[sha])
+
+    print("\nMerges that put " + aTicket + " at risk:")
+    for sha in aMergeShas:
+      print(summaries[sha])
+
+    if aRelatedTickets:
+      print("\nOther tickets put at risk by the same merges:")
+      for related in aRelatedTickets:
+        print(related)
+
+  def checkMerge(self, shaHash, maxCommits=None, maxAge=None, timeBudget=None):
+    # Returns a RiskResult of (tickets, commitsWithoutTickets). The check can be
+    # bounded, so that a merge with an ancient merge base can't take too long:
+    # it stops once maxCommits suspect commits have been checked, or timeBudget
+    # seconds have passed, and leaves out commits more than maxAge seconds old.
+    # If it's cut short, the tickets found so far are returned, and the result
+    # says which limit was reached.
+    limits = WalkLimits(maxCommits=maxCommits, maxAge=maxAge, timeBudget=timeBudget)
+    return self._getPublicResult(self._checkMerge(shaHash, limits))
+
+  def _checkMerge(self, shaHash, aLimits=None):
     if self.mDebugMode:
       print("****** TICKET SPEC Ticket Spec String: " + str(self.getTicketRegex()))
 
-    suspects = self.getAllSuspectCommitsFromMerge(shaHash)
-    return self._checkSuspectCommits(suspects)
-
-
-  def _checkSuspectCommits(self, aSuspects):
+    commitSha = self.getCommitFromHash(shaHash).hexsha
+    return self._checkWithResultCache(('merge', commitSha, self.mPathScoped),
+                                      lambda minDate: self._iterSuspectIdsFromMerge(commitSha, minDate=minDate),
+                                      aLimits)
+
+  def _checkWithResultCache(self, aKey, aGetSuspectIds, aLimits):
+    # Checks the suspect commits given by aGetSuspectIds (called with the
+    # check's minimum commit date, if any, so the walk can stop there), unless
+    # the result is already in the result cache. aKey holds the SHAs the
+    # endpoints of the check were resolved to (and whether it's path-scoped),
+    # since references like HEAD move, but commits never change.
+    #
+    # A complete result is only what a bounded check would give if it has no
+    # more suspect commits than the check's maxCommits, and no maxAge is given.
+    # As with any other check, nothing is found once the time budget is spent.
+    resultCache = self.getResultCache()
+    limits = aLimits or WalkLimits()
+    if resultCache and limits.getMinDate() is None and not limits.isPastDeadline():
+      result = resultCache.get(aKey, maxCommitCount=limits.getMaxCommits())
+      if result is not None:
+        return result
+
+    suspectIds = self._iterPhase(PHASE_WALK, aGetSuspectIds(limits.getMinDate()))
+    result = self._checkSuspectIds(suspectIds, aLimits)
+    if resultCache:
+      storedResult = resultCache.put(aKey, result)
+      if storedResult is not None:
+        self.mCacheMismatches.append((aKey[0] + " " + " ".join(aKey[1:-1]), self._getResultEntry(storedResult),
+                                      self._getResultEntry(result)))
+
+    return result
+
+  def _getResultEntry(self, aResult):
+    (tickets, recordsWithoutTickets) = aResult
+    return (sorted(tickets), sorted(record.hexsha for record in recordsWithoutTickets))
+
+  def _checkSuspectIds(self, aSuspectIds, aLimits=None):
     allTickets = set()
-    commitsWithoutTickets = set()
-    for suspectCommit in aSuspects:
-      tickets = self.getTicketNamesFromCommit(suspectCommit)
-      if not tickets:
+    recordsWithoutTickets = set()
+    graph = self.getCommitGraph()
+    walk = (aLimits or WalkLimits()).limitWalk(graph, aSuspectIds)
+    suspectShas = (graph.getBinSha(commitId) for commitId in walk)
+    commitCount = 0
+    for record in self._iterPhase(PHASE_EXTRACT, self._iterCommitTickets(suspectShas)):
+      # Reading the commits can take a while too, so the time budget is also
+      # checked while their tickets are extracted.
+      if walk.isPastDeadline():
+        walk.stop(LIMIT_TIME_BUDGET)
+        break
+
+      commitCount = commitCount + 1
+      if not record.tickets:
         # We didn't find a ticket for this commit. This could be expected, though,
         # if this is a merge commit.
-        if not self.isMergeCommit(suspectCommit):
-          commitsWithoutTickets.add(suspectCommit)
+        if not record.isMerge:
+          recordsWithoutTickets.add(record)
       else:
-        allTickets = allTickets.union(tickets)
-
-    return (allTickets, commitsWithoutTickets)
+        allTickets.update(record.tickets)
+
+    return RiskResult((allTickets, recordsWithoutTickets), walk.getTruncatedBy(), commitCount)
+
+  def _iterCommitTickets(self, aCommitBinShas):
+    # Yields a CommitRecord for each of the given commits (by binary SHA),
+    # consulting the tickets already extracted by this object and the persistent
+    # ticket cache (if enabled) before reading commit messages.
+    uncachedShas = []
+    for commitBinSha in aCommitBinShas:
+      record = self.mTicketMemo.get(commitBinSha)
+      if record:
+        yield record
+      else:
+        uncachedShas.append(commitBinSha)
+
+    # The persistent cache is keyed by hexadecimal SHA.
+    cache = self.getTicketCache()
+    cachedEntries = {}
+    if cache and self.mCacheMode in (CACHE_MODE_USE, CACHE_MODE_VERIFY):
+      cachedEntries = cache.getEntries(_toHexSha(commitBinSha) for commitBinSha in uncachedShas)
+
+    if self.mCacheMode == CACHE_MODE_USE:
+      for (commitSha, (tickets, isMerge)) in cachedEntries.items():
+        record = CommitRecord(binascii.unhexlify(commitSha), isMerge, tickets)
+        self.mTicketMemo[record.binsha] = record
+        yield record
+      uncachedShas = [commitBinSha for commitBinSha in uncachedShas
+                      if _toHexSha(commitBinSha) not in cachedEntries]
+
+    # New entries are written as they're extracted, in batches, so that they're
+    # kept even if the caller stops early (e.g. when its time budget runs out).
+    if not (cache and self.mCacheMode in (CACHE_MODE_USE, CACHE_MODE_WARM)):
+      cache = None
+    newEntries = []
+    try:
+      for record in self._extractCommitTickets(uncachedShas):
+        self.mTicketMemo[record.binsha] = record
+        entry = (record.tickets, record.isMerge)
+        if cache:
+          newEntries.append((record.hexsha,) + entry)
+          if len(newEntries) >= TICKET_CACHE_WRITE_BATCH_SIZE:
+            cache.putEntries(newEntries)
+            newEntries = []
+
+        if self.mCacheMode == CACHE_MODE_VERIFY and record.hexsha in cachedEntries:
+          cachedEntry = cachedEntries[record.hexsha]
+          if cachedEntry != entry:
+            self.mCacheMismatches.append((record.hexsha, cachedEntry, entry))
+
+        yield record
+    finally:
+      if newEntries:
+        cache.putEntries(newEntries)
+
+  def _extractCommitTickets(self, aCommitBinShas):
+    # Large suspect sets are split into shards, which are read and matched by
+    # the worker pool in parallel.
+    if self.mJobs > 1 and len(aCommitBinShas) >= 2 * PARALLEL_SHARD_SIZE:
+      shardSize = max(PARALLEL_SHARD_SIZE, len(aCommitBinShas) // (self.mJobs * 4) + 1)
+      shards = [aCommitBinShas[start:start + shardSize]
+                for start in range(0, len(aCommitBinShas), shardSize)]
+      for (records, mismatches) in self._getWorkerPool().imap(_extractTicketsInWorker, shards):
+        self.mCacheMismatches.extend(mismatches)
+        for record in records:
+          yield record
+      return
+
+    for (commitBinSha, parentCount, commitMessage) in self._iterCommitMessages(aCommitBinShas):
+      yield CommitRecord(commitBinSha, parentCount > 1, self.getTicketNamesFromMessage(commitMessage))
+
+  def _iterCommitMessages(self, aCommitBinShas):
+    # Read the SHA, parent count and message of every given commit from a single
+    # `git log` process, rather than loading each commit object separately. The
+    # SHAs are fed to git on stdin, since the suspect set can easily be too large
+    # to pass on the command line.
+    #
+    # With the mmap backend, the commits are read from the object store by the
+    # ObjectReader instead, and git only reads those it can't.
+    reader = self.getObjectReader()
+    if reader:
+      unreadShas = []
+      for commitBinSha in aCommitBinShas:
+        commit = reader.readCommit(commitBinSha)
+        if commit is None:
+          unreadShas.append(commitBinSha)
+        else:
+          (parentCount, commitMessage) = commit
+          yield (commitBinSha, parentCount, commitMessage)
+      aCommitBinShas = unreadShas
+
+    shaFile = tempfile.TemporaryFile()
+    try:
+      shaCount = 0
+      for commitBinSha in aCommitBinShas:
+        shaFile.write(binascii.hexlify(commitBinSha) + b"\n")
+        shaCount = shaCount + 1
+
+      # With nothing on stdin, git log would fall back to walking HEAD.
+      if shaCount == 0:
+        return
+
+      shaFile.seek(0)
+      proc = self.mRepo.git.log('--stdin', '--no-walk=unsorted', '-z',
+                                format=COMMIT_RECORD_FORMAT,
+                                as_process=True, istream=shaFile)
+      for fields in _iterNulRecords(proc.stdout, 3):
+        (commitSha, parents, commitMessage) = fields
+        yield (binascii.unhexlify(commitSha), len(parents.split()),
+               commitMessage.decode('utf-8', 'replace'))
+      proc.wait()
+    finally:
+      shaFile.close()
 
   def setDebugMode(self, aDebugMode):
     self.mDebugMode = aDebugMode
@@ -249,36 +1210,290 @@ class GitRisk:
   def getOneLineCommitMessage(self, aCommitSha):
     return self.mRepo.git.log(aCommitSha, oneline=True, n=1)
 
-  def outputResults(self, commitHash, bugs, commitsWithNoTickets):
-    if not self.isInQuietMode():
-      print("Tickets potentially affected by:")
-      onelineMessage = self.getOneLineCommitMessage(commitHash)
-      print(onelineMessage + "\n")
-    for bug in bugs:
-      print(bug)
-
-    if not self.isInQuietMode():
-      if (len(commitsWithNoTickets) > 0):
-        print("\nNote: The following commits did not have tickets associated with them (or git-risk\ncouldn't find them), so there might be undocumented issues that have regression(s)\nstemming from these commits' interactions with the merge.\n")
-        for commit in commitsWithNoTickets:
-          print(self.getOneLineCommitMessage(commit))
+  def getOneLineCommitMessages(self, aCommitShas):
+    # Returns a dictionary of full SHA -> one line summary for all of the given
+    # commits, read from a single git process rather than one per commit.
+    summaries = {}
+    commitShas = list(aCommitShas)
+    if not commitShas:
+      return summaries
+
+    shaFile = tempfile.TemporaryFile()
+    try:
+      for commitSha in commitShas:
+        shaFile.write((commitSha + "\n").encode('ascii'))
+      shaFile.seek(0)
+
+      proc = self.mRepo.git.log('--stdin', '--no-walk=unsorted', '-z',
+                                format=ONELINE_RECORD_FORMAT,
+                                as_process=True, istream=shaFile)
+      for (commitSha, summary) in _iterNulRecords(proc.stdout, 2):
+        summaries[str(commitSha.decode('ascii'))] = summary.decode('utf-8', 'replace').rstrip("\n")
+      proc.wait()
+    finally:
+      shaFile.close()
+
+    return summaries
+
+  def getOutputFormat(self):
+    return self.mResultWriter.getOutputFormat()
+
+  def getResultWriter(self):
+    return self.mResultWriter
+
+  def beginOutput(self):
+    self.mResultWriter.begin()
+
+  def endOutput(self):
+    self.mResultWriter.end()
+
+  def outputResults(self, commitHash, bugs, commitsWithNoTickets, truncatedBy=None, commitCount=None):
+    # truncatedBy and commitCount come from the RiskResult of the check, if it
+    # was bounded (see checkMerge).
+    with self._phase(PHASE_OUTPUT):
+      record = self.getResultRecord(commitHash, bugs, commitsWithNoTickets, truncatedBy, commitCount)
+      self.mResultWriter.writeRecord(record)
+
+  def getResultRecord(self, commitHash, bugs, commitsWithNoTickets, truncatedBy=None, commitCount=None):
+    # Returns the result of checking a commit as a dictionary, as written by
+    # the ResultWriter (and, as is, in JSON output).
+    commitSha = self.getCommitFromHash(commitHash).hexsha
+    shasWithNoTickets = sorted(commit.hexsha for commit in commitsWithNoTickets)
+    if self.mProfiler:
+      self.mProfiler.addCommits(1 + len(shasWithNoTickets))
+
+    summaries = {}
+    if self.mResultWriter.needsSummaries():
+      summaries = self.getOneLineCommitMessages([commitSha] + shasWithNoTickets)
+
+    record = {
+      'commit': commitSha,
+      'summary': summaries.get(commitSha),
+      'tickets': sorted(bugs),
+      'commitsWithoutTickets': [{'commit': sha, 'summary': summaries.get(sha)}
+                                for sha in shasWithNoTickets],
+      'truncated': truncatedBy is not None
+    }
+    if truncatedBy is not None:
+      record['truncatedBy'] = truncatedBy
+    if commitCount is not None:
+      record['commitCount'] = commitCount
+
+    return record
 
 def createParser():
-  version = pkg_resources.require('gitrisk')[0].version
   parser = argparse.ArgumentParser(description='''
   Parse git log files for potential regression risks in a given range or after a merge
   ''', add_help=True)
   parser.add_argument('-f', '--config-file', dest='confFile', help='Specify a configuration file', action='store')
-  parser.add_argument('-r', '--repository', dest='repo', help='Specify a directory on which to operate', action='store', default=".")
+  parser.add_argument('-r', '--repository', dest='repos', help='Specify a directory on which to operate. Give more than once to check the same commits (e.g. --merges v1.0..v1.1) in several repositories, and report the tickets at risk across all of them.', action='append', default=None)
+  parser.add_argument('--repo-threads', metavar='<count>', dest='repoThreads', type=int, help='With several repositories, analyse up to <count> of them at once (4 by default).', action='store', default=4)
+  parser.add_argument('--max-open-repos', metavar='<count>', dest='maxOpenRepos', type=int, help='With several repositories, keep at most <count> of them open at once (8 by default).', action='store', default=8)
   parser.add_argument('-q', '--quiet', dest='quietMode', help='Make git-risk use "quiet" mode, which means only the appropriate ticket(s) will be output.', action='store_true', default=False)
+  parser.add_argument('--format', dest='outputFormat', choices=OUTPUT_FORMATS, help='Output results as human readable "text" (the default), as a single "json" array, or as "ndjson" (one JSON object per line, written as each result is produced).', action='store', default=OUTPUT_FORMAT_TEXT)
   parser.add_argument('-g', '--debug', dest='debugMode', help="Make git-risk print out debugging information", action='store_true', default=False)
-  parser.add_argument('-v', '--version', help='Display the version information for git-risk', action='version', version='git-risk version ' + str(version))
+  parser.add_argument('-v', '--version', help='Display the version information for git-risk', action=_VersionAction)
+  parser.add_argument('--cache', dest='cacheMode', choices=CACHE_MODES, help='Control the persistent commit ticket cache in .git/gitrisk: "use" it, "warm" it by re-extracting and storing every commit, "verify" it against freshly extracted tickets, or "bypass" it. Defaults to "use" if gitrisk.cache is set, otherwise "bypass".', action='store', default=None)
   parser.add_argument('-c', '--commit', metavar='<commit-hash>', dest='commitHash', help='Specify an SHA hash for a commit on which to operate.', action='store', default='HEAD')
+  parser.add_argument('--merges', metavar='<range>', dest='mergeRange', help='Check every merge commit in <range> (e.g. v1.0..v1.1, or v1.0...v1.1 for the merges on either side but not both), rather than a single commit.', action='store', default=None)
+  parser.add_argument('-j', '--jobs', metavar='<count>', dest='jobs', type=int, help='Analyse commits using <count> worker processes. Results are reported in the same order regardless of the number of jobs.', action='store', default=1)
+  parser.add_argument('--stdin', dest='readStdin', help='Check every commit whose SHA hash is given on standard input (one per line), rather than a single commit.', action='store_true', default=False)
+  parser.add_argument('--ticket', metavar='<ticket>', dest='ticket', help='Rather than checking commits, list the commits that reference <ticket>, the merges that put it at risk and the other tickets those merges put at risk, using (and first bringing up to date) the ticket index in .git/gitrisk.', action='store', default=None)
+  parser.add_argument('--hook', metavar='<hook>', dest='hook', choices=HOOKS, help='Run as a server-side "pre-receive" or "post-receive" hook: read the "<old> <new> <ref>" lines git gives the hook on standard input, and check every merge the push introduces, across all of the updated refs. As a pre-receive hook, git-risk never rejects a push.', action='store', default=None)
+  parser.add_argument('--time-budget', metavar='<seconds>', dest='timeBudget', type=float, help='Stop checking once <seconds> have passed: the commit being checked reports the tickets found so far, and the commits that were not checked are listed on standard error.', action='store', default=None)
+  parser.add_argument('--max-commits', metavar='<count>', dest='maxCommits', type=int, help='Check at most <count> suspect commits for each commit, reporting the tickets found so far if there are more.', action='store', default=None)
+  parser.add_argument('--max-age', metavar='<days>', dest='maxAge', type=float, help='Leave out suspect commits that were committed more than <days> days ago, without walking the history past them.', action='store', default=None)
+  parser.add_argument('-t', '--tickets-file', metavar='<file>', dest='ticketsFile', help='Only report those of the tickets listed in <file> (one per line, e.g. the open tickets exported from an issue tracker) that are at risk. Lines that match the ticket regular expression are reduced to the ticket they reference.', action='store', default=None)
+  parser.add_argument('--object-backend', dest='objectBackend', choices=OBJECT_BACKENDS, help='Read commit messages through "git" (git log), or with "mmap" straight from the pack files (mapped into memory) and loose objects, falling back to git for anything that can\'t be read that way. Defaults to gitrisk.objectBackend if set, otherwise "git".', action='store', default=None)
+  parser.add_argument('--path-scoped', dest='pathScoped', help='Only treat a commit on one side of a merge as a suspect if it changed a path that was also changed on another side of the merge. Uses the changed-path Bloom filters in the commit-graph file (see `git commit-graph write --changed-paths`) when there are any.', action='store_true', default=False)
+  parser.add_argument('--serve', dest='serve', help='Run as a daemon for the repository, answering the checks of other git-risk processes over a Unix socket in .git/gitrisk while keeping what it has read from the repository (and the results of earlier checks) in memory. git-risk uses a running daemon automatically, and checks commits itself when there is none.', action='store_true', default=False)
+  parser.add_argument('--serve-memo-size', metavar='<count>', dest='serveMemoSize', type=int, help='With --serve, keep the tickets of at most <count> commits in memory (%d by default).' % DAEMON_MEMO_SIZE, action='store', default=DAEMON_MEMO_SIZE)
+  parser.add_argument('--no-daemon', dest='noDaemon', help='Check commits in this process, even if a git-risk daemon (see --serve) is running for the repository.', action='store_true', default=False)
+  parser.add_argument('--profile', dest='profile', help='Print the time spent, git processes run and commits processed in each phase of the analysis to standard error when done.', action='store_true', default=False)
+  parser.add_argument('--profile-dump', metavar='<file>', dest='profileDump', help='Run git-risk under cProfile, and write the resulting profile to <file> (for use with pstats).', action='store', default=None)
   return parser
 
+def getVersion():
+  # The version is only looked up when it's actually asked for, since reading
+  # package metadata is comparatively slow.
+  try:
+    from importlib.metadata import version
+  except ImportError:
+    try:
+      from importlib_metadata import version
+    except ImportError:
+      return 'unknown'
+
+  try:
+    return version('gitrisk')
+  except Exception:
+    return 'unknown'
+
+class _VersionAction(argparse.Action):
+  def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS, help=None):
+    super(_VersionAction, self).__init__(option_strings=option_strings, dest=dest,
+                                         default=default, nargs=0, help=help)
+
+  def __call__(self, parser, namespace, values, option_string=None):
+    printVersion()
+    parser.exit()
+
 def printVersion():
-  version = pkg_resources.require('gitrisk')[0].version
-  print("git-risk version " + str(version))
+  print("git-risk version " + str(getVersion()))
+
+def _getTicketSpec(aParsedArgs):
+  # The ticket regular expression given in a configuration file, if any;
+  # otherwise, each repository's own git configuration is used.
+  if not aParsedArgs.confFile:
+    return None
+
+  import configparser
+  config = configparser.SafeConfigParser()
+  config.read(aParsedArgs.confFile)
+  return config.get('main', 'ticket-spec')
+
+def _createGitRisk(aParsedArgs, aTicketSpec, aRepoPath, aProfiler=None, memoSize=None,
+                   resultCacheSize=RESULT_CACHE_SIZE):
+  return GitRisk(aTicketSpec, repo=aRepoPath, quiet=aParsedArgs.quietMode, debug=aParsedArgs.debugMode,
+                 cacheMode=aParsedArgs.cacheMode, jobs=aParsedArgs.jobs, outputFormat=aParsedArgs.outputFormat,
+                 profiler=aProfiler, pathScoped=aParsedArgs.pathScoped, memoSize=memoSize,
+                 objectBackend=aParsedArgs.objectBackend, resultCacheSize=resultCacheSize)
+
+def _getCheckArgs(aParsedArgs):
+  maxAge = None
+  if aParsedArgs.maxAge is not None:
+    maxAge = aParsedArgs.maxAge * 24 * 60 * 60
+
+  return {'timeBudget': aParsedArgs.timeBudget, 'maxCommits': aParsedArgs.maxCommits, 'maxAge': maxAge}
+
+def _mainForRepositories(aParsedArgs, aRepoPaths):
+  # Checks the same commits in each of several repositories, from a bounded
+  # pool of open repositories. Phase profiles are per GitRisk object, and
+  # can't be shared between threads, so main() rejects --profile here.
+  ticketSpec = _getTicketSpec(aParsedArgs)
+  pool = RepoPool(lambda repoPath: _createGitRisk(aParsedArgs, ticketSpec, repoPath),
+                  maxOpen=aParsedArgs.maxOpenRepos)
+  multiRepoRisk = MultiRepoRisk(pool, threads=aParsedArgs.repoThreads, outputFormat=aParsedArgs.outputFormat,
+                                quiet=aParsedArgs.quietMode)
+
+  def getCommitHashes(aGitRisk):
+    if aParsedArgs.mergeRange:
+      return aGitRisk.getMergesInRange(aParsedArgs.mergeRange)
+    return [aParsedArgs.commitHash]
+
+  try:
+    repoResults = multiRepoRisk.iterRepoResults(aRepoPaths, getCommitHashes, ticketsFile=aParsedArgs.ticketsFile,
+                                                **_getCheckArgs(aParsedArgs))
+    errors = multiRepoRisk.outputRepoResults(repoResults)
+  finally:
+    pool.close()
+
+  if errors:
+    return 1
+
+  return 0
+
+def _serve(aParsedArgs, aRepoPath):
+  # Runs the daemon for a repository until it's stopped, e.g. with SIGTERM.
+  import signal
+  ticketSpec = _getTicketSpec(aParsedArgs)
+  daemon = RiskDaemon(lambda: _createGitRisk(aParsedArgs, ticketSpec, aRepoPath,
+                                             memoSize=aParsedArgs.serveMemoSize,
+                                             resultCacheSize=DAEMON_RESULT_CACHE_SIZE),
+                      aRepoPath, ticketSpec=ticketSpec)
+  signal.signal(signal.SIGTERM, lambda aSignal, aFrame: sys.exit(0))
+  sys.stderr.write("git-risk: serving " + daemon.getSocketPath() + "\n")
+  try:
+    daemon.serve()
+  except KeyboardInterrupt:
+    pass
+
+  return 0
+
+def _canUseDaemon(aParsedArgs):
+  # Ticket lookups, debugging and profiling only make sense in this process.
+  # So does a pre-receive hook: the objects being pushed are only visible to
+  # the hook's own process (they're quarantined until it accepts the push), not
+  # to a daemon.
+  if aParsedArgs.hook == HOOK_PRE_RECEIVE or os.environ.get('GIT_QUARANTINE_PATH'):
+    return False
+
+  return not (aParsedArgs.noDaemon or aParsedArgs.ticket or aParsedArgs.debugMode or aParsedArgs.profile or
+              aParsedArgs.profileDump)
+
+def _mainWithDaemon(aParsedArgs, aRepoPath, aStdinLines):
+  # Has the daemon for the repository, if one is running, do the checks, and
+  # writes its results just as they would have been written had they been
+  # worked out here. Returns None, without having written anything, if there's
+  # no daemon or anything goes wrong with it, so that the checks are done here
+  # instead.
+  # Nothing is run to find out whether there's a daemon, so that a run without
+  # one costs no more than it would otherwise.
+  gitDir = findGitDir(aRepoPath)
+  if not gitDir or not os.path.exists(getSocketPath(gitDir)):
+    return None
+
+  client = DaemonClient(getSocketPath(gitDir))
+  if not client.connect():
+    return None
+
+  writer = ResultWriter(aParsedArgs.outputFormat, aParsedArgs.quietMode)
+  request = {'command': COMMAND_CHECK, 'ticketSpec': _getTicketSpec(aParsedArgs),
+             'pathScoped': aParsedArgs.pathScoped, 'cacheMode': aParsedArgs.cacheMode,
+             'summaries': writer.needsSummaries()}
+  request.update(_getCheckArgs(aParsedArgs))
+  if aParsedArgs.ticketsFile:
+    request['ticketsFile'] = os.path.abspath(aParsedArgs.ticketsFile)
+
+  if aParsedArgs.hook:
+    request['refUpdates'] = [line.split() for line in aStdinLines]
+  elif aParsedArgs.mergeRange:
+    request['merges'] = aParsedArgs.mergeRange
+  elif aParsedArgs.readStdin:
+    request['commits'] = aStdinLines
+  else:
+    request['commits'] = [aParsedArgs.commitHash]
+
+  # The records are only written once the daemon has answered the whole
+  # request, since it can still fail after some of them.
+  records = []
+  response = {}
+  try:
+    for response in client.iterResponses(request):
+      if 'record' in response:
+        records.append(response['record'])
+  except Exception:
+    return None
+  finally:
+    client.close()
+
+  if not response.get('done') or 'error' in response:
+    return None
+
+  writer.begin()
+  for record in records:
+    writer.writeRecord(record)
+  writer.end()
+
+  _reportUncheckedCommits(response['unchecked'])
+  return _reportCacheMismatches(response['mismatches'])
+
+def _reportUncheckedCommits(aCommitHashes):
+  if aCommitHashes:
+    sys.stderr.write("git-risk: the time budget ran out before the following commits were checked:\n")
+    for commitHash in aCommitHashes:
+      sys.stderr.write(commitHash + "\n")
+
+def _reportCacheMismatches(aMismatches):
+  # Returns the exit status of git-risk, given the cache mismatches found.
+  if not aMismatches:
+    return 0
+
+  for (commitSha, cachedEntry, computedEntry) in aMismatches:
+    sys.stderr.write("git-risk: cache entry for " + commitSha + " is stale: cached " +
+                     str(cachedEntry) + ", extracted " + str(computedEntry) + "\n")
+
+  return 1
 
 def main():
   parser = createParser()
@@ -289,31 +1504,100 @@ def main():
     parser.print_help()
     return 1
 
-  repo = '.'
-  if parsedArgs.repo:
-    repo = parsedArgs.repo
+  repos = parsedArgs.repos or ['.']
+  if len(repos) > 1:
+    if (parsedArgs.ticket or parsedArgs.hook or parsedArgs.readStdin or parsedArgs.serve or parsedArgs.profile or
+        parsedArgs.profileDump):
+      parser.error("--ticket, --hook, --stdin, --serve, --profile and --profile-dump can only be used with a "
+                   "single repository")
+    return _mainForRepositories(parsedArgs, repos)
+
+  if parsedArgs.serve:
+    return _serve(parsedArgs, repos[0])
+
+  if parsedArgs.hook != HOOK_PRE_RECEIVE:
+    return _mainForRepository(parsedArgs, repos[0])
+
+  # A pre-receive hook that fails rejects the push, which git-risk never does:
+  # whatever goes wrong (even a stale cache) is only reported.
+  try:
+    _mainForRepository(parsedArgs, repos[0])
+  except SystemExit:
+    pass
+  except Exception as error:
+    sys.stderr.write("git-risk: " + error.__class__.__name__ + ": " + str(error) + "\n")
 
-  if parsedArgs.confFile:
-    config = configparser.SafeConfigParser()
-    config.read(parsedArgs.confFile)
-    searchString = config.get('main', 'ticket-spec')
-    gitrisk = GitRisk(searchString, repo=repo, quiet=parsedArgs.quietMode, debug=parsedArgs.debugMode)
-  else:
-    # try:
-      gitrisk = GitRisk(repo=repo, quiet=parsedArgs.quietMode, debug=parsedArgs.debugMode)
-    # except:
-      # parser.print_help()
-      # return 1
-
-  # If the commit given on the command line is a merge commit, then we'll check
-  # the merge. Otherwise, we'll check for a range HEAD..<commit>
-  if gitrisk.isMergeCommit(parsedArgs.commitHash):
-      (bugs, commitsWithNoTickets) = gitrisk.checkMerge(parsedArgs.commitHash)
-  else:
-      (bugs, commitsWithNoTickets) = gitrisk.checkCommitRange('HEAD', parsedArgs.commitHash)
-
-  gitrisk.outputResults(parsedArgs.commitHash, bugs, commitsWithNoTickets)
   return 0
 
+def _mainForRepository(aParsedArgs, aRepoPath):
+  # Standard input is read up front, so that it's still there if the daemon
+  # can't answer after all.
+  stdinLines = None
+  if aParsedArgs.hook or aParsedArgs.readStdin:
+    stdinLines = [line.strip() for line in sys.stdin if line.strip()]
+
+  if _canUseDaemon(aParsedArgs):
+    status = _mainWithDaemon(aParsedArgs, aRepoPath, stdinLines)
+    if status is not None:
+      return status
+
+  profiler = None
+  if aParsedArgs.profile:
+    profiler = PhaseProfiler()
+
+  cProfiler = None
+  if aParsedArgs.profileDump:
+    import cProfile
+    cProfiler = cProfile.Profile()
+    cProfiler.enable()
+
+  gitrisk = _createGitRisk(aParsedArgs, _getTicketSpec(aParsedArgs), aRepoPath, profiler)
+
+  # The worker pool and caches are shut down however the checks end, since a
+  # pre-receive hook carries on (see main()) even if they fail.
+  try:
+    if aParsedArgs.ticket:
+      ticket = gitrisk.getTicketName(aParsedArgs.ticket)
+      (commitShas, mergeShas, relatedTickets) = gitrisk.lookupTicket(ticket)
+      gitrisk.outputTicketLookup(ticket, commitShas, mergeShas, relatedTickets)
+      return 0
+
+    if aParsedArgs.hook:
+      refUpdates = [tuple(line.split()) for line in stdinLines]
+      commitHashes = gitrisk.getMergesInPush(refUpdates)
+    elif aParsedArgs.mergeRange:
+      commitHashes = gitrisk.getMergesInRange(aParsedArgs.mergeRange)
+    elif aParsedArgs.readStdin:
+      commitHashes = stdinLines
+    else:
+      commitHashes = [aParsedArgs.commitHash]
+
+    ticketSet = None
+    if aParsedArgs.ticketsFile:
+      ticketSet = gitrisk.getTicketSetFromFile(aParsedArgs.ticketsFile)
+
+    gitrisk.beginOutput()
+    checkedCount = 0
+    for result in gitrisk.checkCommits(commitHashes, asRecords=True, **_getCheckArgs(aParsedArgs)):
+      (commitHash, bugs, commitsWithNoTickets) = result
+      if ticketSet is not None:
+        bugs = gitrisk.getAtRiskTickets(bugs, ticketSet)
+      gitrisk.outputResults(commitHash, bugs, commitsWithNoTickets, result.truncatedBy, result.commitCount)
+      checkedCount = checkedCount + 1
+    gitrisk.endOutput()
+  finally:
+    gitrisk.close()
+
+  _reportUncheckedCommits(commitHashes[checkedCount:])
+
+  if cProfiler:
+    cProfiler.disable()
+    cProfiler.dump_stats(aParsedArgs.profileDump)
+
+  if profiler:
+    sys.stderr.write(profiler.formatSummary() + "\n")
+
+  return _reportCacheMismatches(gitrisk.getCacheMismatches())
+
 if __name__ == '__main__':
   exit(main())
@@ -0,0 +1,49 @@
+from collections import OrderedDict
+
+class LruCache:
+  # A dictionary holding at most mMaxEntries entries: once it's full, adding
+  # another drops the least recently used one. It supports just as much of the
+  # dictionary interface as the memos of GitRisk (and the daemon) use, so that a
+  # long-running process can bound their memory.
+  mMaxEntries = None
+  mEntries = None
+
+  def __init__(self, aMaxEntries):
+    self.mMaxEntries = max(1, int(aMaxEntries))
+    self.mEntries = OrderedDict()
+
+  def getMaxEntries(self):
+    return self.mMaxEntries
+
+  def get(self, aKey, aDefault=None):
+    value = self.mEntries.pop(aKey, _MISSING)
+    if value is _MISSING:
+      return aDefault
+
+    # Re-inserting the entry makes it the most recently used.
+    self.mEntries[aKey] = value
+    return value
+
+  def __getitem__(self, aKey):
+    value = self.get(aKey, _MISSING)
+    if value is _MISSING:
+      raise KeyError(aKey)
+
+    return value
+
+  def __setitem__(self, aKey, aValue):
+    self.mEntries.pop(aKey, None)
+    self.mEntries[aKey] = aValue
+    while len(self.mEntries) > self.mMaxEntries:
+      self.mEntries.popitem(last=False)
+
+  def __contains__(self, aKey):
+    return aKey in self.mEntries
+
+  def __len__(self):
+    return len(self.mEntries)
+
+  def clear(self):
+    self.mEntries.clear()
+
+_MISSING = object()
@@ -0,0 +1,127 @@
+from __future__ import absolute_import
+import json
+import sys
+
+from gitrisk.resultwriter import ResultWriter, OUTPUT_FORMAT_TEXT, OUTPUT_FORMAT_JSON
+
+class MultiRepoRisk:
+  # Checks the same commits (e.g. the merges between two release tags) in many
+  # repositories at once, taking each repository's GitRisk object from a
+  # RepoPool. Each repository uses its own git-risk configuration, and up to
+  # mThreads of them are analysed concurrently; most of the time is spent
+  # waiting on git processes, so threads are enough to keep them all busy.
+  mPool = None
+  mThreads = 4
+  mResultWriter = None
+
+  def __init__(self, aPool, threads=4, outputFormat=OUTPUT_FORMAT_TEXT, quiet=False):
+    self.mPool = aPool
+    self.mThreads = max(1, int(threads))
+    self.mResultWriter = ResultWriter(outputFormat, quiet)
+
+  def getPool(self):
+    return self.mPool
+
+  def iterRepoResults(self, aRepoPaths, aGetCommitHashes, ticketsFile=None, **aCheckArgs):
+    # Yields a (repoPath, records, error) tuple for each repository, in the
+    # order they were given, however many are analysed at once. aGetCommitHashes
+    # is called with each repository's GitRisk object to get the commits to
+    # check in it, and aCheckArgs are passed on to GitRisk.checkCommits. The
+    # records are those of GitRisk.getResultRecord, with the repository added.
+    # error is None, unless the repository couldn't be analysed (e.g. because
+    # the commits don't exist in it), in which case there are no records.
+    repoPaths = []
+    for repoPath in aRepoPaths:
+      if repoPath not in repoPaths:
+        repoPaths.append(repoPath)
+
+    def checkRepo(aRepoPath):
+      try:
+        with self.mPool.using(aRepoPath) as gitRisk:
+          ticketSet = None
+          if ticketsFile:
+            ticketSet = gitRisk.getTicketSetFromFile(ticketsFile)
+
+          records = []
+          for result in gitRisk.checkCommits(aGetCommitHashes(gitRisk), asRecords=True, **aCheckArgs):
+            (commitHash, tickets, recordsWithoutTickets) = result
+            if ticketSet is not None:
+              tickets = gitRisk.getAtRiskTickets(tickets, ticketSet)
+            record = gitRisk.getResultRecord(commitHash, tickets, recordsWithoutTickets,
+                                             result.truncatedBy, result.commitCount)
+            record['repository'] = aRepoPath
+            records.append(record)
+
+          return (aRepoPath, records, None)
+      except Exception as error:
+        return (aRepoPath, [], error.__class__.__name__ + ": " + str(error))
+
+    if self.mThreads == 1 or len(repoPaths) == 1:
+      for repoPath in repoPaths:
+        yield checkRepo(repoPath)
+      return
+
+    from multiprocessing.pool import ThreadPool
+    threadPool = ThreadPool(min(self.mThreads, len(repoPaths)))
+    try:
+      for repoResult in threadPool.imap(checkRepo, repoPaths):
+        yield repoResult
+    finally:
+      threadPool.terminate()
+      threadPool.join()
+
+  def outputRepoResults(self, aRepoResults):
+    # Writes the results of every repository, followed by the tickets at risk
+    # across all of them. In quiet (text) mode, only the latter are written.
+    # Returns the (repoPath, error) pairs of the repositories that couldn't be
+    # analysed, which are also reported on standard error.
+    writer = self.mResultWriter
+    tickets = {}
+    errors = []
+    repositories = []
+
+    if writer.getOutputFormat() != OUTPUT_FORMAT_JSON:
+      writer.begin()
+
+    for (repoPath, records, error) in aRepoResults:
+      if error is not None:
+        sys.stderr.write("git-risk: " + repoPath + ": " + error + "\n")
+        errors.append((repoPath, error))
+
+      for record in records:
+        for ticket in record['tickets']:
+          tickets.setdefault(ticket, set()).add(repoPath)
+
+        if writer.getOutputFormat() == OUTPUT_FORMAT_JSON:
+          continue
+        elif writer.getOutputFormat() != OUTPUT_FORMAT_TEXT or not writer.isInQuietMode():
+          writer.writeRecord(record)
+        elif record['truncated']:
+          sys.stderr.write("git-risk: " + repoPath + ": " + record['commit'] +
+                           ": the analysis was cut short by the --" + record['truncatedBy'] + " limit\n")
+
+      repository = {'repository': repoPath, 'results': records}
+      if error is not None:
+        repository['error'] = error
+      repositories.append(repository)
+
+    aggregatedTickets = [{'ticket': ticket, 'repositories': sorted(tickets[ticket])}
+                         for ticket in sorted(tickets)]
+    if writer.getOutputFormat() == OUTPUT_FORMAT_TEXT:
+      if writer.isInQuietMode():
+        for ticket in aggregatedTickets:
+          print(ticket['ticket'])
+      else:
+        print("\nTickets potentially affected across all repositories:\n")
+        for ticket in aggregatedTickets:
+          print(ticket['ticket'] + " (" + ", ".join(ticket['repositories']) + ")")
+    elif writer.getOutputFormat() == OUTPUT_FORMAT_JSON:
+      # A single JSON document can't be written as results arrive, since the
+      # tickets across all repositories are only known at the end.
+      sys.stdout.write(json.dumps({'repositories': repositories, 'tickets': aggregatedTickets},
+                                  sort_keys=True) + "\n")
+      sys.stdout.flush()
+    else:
+      writer.writeJsonRecord({'tickets': aggregatedTickets})
+
+    return errors
@@ -0,0 +1,443 @@
+import binascii
+import codecs
+import mmap
+import os
+import os.path
+import struct
+import zlib
+
+# Where commit messages are read from: through `git log` (the default), or
+# straight out of the object store by an ObjectReader.
+OBJECT_BACKEND_GIT = 'git'
+OBJECT_BACKEND_MMAP = 'mmap'
+OBJECT_BACKENDS = [OBJECT_BACKEND_GIT, OBJECT_BACKEND_MMAP]
+
+# Layout of pack index (version 2) and pack files, see
+# Documentation/gitformat-pack.txt in the git sources.
+_IDX_SIGNATURE = b'\377tOc'
+_IDX_VERSION = 2
+_IDX_HEADER_LENGTH = 8
+_IDX_FANOUT_LENGTH = 256 * 4
+_IDX_LARGE_OFFSET = 0x80000000
+_PACK_SIGNATURE = b'PACK'
+_HASH_LENGTH = 20
+
+_OBJ_COMMIT = 1
+_OBJ_OFS_DELTA = 6
+_OBJ_REF_DELTA = 7
+
+# Compressed data is fed to zlib in pieces of at most this size, since its
+# length isn't recorded anywhere.
+_INFLATE_CHUNK_SIZE = 4096
+
+class _ObjectFormatError(Exception):
+  pass
+
+def _inflate(aData, aOffset, aSize):
+  # Inflates aSize bytes from the zlib stream starting at aOffset in aData (a
+  # mapped pack file).
+  decompressor = zlib.decompressobj()
+  pieces = []
+  length = 0
+  offset = aOffset
+  # Compressed data is hardly ever much larger than the data itself, so the
+  # first piece usually holds all of it.
+  chunkSize = min(aSize + 64, _INFLATE_CHUNK_SIZE)
+  while length < aSize:
+    chunk = aData[offset:offset + chunkSize]
+    chunkSize = _INFLATE_CHUNK_SIZE
+    if not chunk or decompressor.unused_data:
+      raise _ObjectFormatError("truncated object at offset " + str(aOffset))
+    offset = offset + len(chunk)
+
+    piece = decompressor.decompress(chunk, aSize - length)
+    pieces.append(piece)
+    length = length + len(piece)
+
+  return b''.join(pieces)
+
+def _readDeltaSize(aDelta, aOffset):
+  size = 0
+  shift = 0
+  while True:
+    byte = aDelta[aOffset]
+    aOffset = aOffset + 1
+    size = size | ((byte & 0x7f) << shift)
+    shift = shift + 7
+    if not byte & 0x80:
+      return (size, aOffset)
+
+def _applyDelta(aBase, aDelta):
+  # Rebuilds an object from its base and a delta, a series of instructions to
+  # either copy a range of the base or insert literal data.
+  delta = bytearray(aDelta)
+  (baseSize, offset) = _readDeltaSize(delta, 0)
+  (resultSize, offset) = _readDeltaSize(delta, offset)
+  if baseSize != len(aBase):
+    raise _ObjectFormatError("delta base has the wrong size")
+
+  pieces = []
+  while offset < len(delta):
+    opcode = delta[offset]
+    offset = offset + 1
+    if opcode & 0x80:
+      copyOffset = 0
+      for (bit, shift) in ((0x01, 0), (0x02, 8), (0x04, 16), (0x08, 24)):
+        if opcode & bit:
+          copyOffset = copyOffset | (delta[offset] << shift)
+          offset = offset + 1
+
+      copySize = 0
+      for (bit, shift) in ((0x10, 0), (0x20, 8), (0x40, 16)):
+        if opcode & bit:
+          copySize = copySize | (delta[offset] << shift)
+          offset = offset + 1
+
+      if copySize == 0:
+        copySize = 0x10000
+      pieces.append(aBase[copyOffset:copyOffset + copySize])
+    elif opcode:
+      pieces.append(bytes(delta[offset:offset + opcode]))
+      offset = offset + opcode
+    else:
+      raise _ObjectFormatError("invalid delta opcode")
+
+  result = b''.join(pieces)
+  if len(result) != resultSize:
+    raise _ObjectFormatError("delta produced the wrong size")
+
+  return result
+
+def _parseCommit(aData):
+  # Returns the number of parents and the message of a raw commit, with the
+  # message decoded as `git log` would re-encode it.
+  headerEnd = aData.find(b'\n\n')
+  if headerEnd < 0:
+    (header, message) = (aData, b'')
+  else:
+    (header, message) = (aData[:headerEnd], aData[headerEnd + 2:])
+
+  parentCount = 0
+  encoding = 'utf-8'
+  for line in header.split(b'\n'):
+    if line.startswith(b'parent '):
+      parentCount = parentCount + 1
+    elif line.startswith(b'encoding '):
+      encoding = line[len(b'encoding '):].decode('ascii', 'replace')
+
+  try:
+    codecs.lookup(encoding)
+  except LookupError:
+    encoding = 'utf-8'
+
+  return (parentCount, message.decode(encoding, 'replace'))
+
+def hasReplacedObjects(aGitDir):
+  # Whether `git replace` (or a grafts file) changes what git shows for some
+  # objects. An ObjectReader only sees the objects as they're stored.
+  if os.path.exists(os.path.join(aGitDir, 'info', 'grafts')):
+    return True
+
+  for (root, dirs, files) in os.walk(os.path.join(aGitDir, 'refs', 'replace')):
+    if files:
+      return True
+
+  packedRefsPath = os.path.join(aGitDir, 'packed-refs')
+  if os.path.exists(packedRefsPath):
+    with open(packedRefsPath, 'rb') as packedRefs:
+      for line in packedRefs:
+        if b' refs/replace/' in line:
+          return True
+
+  return False
+
+class _Pack:
+  # A pack file and its index, both mapped into memory. Lookups read the index
+  # in place, and only the (compressed) bytes of the objects asked for are read
+  # from the pack.
+  mIdxPath = None
+  mIdxData = None
+  mPackData = None
+  mFanout = None
+  mShaTableOffset = 0
+  mOffsetTableOffset = 0
+  mLargeOffsetTableOffset = 0
+
+  def __init__(self, aIdxPath, aPackPath):
+    self.mIdxPath = aIdxPath
+    self.mIdxData = self._map(aIdxPath)
+    try:
+      self.mPackData = self._map(aPackPath)
+      if (self.mIdxData[:4] != _IDX_SIGNATURE or
+          struct.unpack_from('>I', self.mIdxData, 4)[0] != _IDX_VERSION):
+        raise _ObjectFormatError("unsupported pack index version: " + aIdxPath)
+      if self.mPackData[:4] != _PACK_SIGNATURE:
+        raise _ObjectFormatError("not a pack file: " + aPackPath)
+    except Exception:
+      self.close()
+      raise
+
+    self.mFanout = struct.unpack_from('>256I', self.mIdxData, _IDX_HEADER_LENGTH)
+    count = self.mFanout[255]
+    self.mShaTableOffset = _IDX_HEADER_LENGTH + _IDX_FANOUT_LENGTH
+    self.mOffsetTableOffset = self.mShaTableOffset + count * (_HASH_LENGTH + 4)
+    self.mLargeOffsetTableOffset = self.mOffsetTableOffset + count * 4
+
+  def _map(self, aPath):
+    with open(aPath, 'rb') as mappedFile:
+      return mmap.mmap(mappedFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+  def getIdxPath(self):
+    return self.mIdxPath
+
+  def findOffset(self, aBinSha):
+    # Returns the offset of an object in the pack, or None if it isn't in it.
+    firstByte = struct.unpack_from('B', aBinSha)[0]
+    low = 0
+    if firstByte:
+      low = self.mFanout[firstByte - 1]
+    high = self.mFanout[firstByte]
+
+    while low < high:
+      middle = (low + high) // 2
+      shaOffset = self.mShaTableOffset + middle * _HASH_LENGTH
+      middleSha = self.mIdxData[shaOffset:shaOffset + _HASH_LENGTH]
+      if middleSha < aBinSha:
+        low = middle + 1
+      elif middleSha > aBinSha:
+        high = middle
+      else:
+        offset = struct.unpack_from('>I', self.mIdxData, self.mOffsetTableOffset + middle * 4)[0]
+        if offset & _IDX_LARGE_OFFSET:
+          offset = struct.unpack_from('>Q', self.mIdxData,
+                                      self.mLargeOffsetTableOffset + (offset & ~_IDX_LARGE_OFFSET) * 8)[0]
+        return offset
+
+    return None
+
+  def readCommit(self, aOffset, aReader):
+    # Returns the data of the commit at aOffset, applying any deltas, or None if
+    # the object isn't a commit. The chain of deltas is followed to its base
+    # (which has the type of the object) before anything is inflated. Objects
+    # stored as deltas against another object (by SHA) are looked up through
+    # aReader, since that object could be anywhere.
+    deltas = []
+    offset = aOffset
+    while True:
+      (objectType, size, dataOffset) = self._readEntryHeader(offset)
+      if objectType == _OBJ_OFS_DELTA:
+        (baseDistance, dataOffset) = self._readBaseDistance(dataOffset)
+        deltas.append((dataOffset, size))
+        offset = offset - baseDistance
+      elif objectType == _OBJ_REF_DELTA:
+        baseSha = self.mPackData[dataOffset:dataOffset + _HASH_LENGTH]
+        deltas.append((dataOffset + _HASH_LENGTH, size))
+        offset = self.findOffset(baseSha)
+        if offset is None:
+          data = aReader._readCommitData(baseSha)
+          break
+      elif objectType == _OBJ_COMMIT:
+        data = _inflate(self.mPackData, dataOffset, size)
+        break
+      else:
+        return None
+
+    if data is None:
+      return None
+
+    for (dataOffset, size) in reversed(deltas):
+      data = _applyDelta(data, _inflate(self.mPackData, dataOffset, size))
+
+    return data
+
+  def _readEntryHeader(self, aOffset):
+    # Each entry starts with its type and inflated size, as a variable length
+    # integer.
+    byte = struct.unpack_from('B', self.mPackData, aOffset)[0]
+    offset = aOffset + 1
+    objectType = (byte >> 4) & 0x07
+    size = byte & 0x0f
+    shift = 4
+    while byte & 0x80:
+      byte = struct.unpack_from('B', self.mPackData, offset)[0]
+      offset = offset + 1
+      size = size | ((byte & 0x7f) << shift)
+      shift = shift + 7
+
+    return (objectType, size, offset)
+
+  def _readBaseDistance(self, aOffset):
+    byte = struct.unpack_from('B', self.mPackData, aOffset)[0]
+    offset = aOffset + 1
+    distance = byte & 0x7f
+    while byte & 0x80:
+      byte = struct.unpack_from('B', self.mPackData, offset)[0]
+      offset = offset + 1
+      distance = ((distance + 1) << 7) | (byte & 0x7f)
+
+    return (distance, offset)
+
+  def close(self):
+    if self.mIdxData is not None:
+      self.mIdxData.close()
+      self.mIdxData = None
+    if self.mPackData is not None:
+      self.mPackData.close()
+      self.mPackData = None
+
+class ObjectReader:
+  # Reads commits straight out of a repository's object store, rather than
+  # asking git for them: pack files and their indexes are mapped into memory,
+  # and loose objects are read from their files. Only commits are ever
+  # inflated; anything else (and anything that can't be read, e.g. from a pack
+  # with an index format this doesn't know) gives None, for the caller to read
+  # through git instead.
+  mObjectDirs = None
+  mPacks = None
+  mPackDirStamp = None
+
+  def __init__(self, aObjectDir):
+    self.mObjectDirs = self._getObjectDirs(aObjectDir)
+    self.mPacks = []
+    self._refreshPacks()
+
+  @classmethod
+  def openForRepo(cls, aRepo):
+    return cls(os.path.join(aRepo.common_dir, 'objects'))
+
+  def _getObjectDirs(self, aObjectDir):
+    # The repository's own objects, followed by those of its alternates.
+    objectDirs = [aObjectDir]
+    pending = [aObjectDir]
+    while pending:
+      alternatesPath = os.path.join(pending.pop(0), 'info', 'alternates')
+      if not os.path.exists(alternatesPath):
+        continue
+
+      with open(alternatesPath) as alternates:
+        for line in alternates:
+          line = line.strip()
+          if not line or line.startswith('#'):
+            continue
+
+          alternateDir = os.path.normpath(os.path.join(os.path.dirname(os.path.dirname(alternatesPath)), line))
+          if alternateDir not in objectDirs and os.path.isdir(alternateDir):
+            objectDirs.append(alternateDir)
+            pending.append(alternateDir)
+
+    return objectDirs
+
+  def _getPackDirStamp(self):
+    # The modification times of the pack directories, which change whenever a
+    # pack is added or removed.
+    stamp = []
+    for objectDir in self.mObjectDirs:
+      try:
+        stamp.append(os.stat(os.path.join(objectDir, 'pack')).st_mtime)
+      except OSError:
+        stamp.append(None)
+
+    return tuple(stamp)
+
+  def _refreshPacks(self):
+    # Picks up packs written since the last refresh (e.g. by a fetch or gc), and
+    # lets go of those that have been deleted. The directories are stamped
+    # before they're listed, so that anything changing while they are is picked
+    # up by the next refresh.
+    self.mPackDirStamp = self._getPackDirStamp()
+    packs = dict((pack.getIdxPath(), pack) for pack in self.mPacks)
+    self.mPacks = []
+    for objectDir in self.mObjectDirs:
+      packDir = os.path.join(objectDir, 'pack')
+      if not os.path.isdir(packDir):
+        continue
+
+      for name in sorted(os.listdir(packDir)):
+        if not name.endswith('.idx'):
+          continue
+
+        idxPath = os.path.join(packDir, name)
+        pack = packs.pop(idxPath, None)
+        if pack is None:
+          packPath = idxPath[:-len('.idx')] + '.pack'
+          try:
+            pack = _Pack(idxPath, packPath)
+          except (_ObjectFormatError, EnvironmentError, ValueError, struct.error):
+            continue
+        self.mPacks.append(pack)
+
+    for pack in packs.values():
+      pack.close()
+
+  def readCommit(self, aBinSha):
+    # Returns the (parentCount, message) of a commit, or None if it can't be
+    # read here.
+    try:
+      data = self._readCommitData(aBinSha)
+    except (_ObjectFormatError, zlib.error, struct.error, IndexError, EnvironmentError):
+      return None
+
+    if data is None:
+      return None
+
+    return _parseCommit(data)
+
+  def _readCommitData(self, aBinSha):
+    location = self._find(aBinSha)
+    if location is None:
+      return None
+
+    (pack, offset) = location
+    if pack is None:
+      return self._readLooseCommit(offset)
+
+    return pack.readCommit(offset, self)
+
+  def _find(self, aBinSha):
+    # Returns (pack, offset) for a packed object, (None, path) for a loose one,
+    # or None if the object can't be found.
+    for attempt in range(2):
+      for pack in self.mPacks:
+        offset = pack.findOffset(aBinSha)
+        if offset is not None:
+          return (pack, offset)
+
+      hexSha = binascii.hexlify(aBinSha).decode('ascii')
+      for objectDir in self.mObjectDirs:
+        loosePath = os.path.join(objectDir, hexSha[:2], hexSha[2:])
+        if os.path.exists(loosePath):
+          return (None, loosePath)
+
+      # The object may have been packed since the packs were last looked at,
+      # but only if a pack directory has changed since then; anything else
+      # (e.g. an object that's simply not there) costs a few stat calls rather
+      # than listing the directories again.
+      if attempt > 0 or self._getPackDirStamp() == self.mPackDirStamp:
+        break
+
+      self._refreshPacks()
+
+    return None
+
+  def _readLooseCommit(self, aPath):
+    # The header ("<type> <size>\0") is at the start of the inflated object, so
+    # only the first few bytes are inflated until it's known to be a commit.
+    with open(aPath, 'rb') as looseFile:
+      compressedData = looseFile.read()
+
+    decompressor = zlib.decompressobj()
+    header = decompressor.decompress(compressedData, 32)
+    if not header.startswith(b'commit '):
+      return None
+
+    data = header + decompressor.decompress(decompressor.unconsumed_tail) + decompressor.flush()
+    headerEnd = data.find(b'\0')
+    if headerEnd < 0:
+      raise _ObjectFormatError("malformed object: " + aPath)
+
+    return data[headerEnd + 1:]
+
+  def close(self):
+    for pack in self.mPacks:
+      pack.close()
+    self.mPacks = []
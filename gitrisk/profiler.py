@@ -0,0 +1,169 @@
+import time
+from collections import namedtuple
+
+PHASE_CONFIG = 'config'
+PHASE_GRAPH = 'graph'
+PHASE_MERGE_BASE = 'mergeBase'
+PHASE_WALK = 'walk'
+PHASE_EXTRACT = 'extract'
+PHASE_OUTPUT = 'output'
+
+# The order in which phases are listed in the summary.
+PHASES = [PHASE_CONFIG, PHASE_GRAPH, PHASE_MERGE_BASE, PHASE_WALK, PHASE_EXTRACT, PHASE_OUTPUT]
+
+# What is passed to the profiler's callback each time a phase finishes. wallTime
+# is in seconds, and (like subprocesses and commits) excludes anything done by
+# phases nested inside this one.
+PhaseTiming = namedtuple('PhaseTiming', ['phase', 'wallTime', 'subprocesses', 'commits'])
+
+class _PhaseRun:
+  mPhase = None
+  mWallTime = 0.0
+  mSubprocesses = 0
+  mCommits = 0
+  mStartTime = 0.0
+  mChildTime = 0.0
+
+  def __init__(self, aPhase):
+    self.mPhase = aPhase
+
+class _PhaseContext:
+  mProfiler = None
+  mRun = None
+
+  def __init__(self, aProfiler, aPhase):
+    self.mProfiler = aProfiler
+    self.mRun = _PhaseRun(aPhase)
+
+  def __enter__(self):
+    self.mProfiler._push(self.mRun)
+    return self.mProfiler
+
+  def __exit__(self, aType, aValue, aTraceback):
+    self.mProfiler._pop(self.mRun)
+    self.mProfiler._finish(self.mRun)
+    return False
+
+class PhaseProfiler:
+  mCallback = None
+  mStack = None
+  mTotals = None
+  mStartTime = 0.0
+  mSubprocesses = 0
+
+  def __init__(self, callback=None):
+    # callback, if given, is called with a PhaseTiming every time a phase
+    # finishes, e.g. to forward the numbers to a metrics system.
+    self.mCallback = callback
+    self.mStack = []
+    self.mTotals = {}
+    self.mStartTime = time.time()
+    self.mSubprocesses = 0
+
+  def phase(self, aPhase):
+    # Returns a context manager that attributes everything done inside it to
+    # aPhase (less whatever is attributed to nested phases).
+    return _PhaseContext(self, aPhase)
+
+  def iterPhase(self, aPhase, aIterable):
+    # Attributes the work done producing each item of aIterable to aPhase, and
+    # counts every item as one commit processed. The phase is reported once,
+    # when the iterable is exhausted (or abandoned).
+    run = _PhaseRun(aPhase)
+    iterator = iter(aIterable)
+    try:
+      while True:
+        self._push(run)
+        try:
+          item = next(iterator)
+        except StopIteration:
+          return
+        finally:
+          self._pop(run)
+
+        run.mCommits = run.mCommits + 1
+        yield item
+    finally:
+      self._finish(run)
+
+  def addCommits(self, aCount):
+    if self.mStack:
+      self.mStack[-1].mCommits = self.mStack[-1].mCommits + aCount
+
+  def addSubprocess(self):
+    self.mSubprocesses = self.mSubprocesses + 1
+    if self.mStack:
+      self.mStack[-1].mSubprocesses = self.mStack[-1].mSubprocesses + 1
+
+  def instrumentRepo(self, aRepo):
+    # Every git command GitPython runs (including the persistent cat-file
+    # processes it reads objects through) is started by Git.execute, so
+    # overriding it on this repository's Git object counts them all. Git uses
+    # __slots__, so rather than setting an attribute, the object's class is
+    # swapped for a subclass with the same (empty) layout.
+    profiler = self
+    gitClass = type(aRepo.git)
+
+    class CountingGit(gitClass):
+      __slots__ = ()
+
+      def execute(self, *aArgs, **aKwargs):
+        profiler.addSubprocess()
+        return gitClass.execute(self, *aArgs, **aKwargs)
+
+    aRepo.git.__class__ = CountingGit
+
+  def _push(self, aRun):
+    aRun.mStartTime = time.time()
+    aRun.mChildTime = 0.0
+    self.mStack.append(aRun)
+
+  def _pop(self, aRun):
+    elapsed = time.time() - aRun.mStartTime
+    self.mStack.pop()
+    aRun.mWallTime = aRun.mWallTime + elapsed - aRun.mChildTime
+    if self.mStack:
+      self.mStack[-1].mChildTime = self.mStack[-1].mChildTime + elapsed
+
+  def _finish(self, aRun):
+    (calls, wallTime, subprocesses, commits) = self.mTotals.get(aRun.mPhase, (0, 0.0, 0, 0))
+    self.mTotals[aRun.mPhase] = (calls + 1, wallTime + aRun.mWallTime,
+                                 subprocesses + aRun.mSubprocesses, commits + aRun.mCommits)
+    if self.mCallback:
+      self.mCallback(PhaseTiming(aRun.mPhase, aRun.mWallTime, aRun.mSubprocesses, aRun.mCommits))
+
+  def getTotals(self):
+    # Returns a dictionary of phase -> (calls, wallTime, subprocesses, commits)
+    # for every phase that has finished at least once.
+    return dict(self.mTotals)
+
+  def getElapsedTime(self):
+    return time.time() - self.mStartTime
+
+  def getSubprocessCount(self):
+    return self.mSubprocesses
+
+  def formatSummary(self):
+    phases = [phase for phase in PHASES if phase in self.mTotals]
+    phases.extend(sorted(phase for phase in self.mTotals if phase not in PHASES))
+
+    lines = ["%-12s %8s %10s %13s %10s" % ('phase', 'calls', 'wall (s)', 'subprocesses', 'commits')]
+    for phase in phases:
+      (calls, wallTime, subprocesses, commits) = self.mTotals[phase]
+      lines.append("%-12s %8d %10.4f %13d %10d" % (phase, calls, wallTime, subprocesses, commits))
+
+    # Whatever wasn't done inside any phase (e.g. resolving the commits given
+    # on the command line) is only included in the total.
+    lines.append("%-12s %8s %10.4f %13d %10s" % ('total', '', self.getElapsedTime(),
+                                                 self.mSubprocesses, ''))
+    return "\n".join(lines)
+
+class _NullPhaseContext:
+  def __enter__(self):
+    return None
+
+  def __exit__(self, aType, aValue, aTraceback):
+    return False
+
+# Used in place of a phase when nothing is being profiled.
+NULL_PHASE = _NullPhaseContext()
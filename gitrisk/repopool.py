@@ -0,0 +1,88 @@
+from __future__ import absolute_import
+import os.path
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+class RepoPool:
+  # A bounded set of open repositories, for analysing many of them in one run.
+  # Each one is held as a GitRisk object, so that its Repo (along with the
+  # persistent `git cat-file --batch` processes GitPython reads objects
+  # through), commit graph and extracted tickets are kept between uses. Once
+  # mMaxOpen repositories are open, the least recently used one that isn't in
+  # use is closed to make room for the next.
+  #
+  # A GitRisk object is only ever handed to one thread at a time: anyone else
+  # acquiring the same repository waits until it's released.
+  mFactory = None
+  mMaxOpen = 8
+  mEntries = None
+  mInUse = None
+  mCondition = None
+
+  def __init__(self, aFactory, maxOpen=8):
+    # aFactory is called with the path of a repository to create its GitRisk
+    # object.
+    self.mFactory = aFactory
+    self.mMaxOpen = max(1, int(maxOpen))
+
+    # Repository path -> GitRisk object, least recently used first.
+    self.mEntries = OrderedDict()
+    self.mInUse = set()
+    self.mCondition = threading.Condition()
+
+  def getMaxOpen(self):
+    return self.mMaxOpen
+
+  def getOpenRepoPaths(self):
+    with self.mCondition:
+      return list(self.mEntries)
+
+  def acquire(self, aRepoPath):
+    repoPath = os.path.abspath(aRepoPath)
+    with self.mCondition:
+      while True:
+        if repoPath in self.mInUse:
+          self.mCondition.wait()
+          continue
+
+        gitRisk = self.mEntries.pop(repoPath, None)
+        if gitRisk is None and len(self.mEntries) >= self.mMaxOpen:
+          if not self._evictOne():
+            self.mCondition.wait()
+            continue
+
+        if gitRisk is None:
+          gitRisk = self.mFactory(repoPath)
+
+        self.mEntries[repoPath] = gitRisk
+        self.mInUse.add(repoPath)
+        return gitRisk
+
+  def release(self, aRepoPath):
+    with self.mCondition:
+      self.mInUse.discard(os.path.abspath(aRepoPath))
+      self.mCondition.notify_all()
+
+  @contextmanager
+  def using(self, aRepoPath):
+    gitRisk = self.acquire(aRepoPath)
+    try:
+      yield gitRisk
+    finally:
+      self.release(aRepoPath)
+
+  def _evictOne(self):
+    for (repoPath, gitRisk) in self.mEntries.items():
+      if repoPath not in self.mInUse:
+        del self.mEntries[repoPath]
+        gitRisk.close()
+        return True
+
+    return False
+
+  def close(self):
+    with self.mCondition:
+      for gitRisk in self.mEntries.values():
+        gitRisk.close()
+      self.mEntries.clear()
@@ -0,0 +1,190 @@
+from __future__ import absolute_import
+import binascii
+import json
+import os
+import os.path
+
+from gitrisk.commitrecord import CommitRecord
+from gitrisk.lrucache import LruCache
+from gitrisk.riskresult import RiskResult
+from gitrisk.ticketcache import getCacheDirectory, getConfigFingerprint, CACHE_MODE_USE, CACHE_MODE_WARM, \
+                                CACHE_MODE_VERIFY, CACHE_MODE_BYPASS
+
+# How many results are kept in memory, and stored on disk, by default.
+RESULT_CACHE_SIZE = 1024
+RESULT_STORE_SIZE = 100000
+
+def _encodeKey(aKey):
+  return u' '.join(str(part) for part in aKey)
+
+class ResultStore:
+  # The persistent layer of a ResultCache, in .git/gitrisk/results.sqlite. Like
+  # the TicketCache's, its entries are keyed by the fingerprint of the ticket
+  # configuration they were worked out with, as well as by the key of the
+  # check, so that processes with different configurations can share it.
+  # At most mMaxEntries results are kept, whatever their configuration; the
+  # oldest stored are dropped first.
+  mPath = None
+  mFingerprint = None
+  mMaxEntries = RESULT_STORE_SIZE
+  mConnection = None
+
+  def __init__(self, aPath, aFingerprint, maxEntries=RESULT_STORE_SIZE):
+    # sqlite3 is only imported when the store is actually used, to keep it off
+    # the startup path of git-risk.
+    import sqlite3
+
+    self.mPath = aPath
+    self.mFingerprint = aFingerprint
+    self.mMaxEntries = max(1, int(maxEntries))
+
+    storeDir = os.path.dirname(aPath)
+    if not os.path.isdir(storeDir):
+      os.makedirs(storeDir)
+
+    # GitRisk objects can be handed from one thread to another (see RepoPool),
+    # though never used by two at once, so the connection isn't tied to the
+    # thread that opened it.
+    self.mConnection = sqlite3.connect(aPath, timeout=30, check_same_thread=False)
+
+    # Stores written with any other layout (such as those from before results
+    # were keyed by fingerprint, which can't tell which configuration their
+    # results came from) are started over.
+    columns = [column[1] for column in self.mConnection.execute('PRAGMA table_info(results)')]
+    if columns and columns != ['fingerprint', 'key', 'tickets', 'without_tickets', 'commit_count']:
+      self.mConnection.execute('DROP TABLE results')
+      self.mConnection.execute('DROP TABLE IF EXISTS meta')
+
+    self.mConnection.execute('CREATE TABLE IF NOT EXISTS results '
+                             '(fingerprint TEXT NOT NULL, key TEXT NOT NULL, tickets TEXT NOT NULL, '
+                             'without_tickets TEXT NOT NULL, commit_count INTEGER NOT NULL, '
+                             'PRIMARY KEY (fingerprint, key))')
+    self.mConnection.commit()
+
+  @classmethod
+  def openForRepo(cls, aRepo, aTicketRegexes, aRegexGroup, maxEntries=RESULT_STORE_SIZE):
+    path = os.path.join(getCacheDirectory(aRepo), 'results.sqlite')
+    return cls(path, getConfigFingerprint(aTicketRegexes, aRegexGroup), maxEntries)
+
+  def getPath(self):
+    return self.mPath
+
+  def getResult(self, aKey):
+    row = self.mConnection.execute('SELECT tickets, without_tickets, commit_count FROM results '
+                                   'WHERE fingerprint = ? AND key = ?',
+                                   (self.mFingerprint, _encodeKey(aKey))).fetchone()
+    if not row:
+      return None
+
+    (tickets, withoutTickets, commitCount) = row
+    records = set(CommitRecord(binascii.unhexlify(commitSha), False, None)
+                  for commitSha in json.loads(withoutTickets))
+    return RiskResult((set(json.loads(tickets)), records), None, commitCount)
+
+  def putResult(self, aKey, aResult):
+    (tickets, recordsWithoutTickets) = aResult
+    self.mConnection.execute('INSERT OR REPLACE INTO results '
+                             '(fingerprint, key, tickets, without_tickets, commit_count) '
+                             'VALUES (?, ?, ?, ?, ?)',
+                             (self.mFingerprint, _encodeKey(aKey), json.dumps(sorted(tickets)),
+                              json.dumps(sorted(record.hexsha for record in recordsWithoutTickets)),
+                              aResult.commitCount))
+    self.mConnection.execute('DELETE FROM results WHERE rowid IN '
+                             '(SELECT rowid FROM results ORDER BY rowid LIMIT '
+                             'max(0, (SELECT COUNT(*) FROM results) - ?))', (self.mMaxEntries,))
+    self.mConnection.commit()
+
+  def getEntryCount(self):
+    # The number of results for this store's ticket configuration.
+    return self.mConnection.execute('SELECT COUNT(*) FROM results WHERE fingerprint = ?',
+                                    (self.mFingerprint,)).fetchone()[0]
+
+  def close(self):
+    if self.mConnection:
+      self.mConnection.close()
+      self.mConnection = None
+
+class ResultCache:
+  # The results of checking merges and ranges (see GitRisk.checkMerge), by the
+  # SHAs they were resolved to. A merge's suspect commits, and the tickets they
+  # reference, can never change, so neither can its result, as long as the
+  # ticket configuration doesn't; a GitRisk object's configuration never does.
+  # Only complete results are kept, i.e. those that weren't cut short by any
+  # limit (see WalkLimits), since which commits a bounded check gets to depends
+  # on the order the history is walked in.
+  #
+  # The most recently used results are kept in memory, and, unless the cache
+  # mode (see TicketCache) is bypass, in a ResultStore as well, which is used
+  # the same way as the ticket cache: read and written in use mode, only
+  # written in warm mode and only compared against in verify mode.
+  mMemory = None
+  mStore = None
+  mCacheMode = CACHE_MODE_BYPASS
+  mHitCount = 0
+  mMissCount = 0
+
+  def __init__(self, maxEntries=RESULT_CACHE_SIZE, store=None, cacheMode=CACHE_MODE_BYPASS):
+    self.mMemory = LruCache(maxEntries)
+    self.mStore = store
+    self.mCacheMode = cacheMode
+    self.mHitCount = 0
+    self.mMissCount = 0
+
+  def getStore(self):
+    return self.mStore
+
+  def getHitCount(self):
+    return self.mHitCount
+
+  def getMissCount(self):
+    return self.mMissCount
+
+  def getEntryCount(self):
+    return len(self.mMemory)
+
+  def get(self, aKey, maxCommitCount=None):
+    # Returns the result for aKey, or None if it has to be worked out (and then
+    # given to put). A result of more than maxCommitCount suspect commits
+    # isn't what a check bounded to that many would give, so it isn't returned.
+    result = self.mMemory.get(aKey)
+    if result is None and self.mStore and self.mCacheMode == CACHE_MODE_USE:
+      result = self.mStore.getResult(aKey)
+      if result is not None:
+        self.mMemory[aKey] = result
+
+    if result is None or (maxCommitCount is not None and result.commitCount > maxCommitCount):
+      self.mMissCount = self.mMissCount + 1
+      return None
+
+    self.mHitCount = self.mHitCount + 1
+    return self._copy(result)
+
+  def put(self, aKey, aResult):
+    # Keeps a result, unless it's incomplete. In verify mode, returns the stored
+    # result if it differs, and None otherwise.
+    if aResult.truncated:
+      return None
+
+    self.mMemory[aKey] = self._copy(aResult)
+    if not self.mStore:
+      return None
+
+    if self.mCacheMode in (CACHE_MODE_USE, CACHE_MODE_WARM):
+      self.mStore.putResult(aKey, aResult)
+    elif self.mCacheMode == CACHE_MODE_VERIFY:
+      storedResult = self.mStore.getResult(aKey)
+      if storedResult is not None and (tuple(storedResult) != tuple(aResult) or
+                                       storedResult.commitCount != aResult.commitCount):
+        return storedResult
+
+    return None
+
+  def _copy(self, aResult):
+    # Callers are free to change the sets they're given.
+    (tickets, recordsWithoutTickets) = aResult
+    return RiskResult((set(tickets), set(recordsWithoutTickets)), aResult.truncatedBy, aResult.commitCount)
+
+  def close(self):
+    if self.mStore:
+      self.mStore.close()
+      self.mStore = None
@@ -0,0 +1,93 @@
+import json
+import sys
+
+OUTPUT_FORMAT_TEXT = 'text'
+OUTPUT_FORMAT_JSON = 'json'
+OUTPUT_FORMAT_NDJSON = 'ndjson'
+OUTPUT_FORMATS = [OUTPUT_FORMAT_TEXT, OUTPUT_FORMAT_JSON, OUTPUT_FORMAT_NDJSON]
+
+class ResultWriter:
+  # Writes result records (see GitRisk.getResultRecord) to standard output, as
+  # human readable text, a single JSON array or one JSON object per line.
+  mOutputFormat = OUTPUT_FORMAT_TEXT
+  mQuietMode = False
+  mOutputCount = 0
+
+  def __init__(self, aOutputFormat=OUTPUT_FORMAT_TEXT, aQuiet=False):
+    assert aOutputFormat in OUTPUT_FORMATS, "unknown output format: " + str(aOutputFormat)
+    self.mOutputFormat = aOutputFormat
+    self.mQuietMode = aQuiet
+
+  def getOutputFormat(self):
+    return self.mOutputFormat
+
+  def isInQuietMode(self):
+    return self.mQuietMode
+
+  def setInQuietMode(self, aQuiet):
+    self.mQuietMode = aQuiet
+
+  def needsSummaries(self):
+    # Whether records need the one line summaries of their commits.
+    return self.mOutputFormat != OUTPUT_FORMAT_TEXT or not self.mQuietMode
+
+  def begin(self):
+    self.mOutputCount = 0
+    if self.mOutputFormat == OUTPUT_FORMAT_JSON:
+      sys.stdout.write("[")
+
+  def end(self):
+    if self.mOutputFormat == OUTPUT_FORMAT_JSON:
+      if self.mOutputCount > 0:
+        sys.stdout.write("\n")
+      sys.stdout.write("]\n")
+      sys.stdout.flush()
+
+  def writeRecord(self, aRecord):
+    if self.mOutputFormat == OUTPUT_FORMAT_TEXT:
+      self._writeTextRecord(aRecord)
+    else:
+      self.writeJsonRecord(aRecord)
+
+    self.mOutputCount = self.mOutputCount + 1
+
+  def writeJsonRecord(self, aRecord):
+    # Records are written (and flushed) as soon as they're produced, so that
+    # consumers can process the results of a long batch run as they arrive.
+    if self.mOutputFormat == OUTPUT_FORMAT_JSON:
+      if self.mOutputCount > 0:
+        sys.stdout.write(",")
+      sys.stdout.write("\n" + json.dumps(aRecord, sort_keys=True))
+    else:
+      sys.stdout.write(json.dumps(aRecord, sort_keys=True) + "\n")
+    sys.stdout.flush()
+
+  def _writeTextRecord(self, aRecord):
+    if not self.mQuietMode:
+      if self.mOutputCount > 0:
+        print("")
+      print("Tickets potentially affected by:")
+      if 'repository' in aRecord:
+        print("[" + aRecord['repository'] + "] " + aRecord['summary'] + "\n")
+      else:
+        print(aRecord['summary'] + "\n")
+    for bug in aRecord['tickets']:
+      print(bug)
+
+    if not self.mQuietMode:
+      if (len(aRecord['commitsWithoutTickets']) > 0):
+        print("\nNote: The following commits did not have tickets associated with them (or git-risk\ncouldn't find them), so there might be undocumented issues that have regression(s)\nstemming from these commits' interactions with the merge.\n")
+        for commit in aRecord['commitsWithoutTickets']:
+          print(commit['summary'])
+
+    if aRecord['truncated']:
+      # In quiet mode, only tickets go to standard output, but an incomplete
+      # list of them shouldn't go unnoticed.
+      note = "Note: The analysis was cut short by the --" + aRecord['truncatedBy'] + " limit"
+      if aRecord.get('commitCount') is not None:
+        note = note + " after checking " + str(aRecord['commitCount']) + " commits"
+      note = note + ", so other tickets might also be at risk."
+      if self.mQuietMode:
+        sys.stderr.write("git-risk: " + aRecord['commit'] + ": " + note[len("Note: "):] + "\n")
+      else:
+        print("\n" + note)
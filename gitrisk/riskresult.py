@@ -0,0 +1,25 @@
+class RiskResult(tuple):
+  # The result of checking a commit. It's a tuple, so it can be unpacked
+  # exactly as before (e.g. `(tickets, commitsWithoutTickets) = ...`), that
+  # also records whether a WalkLimit cut the check short (truncatedBy is the
+  # LIMIT_* constant for the limit that was reached, or None), and how many
+  # suspect commits were actually checked.
+
+  def __new__(cls, aValues, truncatedBy=None, commitCount=0):
+    result = tuple.__new__(cls, aValues)
+    result.truncatedBy = truncatedBy
+    result.commitCount = commitCount
+    return result
+
+  @property
+  def truncated(self):
+    return self.truncatedBy is not None
+
+  def __reduce__(self):
+    # Results are sent back from worker processes, and the attributes would
+    # otherwise be lost when pickling a tuple.
+    return (RiskResult, (tuple(self), self.truncatedBy, self.commitCount))
+
+  def __repr__(self):
+    return ('<RiskResult ' + tuple.__repr__(self) + ' truncatedBy=' + str(self.truncatedBy) +
+            ' commitCount=' + str(self.commitCount) + '>')
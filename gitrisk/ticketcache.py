@@ -0,0 +1,122 @@
+import hashlib
+import os
+import os.path
+
+CACHE_MODE_USE = 'use'
+CACHE_MODE_WARM = 'warm'
+CACHE_MODE_VERIFY = 'verify'
+CACHE_MODE_BYPASS = 'bypass'
+CACHE_MODES = [CACHE_MODE_USE, CACHE_MODE_WARM, CACHE_MODE_VERIFY, CACHE_MODE_BYPASS]
+
+# SQLite limits the number of parameters in a single statement (to 999 in older
+# versions), so lookups of large suspect sets are done in batches.
+_QUERY_BATCH_SIZE = 500
+
+def getCacheDirectory(aRepo):
+  return os.path.join(aRepo.git_dir, 'gitrisk')
+
+def getConfigFingerprint(aTicketRegexes, aRegexGroup):
+  # Any change to the ticket configuration changes what is extracted from a
+  # commit, so it must also change the fingerprint the cache is keyed by.
+  fingerprint = hashlib.sha1()
+  for ticketRegex in aTicketRegexes:
+    fingerprint.update(ticketRegex.encode('utf-8'))
+    fingerprint.update(b'\0')
+  fingerprint.update(str(aRegexGroup).encode('utf-8'))
+  return fingerprint.hexdigest()
+
+class TicketCache:
+  # The tickets extracted from each commit, by commit SHA and the fingerprint
+  # of the ticket configuration they were extracted with. Entries for other
+  # configurations are simply never looked at, so that processes with different
+  # configurations (e.g. a daemon and a one-off run) can share the cache.
+  mPath = None
+  mFingerprint = None
+  mConnection = None
+
+  def __init__(self, aPath, aFingerprint):
+    # sqlite3 is only imported when the cache is actually used, to keep it off
+    # the startup path of git-risk.
+    import sqlite3
+
+    self.mPath = aPath
+    self.mFingerprint = aFingerprint
+
+    cacheDir = os.path.dirname(aPath)
+    if not os.path.isdir(cacheDir):
+      os.makedirs(cacheDir)
+
+    # GitRisk objects can be handed from one thread to another (see RepoPool),
+    # though never used by two at once, so the connection isn't tied to the
+    # thread that opened it.
+    self.mConnection = sqlite3.connect(aPath, timeout=30, check_same_thread=False)
+
+    # Caches written before entries were keyed by fingerprint can't tell which
+    # configuration their entries came from, so they're started over.
+    columns = [column[1] for column in self.mConnection.execute('PRAGMA table_info(commit_tickets)')]
+    if columns and 'fingerprint' not in columns:
+      self.mConnection.execute('DROP TABLE commit_tickets')
+      self.mConnection.execute('DROP TABLE IF EXISTS meta')
+
+    self.mConnection.execute('CREATE TABLE IF NOT EXISTS commit_tickets '
+                             '(fingerprint TEXT NOT NULL, sha TEXT NOT NULL, tickets TEXT NOT NULL, '
+                             'is_merge INTEGER NOT NULL, PRIMARY KEY (fingerprint, sha))')
+    self.mConnection.commit()
+
+  @classmethod
+  def openForRepo(cls, aRepo, aTicketRegexes, aRegexGroup):
+    path = os.path.join(getCacheDirectory(aRepo), 'tickets.sqlite')
+    return cls(path, getConfigFingerprint(aTicketRegexes, aRegexGroup))
+
+  def getPath(self):
+    return self.mPath
+
+  def getFingerprint(self):
+    return self.mFingerprint
+
+  def getEntries(self, aCommitShas):
+    # Returns a dictionary of SHA -> (tickets, isMerge) for every given commit
+    # that has an entry in the cache. tickets is None if the commit didn't
+    # reference any tickets.
+    entries = {}
+    commitShas = list(aCommitShas)
+    for start in range(0, len(commitShas), _QUERY_BATCH_SIZE):
+      batch = commitShas[start:start + _QUERY_BATCH_SIZE]
+      query = ('SELECT sha, tickets, is_merge FROM commit_tickets WHERE fingerprint = ? AND sha IN (%s)'
+               % ', '.join('?' * len(batch)))
+      for (commitSha, tickets, isMerge) in self.mConnection.execute(query, [self.mFingerprint] + batch):
+        entries[str(commitSha)] = (_decodeTickets(tickets), bool(isMerge))
+
+    return entries
+
+  def putEntries(self, aEntries):
+    # aEntries is an iterable of (SHA, tickets, isMerge) tuples.
+    self.mConnection.executemany('INSERT OR REPLACE INTO commit_tickets (fingerprint, sha, tickets, is_merge) '
+                                 'VALUES (?, ?, ?, ?)',
+                                 ((self.mFingerprint, commitSha, _encodeTickets(tickets), int(isMerge))
+                                  for (commitSha, tickets, isMerge) in aEntries))
+    self.mConnection.commit()
+
+  def getEntryCount(self):
+    # The number of entries for this cache's ticket configuration.
+    return self.mConnection.execute('SELECT COUNT(*) FROM commit_tickets WHERE fingerprint = ?',
+                                    (self.mFingerprint,)).fetchone()[0]
+
+  def close(self):
+    if self.mConnection:
+      self.mConnection.close()
+      self.mConnection = None
+
+def _encodeTickets(aTickets):
+  # Tickets are extracted from single lines, so they can never contain a
+  # newline themselves.
+  if not aTickets:
+    return u''
+
+  return u'\n'.join(sorted(aTickets))
+
+def _decodeTickets(aEncodedTickets):
+  if not aEncodedTickets:
+    return None
+
+  return set(aEncodedTickets.split(u'\n'))
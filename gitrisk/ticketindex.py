@@ -0,0 +1,136 @@
+from __future__ import absolute_import
+import os
+import os.path
+
+from gitrisk.ticketcache import getCacheDirectory, getConfigFingerprint
+
+# SQLite limits the number of parameters in a single statement (to 999 in older
+# versions), so lookups of many commits are done in batches.
+_QUERY_BATCH_SIZE = 500
+
+class TicketIndex:
+  # A persistent reverse index from tickets to the commits that reference them,
+  # and from commits to the merges whose suspect sets (see
+  # GitRisk.checkMerge) contain them. GitRisk.updateTicketIndex keeps it up to
+  # date; the index itself only stores and queries what it's given.
+  mPath = None
+  mFingerprint = None
+  mConnection = None
+
+  def __init__(self, aPath, aFingerprint):
+    # sqlite3 is only imported when the index is actually used, to keep it off
+    # the startup path of git-risk.
+    import sqlite3
+
+    self.mPath = aPath
+    self.mFingerprint = aFingerprint
+
+    indexDir = os.path.dirname(aPath)
+    if not os.path.isdir(indexDir):
+      os.makedirs(indexDir)
+
+    # GitRisk objects can be handed from one thread to another (see RepoPool),
+    # though never used by two at once, so the connection isn't tied to the
+    # thread that opened it.
+    self.mConnection = sqlite3.connect(aPath, timeout=30, check_same_thread=False)
+    self.mConnection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+    self.mConnection.execute('CREATE TABLE IF NOT EXISTS tips (sha TEXT PRIMARY KEY)')
+    self.mConnection.execute('CREATE TABLE IF NOT EXISTS ticket_commits '
+                             '(ticket TEXT NOT NULL, sha TEXT NOT NULL, PRIMARY KEY (ticket, sha))')
+    self.mConnection.execute('CREATE TABLE IF NOT EXISTS merge_suspects '
+                             '(merge TEXT NOT NULL, sha TEXT NOT NULL, PRIMARY KEY (merge, sha))')
+    self.mConnection.execute('CREATE INDEX IF NOT EXISTS ticket_commits_by_sha ON ticket_commits (sha)')
+    self.mConnection.execute('CREATE INDEX IF NOT EXISTS merge_suspects_by_sha ON merge_suspects (sha)')
+
+    # An index built with a different ticket configuration has to be rebuilt
+    # from scratch, so forget everything (including the indexed tips) when the
+    # fingerprint changes.
+    row = self.mConnection.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+    if not row or row[0] != aFingerprint:
+      self.mConnection.execute('DELETE FROM tips')
+      self.mConnection.execute('DELETE FROM ticket_commits')
+      self.mConnection.execute('DELETE FROM merge_suspects')
+      self.mConnection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('fingerprint', ?)",
+                               (aFingerprint,))
+
+    # Indexes written before only the suspects referencing a ticket were stored
+    # (see addMergeSuspects) are trimmed down once.
+    row = self.mConnection.execute("SELECT value FROM meta WHERE key = 'suspects'").fetchone()
+    if not row:
+      self.mConnection.execute('DELETE FROM merge_suspects WHERE sha NOT IN (SELECT sha FROM ticket_commits)')
+      self.mConnection.execute("INSERT INTO meta (key, value) VALUES ('suspects', 'ticketed')")
+    self.mConnection.commit()
+
+  @classmethod
+  def openForRepo(cls, aRepo, aTicketRegexes, aRegexGroup):
+    path = os.path.join(getCacheDirectory(aRepo), 'index.sqlite')
+    return cls(path, getConfigFingerprint(aTicketRegexes, aRegexGroup))
+
+  def getPath(self):
+    return self.mPath
+
+  def getTips(self):
+    return [str(sha) for (sha,) in self.mConnection.execute('SELECT sha FROM tips')]
+
+  def addCommitTickets(self, aEntries):
+    # aEntries is an iterable of (SHA, tickets) tuples.
+    self.mConnection.executemany('INSERT OR IGNORE INTO ticket_commits (ticket, sha) VALUES (?, ?)',
+                                 ((ticket, commitSha) for (commitSha, tickets) in aEntries
+                                  for ticket in tickets))
+
+  def addMergeSuspects(self, aMergeSha, aSuspectShas):
+    # Only the suspects already added with addCommitTickets are stored, since
+    # a suspect that doesn't reference any ticket can never turn up in a
+    # lookup.
+    self.mConnection.executemany('INSERT OR IGNORE INTO merge_suspects (merge, sha) '
+                                 'SELECT DISTINCT ?, sha FROM ticket_commits WHERE sha = ?',
+                                 ((aMergeSha, commitSha) for commitSha in aSuspectShas))
+
+  def removeCommits(self, aShas):
+    # Forgets the given commits: the tickets they reference, and their suspect
+    # sets (if they're merges) as well as their place in anyone else's.
+    shas = list(aShas)
+    for start in range(0, len(shas), _QUERY_BATCH_SIZE):
+      batch = shas[start:start + _QUERY_BATCH_SIZE]
+      placeholders = ', '.join('?' * len(batch))
+      self.mConnection.execute('DELETE FROM ticket_commits WHERE sha IN (%s)' % placeholders, batch)
+      self.mConnection.execute('DELETE FROM merge_suspects WHERE merge IN (%s) OR sha IN (%s)'
+                               % (placeholders, placeholders), batch + batch)
+
+  def getIndexedCommits(self):
+    return sorted(str(sha) for (sha,) in self.mConnection.execute(
+      'SELECT sha FROM ticket_commits UNION SELECT merge FROM merge_suspects'))
+
+  def setTips(self, aTipShas):
+    # Records the tips everything has now been indexed up to, and commits
+    # everything added since the last time they were set, so that an
+    # interrupted update never leaves the index claiming more than it holds.
+    self.mConnection.execute('DELETE FROM tips')
+    self.mConnection.executemany('INSERT OR IGNORE INTO tips (sha) VALUES (?)',
+                                 ((tipSha,) for tipSha in aTipShas))
+    self.mConnection.commit()
+
+  def getCommitsForTicket(self, aTicket):
+    return sorted(str(sha) for (sha,) in
+                  self.mConnection.execute('SELECT sha FROM ticket_commits WHERE ticket = ?', (aTicket,)))
+
+  def getMergesForCommits(self, aCommitShas):
+    return sorted(set(str(merge) for (merge,) in self._queryBatches(
+      'SELECT DISTINCT merge FROM merge_suspects WHERE sha IN (%s)', aCommitShas)))
+
+  def getTicketsForMerges(self, aMergeShas):
+    return sorted(set(ticket for (ticket,) in self._queryBatches(
+      'SELECT DISTINCT ticket_commits.ticket FROM merge_suspects JOIN ticket_commits '
+      'ON ticket_commits.sha = merge_suspects.sha WHERE merge_suspects.merge IN (%s)', aMergeShas)))
+
+  def _queryBatches(self, aQuery, aValues):
+    values = list(aValues)
+    for start in range(0, len(values), _QUERY_BATCH_SIZE):
+      batch = values[start:start + _QUERY_BATCH_SIZE]
+      for row in self.mConnection.execute(aQuery % ', '.join('?' * len(batch)), batch):
+        yield row
+
+  def close(self):
+    if self.mConnection:
+      self.mConnection.close()
+      self.mConnection = None
@@ -0,0 +1,168 @@
+import re
+
+try:
+  from re import _parser as sre_parse
+  from re import _constants as sre_constants
+except ImportError:
+  import sre_parse
+  import sre_constants
+
+def _getSubpattern(aArgs):
+  # The layout of a SUBPATTERN node differs between python versions, but the
+  # parsed subpattern itself is always the last element.
+  return aArgs[-1]
+
+def _subpatternChangesFlags(aArgs):
+  return len(aArgs) > 2 and (aArgs[1] or aArgs[2])
+
+def _findRequiredLiteralRuns(aParsedPattern):
+  # Walk a parsed regular expression and return the runs of literal characters
+  # that any match of the expression is guaranteed to contain. Anything that
+  # isn't a plain literal (character classes, alternation, optional repeats,
+  # anchors, ...) ends the current run. Being conservative here is always safe:
+  # the worst case is that a line isn't skipped when it could have been.
+  runs = []
+  currentRun = []
+
+  def endRun():
+    if currentRun:
+      runs.append(''.join(currentRun))
+      del currentRun[:]
+
+  for (op, av) in aParsedPattern:
+    if op == sre_constants.LITERAL and av < 128:
+      # Only ASCII literals are used, so that the prefilter can compare them
+      # against both byte and unicode lines.
+      currentRun.append(chr(av))
+    elif op == sre_constants.SUBPATTERN and not _subpatternChangesFlags(av):
+      subRuns = _findRequiredLiteralRuns(_getSubpattern(av))
+      if _isLiteralOnly(_getSubpattern(av)):
+        currentRun.extend(''.join(subRuns))
+      else:
+        endRun()
+        runs.extend(subRuns)
+    elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and av[0] >= 1:
+      endRun()
+      runs.extend(_findRequiredLiteralRuns(av[2]))
+    else:
+      endRun()
+
+  endRun()
+  return runs
+
+def _isLiteralOnly(aParsedPattern):
+  for (op, av) in aParsedPattern:
+    if op == sre_constants.LITERAL and av < 128:
+      continue
+
+    if op == sre_constants.SUBPATTERN and not _subpatternChangesFlags(av) \
+       and _isLiteralOnly(_getSubpattern(av)):
+      continue
+
+    return False
+
+  return True
+
+def getRequiredLiteral(aPattern, aFlags=0):
+  runs = _findRequiredLiteralRuns(sre_parse.parse(aPattern, aFlags))
+  if not runs:
+    return None
+
+  return max(runs, key=len)
+
+class TicketPattern:
+  mRegex = None
+  mGroup = 0
+  mLiteral = None
+  mIgnoreCase = False
+
+  def __init__(self, aPattern, aGroup=0, mayLackGroup=False):
+    self.mRegex = re.compile(aPattern)
+    self.mIgnoreCase = bool(self.mRegex.flags & re.IGNORECASE)
+
+    # The group is a number or a name, which comes from the configuration as a
+    # string either way. With mayLackGroup, a pattern that doesn't have it (e.g.
+    # a JIRA style pattern alongside a "Bug (#123)" style pattern) uses the
+    # whole match; otherwise, it's an error, just as it is for re.
+    try:
+      self.mGroup = int(aGroup)
+    except ValueError:
+      self.mGroup = self.mRegex.groupindex.get(aGroup)
+    if self.mGroup is None or not 0 <= self.mGroup <= self.mRegex.groups:
+      if not mayLackGroup:
+        raise IndexError("no such group %s in ticket expression %s" % (aGroup, aPattern))
+      self.mGroup = 0
+
+    self.mLiteral = getRequiredLiteral(aPattern)
+    if self.mLiteral and self.mIgnoreCase:
+      self.mLiteral = self.mLiteral.lower()
+
+  def getPattern(self):
+    return self.mRegex.pattern
+
+  def getLiteral(self):
+    return self.mLiteral
+
+  def mightMatch(self, aLine, aLoweredLine=None):
+    if not self.mLiteral:
+      return True
+
+    if self.mIgnoreCase:
+      return self.mLiteral in (aLoweredLine if aLoweredLine is not None else aLine.lower())
+
+    return self.mLiteral in aLine
+
+  def match(self, aLine):
+    result = self.mRegex.search(aLine)
+    if not result:
+      return None
+
+    return result.group(self.mGroup).strip()
+
+class TicketMatcher:
+  mPatterns = None
+  mNeedsLowerCase = False
+
+  def __init__(self, aPatterns, aGroup=0):
+    if isinstance(aPatterns, str) or not hasattr(aPatterns, '__iter__'):
+      aPatterns = [aPatterns]
+
+    aPatterns = list(aPatterns)
+    self.mPatterns = [TicketPattern(pattern, aGroup, len(aPatterns) > 1) for pattern in aPatterns]
+    if not self.mPatterns:
+      raise Exception("Unable to find a regular expression for searching tickets")
+
+    self.mNeedsLowerCase = any(pattern.mIgnoreCase for pattern in self.mPatterns)
+
+  def getPatterns(self):
+    return [pattern.getPattern() for pattern in self.mPatterns]
+
+  def match(self, aLine):
+    # Each line contributes at most one ticket: the one found by the first
+    # pattern (in configuration order) that matches it.
+    loweredLine = None
+    if self.mNeedsLowerCase:
+      loweredLine = aLine.lower()
+
+    for pattern in self.mPatterns:
+      if not pattern.mightMatch(aLine, loweredLine):
+        continue
+
+      result = pattern.match(aLine)
+      if result:
+        return result
+
+    return None
+
+  def matchMany(self, aLines):
+    return [self.match(line) for line in aLines]
+
+  def matchMessage(self, aMessage):
+    # Returns the set of tickets referenced by the lines of a commit message, or
+    # None if it doesn't reference any.
+    lines = [line for line in aMessage.split("\n") if line.strip()]
+    tickets = set(ticket for ticket in self.matchMany(lines) if ticket)
+    if tickets:
+      return tickets
+    else:
+      return None
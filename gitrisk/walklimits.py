@@ -0,0 +1,92 @@
+import time
+
+# Which limit cut a walk short, as given by LimitedWalk.getTruncatedBy() (and
+# RiskResult.truncatedBy).
+LIMIT_MAX_COMMITS = 'max-commits'
+LIMIT_MAX_AGE = 'max-age'
+LIMIT_TIME_BUDGET = 'time-budget'
+
+class WalkLimits:
+  # Bounds on how much of the history checking a commit may look at: at most
+  # mMaxCommits suspect commits, none committed before mMinDate, and nothing at
+  # all after mDeadline (all as timestamps). Any of them can be None, for no
+  # limit. Limits are plain values, so they can be sent to worker processes.
+  mMaxCommits = None
+  mMinDate = None
+  mDeadline = None
+
+  def __init__(self, maxCommits=None, maxAge=None, timeBudget=None):
+    # maxAge and timeBudget are in seconds, and are counted from now. A maxAge
+    # reaching back before 1970 leaves out no commits at all, so it's no limit
+    # (git would take the negative date it gives to mean nothing is new enough).
+    now = time.time()
+    self.mMaxCommits = maxCommits
+    if maxAge is not None and now - maxAge > 0:
+      self.mMinDate = now - maxAge
+    if timeBudget is not None:
+      self.mDeadline = now + timeBudget
+
+  def getMaxCommits(self):
+    return self.mMaxCommits
+
+  def getMinDate(self):
+    return self.mMinDate
+
+  def getDeadline(self):
+    return self.mDeadline
+
+  def isPastDeadline(self):
+    return self.mDeadline is not None and time.time() >= self.mDeadline
+
+  def limitWalk(self, aGraph, aIds):
+    return LimitedWalk(self, aGraph, aIds)
+
+class LimitedWalk:
+  # Produces the commit ids of a walk until one of its limits is reached.
+  # Commits older than the minimum date are left out, but don't end the walk,
+  # since commit dates aren't ordered along it; the walk itself is expected to
+  # stop at them instead (see CommitGraph.iterRange).
+  mLimits = None
+  mGraph = None
+  mIds = None
+  mCount = 0
+  mTruncatedBy = None
+
+  def __init__(self, aLimits, aGraph, aIds):
+    self.mLimits = aLimits
+    self.mGraph = aGraph
+    self.mIds = aIds
+    self.mCount = 0
+
+  def __iter__(self):
+    maxCommits = self.mLimits.getMaxCommits()
+    minDate = self.mLimits.getMinDate()
+    for commitId in self.mIds:
+      if self.mLimits.isPastDeadline():
+        self.stop(LIMIT_TIME_BUDGET)
+        return
+
+      if minDate is not None and self.mGraph.getCommitDate(commitId) < minDate:
+        self.stop(LIMIT_MAX_AGE)
+        continue
+
+      if maxCommits is not None and self.mCount >= maxCommits:
+        self.stop(LIMIT_MAX_COMMITS)
+        return
+
+      self.mCount = self.mCount + 1
+      yield commitId
+
+  def isPastDeadline(self):
+    return self.mLimits.isPastDeadline()
+
+  def stop(self, aLimit):
+    # Only the first limit reached is reported.
+    if not self.mTruncatedBy:
+      self.mTruncatedBy = aLimit
+
+  def getTruncatedBy(self):
+    return self.mTruncatedBy
+
+  def getCount(self):
+    return self.mCount
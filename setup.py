@@ -15,7 +15,8 @@ entryPoints = {
 
 requirements = [
   'configparser>=3.3.0',
-  'GitPython>=0.3.2'
+  'GitPython>=0.3.2',
+  'importlib_metadata; python_version < "3.8"'
 ]
 
 curDir = os.path.dirname(os.path.realpath(__file__))
@@ -0,0 +1,96 @@
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import zipfile
+
+# The asyncio interface needs Python 3.5 or later (and, unlike the rest of
+# git-risk, doesn't need GitPython), so it can only be imported there.
+if sys.version_info >= (3, 5):
+  import asyncio
+  from gitrisk.asyncrisk import AsyncGitRisk, GitCommandError
+
+@unittest.skipIf(sys.version_info < (3, 5), "the asyncio interface requires Python 3.5 or later")
+class AsyncGitRiskTest(unittest.TestCase):
+  mTempDir = None
+  mGitRepoPath = None
+
+  def setUp(self):
+    self.mTempDir = tempfile.mkdtemp(prefix='gitRiskAsyncTest')
+    testRepoZipPath = os.path.join(self.__findTestDir(), "testrepo.zip")
+    with open(testRepoZipPath, 'rb') as zipFh:
+      zipfile.ZipFile(zipFh).extractall(self.mTempDir)
+    self.mGitRepoPath = os.path.join(self.mTempDir, 'testrepo')
+
+  def tearDown(self):
+    shutil.rmtree(self.mTempDir)
+
+  def __run(self, aCoroutine):
+    loop = asyncio.new_event_loop()
+    try:
+      return loop.run_until_complete(aCoroutine)
+    finally:
+      loop.close()
+
+  def test_checkMerge(self):
+    # The same results as GitRisk.checkMerge, using the repository's own
+    # configuration.
+    gitRisk = AsyncGitRisk(repo=self.mGitRepoPath)
+    (tickets, recordsWithoutTickets) = self.__run(gitRisk.checkMerge('9cfed13'))
+    self.assertEqual(set(['143']), tickets)
+    self.assertEqual(set(['0d75d6c25419313db8c7c85b19a2b7ae2e3020f7', '767afe6aeb9cdd79d0fcf09135f6fe993fad80c6']),
+                     set(record.hexsha for record in recordsWithoutTickets))
+
+    gitRisk = AsyncGitRisk(r"^(\W)*([B|b][U|u][G|g])(\ )*(\#)*[0-9]+", self.mGitRepoPath)
+    (tickets, recordsWithoutTickets) = self.__run(gitRisk.checkCommitRange('HEAD', 'd8bb7b3'))
+    self.assertEqual(set(['Bug 143', 'Bug #98', 'Bug #27', 'Bug #72']), tickets)
+    self.assertEqual(set(['767afe6', '0d75d6c', '836ceea']),
+                     set(record.hexsha[:7] for record in recordsWithoutTickets))
+
+  def test_escapedQuoteInConfig(self):
+    # Quotes escaped in the configuration are part of the expression, as they
+    # are for GitRisk.
+    for (name, value) in [('gitrisk.ticketRegex', '"([A-Za-z]+)"'), ('gitrisk.ticketNumberRegexGroup', '1')]:
+      subprocess.check_call(['git', 'config', name, value], cwd=self.mGitRepoPath)
+    with open(os.path.join(self.mGitRepoPath, '.git', 'config')) as configFile:
+      self.assertTrue('\\"([A-Za-z]+)\\"' in configFile.read())
+
+    gitRisk = AsyncGitRisk(repo=self.mGitRepoPath)
+    (tickets, recordsWithoutTickets) = self.__run(gitRisk.checkMerge('9cfed13'))
+    self.assertEqual(set(['BetaThing']), tickets)
+
+  def test_concurrentChecks(self):
+    gitRisk = AsyncGitRisk(repo=self.mGitRepoPath, maxConcurrency=2)
+    commitHashes = ['9cfed13', 'd8bb7b3', 'ddcdb34', 'e4a0663'] * 5
+    results = self.__run(gitRisk.checkCommits(commitHashes))
+
+    self.assertEqual(commitHashes, [commitHash for (commitHash, tickets, recordsWithoutTickets) in results])
+    self.assertEqual(set(['143']), results[0][1])
+    self.assertEqual(set(['#14', '#44']), results[1][1])
+    self.assertEqual(set(['#14', '#0']), results[2][1])
+    for (index, result) in enumerate(results):
+      self.assertEqual(results[index % 4][1], result[1])
+      self.assertFalse(result.truncated)
+
+    with self.assertRaises(GitCommandError):
+      self.__run(gitRisk.checkMerge('0000000'))
+
+  def test_boundedMemo(self):
+    # The memo of extracted commits never holds more than memoSize of them,
+    # even when a single check reads more.
+    gitRisk = AsyncGitRisk(repo=self.mGitRepoPath, memoSize=2)
+    (tickets, recordsWithoutTickets) = self.__run(gitRisk.checkMerge('d8bb7b3'))
+    self.assertEqual(set(['#14', '#44']), tickets)
+    self.assertEqual(2, len(gitRisk.mTicketMemo))
+
+  def __findTestDir(self):
+    # Find the file called 'testrepo.zip', starting at the current dir
+    for (root, dirs, files) in os.walk('.'):
+      if 'testrepo.zip' in files:
+        return root
+
+if __name__ == '__main__':
+  unittest.main()
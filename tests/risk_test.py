@@ -6,8 +6,25 @@ from os.path import join
 import os
 import tempfile
 import shutil
+import sys
+import json
+import pickle
+import binascii
 
+try:
+  from StringIO import StringIO
+except ImportError:
+  from io import StringIO
+
+import gitrisk.gitrisk
 from gitrisk.gitrisk import GitRisk
+from gitrisk.ticketmatcher import TicketMatcher, getRequiredLiteral
+from gitrisk.profiler import PhaseProfiler
+from gitrisk.commitrecord import CommitRecord
+from gitrisk.walklimits import WalkLimits
+from gitrisk.repopool import RepoPool
+from gitrisk.multirepo import MultiRepoRisk
+from gitrisk.daemon import RiskDaemon, DaemonClient, findGitDir, getGitDir
 
 class GitRiskTest(unittest.TestCase):
   mGitRepoPath = None
@@ -67,6 +84,58 @@ class GitRiskTest(unittest.TestCase):
     self.assertEqual('Bug 1029104', tickets[7])
     self.assertEqual('Bug 19283', tickets[8])
 
+  def test_multipleTicketRegexes(self):
+    gitRisk = GitRisk(["(JM|jm)-[0-9]+", "([B|b][U|u][G|g])\ [0-9]+"], os.path.abspath("."), debug=False)
+
+    jmTickets = gitRisk.getTicketNamesFromFile(join(self.__findTestDir(), "testjmtickets.txt"))
+    self.assertEqual(['JM-1966', 'JM-1726', 'jm-1922', 'jm-1021'], jmTickets)
+
+    bugTickets = gitRisk.getTicketNamesFromFile(join(self.__findTestDir(), "bugtickets.txt"))
+    self.assertEqual(9, len(bugTickets))
+    self.assertEqual('Bug 1028867', bugTickets[0])
+    self.assertEqual('Bug 19283', bugTickets[8])
+
+  def test_getAtRiskTickets(self):
+    gitRisk = GitRisk(repo=self.mGitRepoPath, debug=False)
+    ticketListPath = os.path.join(self.mTempDir, 'open-tickets.txt')
+    with open(ticketListPath, 'w') as ticketList:
+      ticketList.write("Bug #14: The widget is broken\n#44\n\nBug 99 - Unrelated\nBug #14 (duplicate)\n")
+
+    self.assertEquals(['#14', '99', '#14'], list(gitRisk.iterTicketNamesFromFile(ticketListPath)))
+    ticketSet = gitRisk.getTicketSetFromFile(ticketListPath)
+    self.assertEquals(set(['#14', '#44', '99']), ticketSet)
+
+    (tickets, commitsWithoutTickets) = gitRisk.checkMerge('d8bb7b3')
+    self.assertEquals(set(['#14', '#44']), gitRisk.getAtRiskTickets(tickets, ticketSet))
+    self.assertEquals(set(['#14']), gitRisk.getAtRiskTickets(tickets, ['Bug 1', '#14']))
+
+    # Empty files can't be mapped, but are still read.
+    emptyPath = os.path.join(self.mTempDir, 'no-tickets.txt')
+    open(emptyPath, 'w').close()
+    self.assertEquals(set(), gitRisk.getTicketSetFromFile(emptyPath))
+
+  def test_ticketMatcherLiteralPrefilter(self):
+    self.assertEqual('Bug', getRequiredLiteral("^(\W)*(Bug)(\ )*((\#)*[0-9]+)"))
+    self.assertEqual('-', getRequiredLiteral("(JM|jm)-[0-9]+"))
+    self.assertEqual(None, getRequiredLiteral("[0-9]+"))
+
+    matcher = TicketMatcher(["(?i)bug #[0-9]+", "JM-[0-9]+"])
+    self.assertEqual(['BUG #12', None, 'JM-7', None],
+                     matcher.matchMany(["BUG #12: fix", "Bug 12", "JM-7 - thing", "jm-7"]))
+
+  def test_ticketMatcherGroups(self):
+    # Groups can be given by name, and by number as a string, as they are in
+    # the configuration.
+    self.assertEqual('12', TicketMatcher(["Bug #(?P<num>[0-9]+)"], 'num').match("Bug #12: fix"))
+    self.assertEqual('12', TicketMatcher(["Bug #([0-9]+)"], '1').match("Bug #12: fix"))
+
+    # Only when there are several patterns may one of them lack the group, and
+    # use the whole match instead.
+    matcher = TicketMatcher(["Bug #(?P<num>[0-9]+)", "JM-[0-9]+"], 'num')
+    self.assertEqual(['12', 'JM-7'], matcher.matchMany(["Bug #12: fix", "JM-7 - thing"]))
+    self.assertRaises(IndexError, TicketMatcher, ["Bug #([0-9]+)"], 2)
+    self.assertRaises(IndexError, TicketMatcher, ["Bug #([0-9]+)"], 'num')
+
   def test_getRepo(self):
     self.assertEqual(self.mGitRepoPath, self.mGitRiskObj.getRepoPath())
 
@@ -115,6 +184,77 @@ class GitRiskTest(unittest.TestCase):
     tickets = self.mGitRiskObj.getTicketNamesFromCommit(commitWithNoTicketButMatchingSpec)
     self.assertFalse(tickets)
 
+  def test_getMergeBaseFromCommitGraphFile(self):
+    # Merge bases computed from git's own commit-graph file should be exactly
+    # those given by `git merge-base`.
+    repo = self.mGitRiskObj.mRepo
+    repo.git.commit_graph('write', '--reachable')
+    gitRisk = GitRisk("^(\W)*([B|b][U|u][G|g])(\ )*(\#)*[0-9]+", self.mGitRepoPath, debug=False)
+    self.assertTrue(gitRisk.getCommitGraph().isGraphFileLoaded())
+
+    allShas = repo.git.rev_list('--all').split()
+    for firstSha in allShas:
+      for secondSha in allShas:
+        expectedSha = repo.git.merge_base(firstSha, secondSha)
+        self.assertEquals(expectedSha, gitRisk.getMergeBase(firstSha, secondSha).hexsha)
+
+    mergeBaseTriple2 = gitRisk.getMergeBase("6ff4935", "6a5c798", "88f06c9")
+    self.assertEquals("deb5eb357ef6677301b629922279cf2221d4a91d", mergeBaseTriple2.hexsha)
+
+    suspects = gitRisk.getAllSuspectCommitsFromMerge("9cfed13838c730c748c482be0ea78e65883e6b94")
+    self.assertEquals(set(['9cfed13838c730c748c482be0ea78e65883e6b94',
+                           '934d49610abc5e71fff06394b66e960f399a3412',
+                           '767afe6aeb9cdd79d0fcf09135f6fe993fad80c6',
+                           '0d75d6c25419313db8c7c85b19a2b7ae2e3020f7']),
+                      set(suspect.hexsha for suspect in suspects))
+
+  def test_commitGraphWithoutGraphFile(self):
+    # Without a commit-graph file, checking a merge only loads the commits it
+    # touches, rather than the whole history behind it.
+    gitRisk = GitRisk(repo=self.mGitRepoPath, debug=False)
+    self.assertFalse(gitRisk.getCommitGraph().isGraphFileLoaded())
+    expected = gitRisk.checkMerge('9cfed13')
+    self.assertEquals(set(['143']), expected[0])
+    historySize = len(gitRisk.mRepo.git.rev_list('--all').split())
+    self.assertTrue(gitRisk.getCommitGraph().getCommitCount() < historySize)
+
+    # Once everything is loaded, the same answers are worked out in-process.
+    gitRisk = GitRisk(repo=self.mGitRepoPath, debug=False)
+    gitRisk.getCommitGraph().loadAll()
+    self.assertEquals(historySize, gitRisk.getCommitGraph().getCommitCount())
+    self.assertEquals(expected, gitRisk.checkMerge('9cfed13'))
+    self.assertEquals("deb5eb357ef6677301b629922279cf2221d4a91d",
+                      gitRisk.getMergeBase("6ff4935", "6a5c798", "88f06c9").hexsha)
+
+  def test_iterRangeMinDate(self):
+    # The walk stops at the first commits older than the minimum date, whether
+    # git does the walk or it's done in-process: only 88f06c9, which can only
+    # be reached through older commits, isn't produced.
+    headSha = self.mGitRiskObj.mRepo.git.rev_parse('HEAD')
+    expected = set(self.mGitRiskObj.mRepo.git.rev_list('HEAD').split())
+    expected.remove('88f06c9cf2c3bccf3df73a6c2bcb8a34549ef20f')
+    for loadAll in [False, True]:
+      graph = GitRisk(repo=self.mGitRepoPath, debug=False).getCommitGraph()
+      if loadAll:
+        graph.loadAll()
+      minDate = graph.getCommitDate(graph.getId('c2a881d4c5753a2e6e6e1130d0e27b17a44b4c4c'))
+      commitIds = list(graph.iterRange([graph.getId(headSha)], minDate=minDate))
+      self.assertEquals(expected, set(graph.getHexSha(commitId) for commitId in commitIds))
+      self.assertEquals(len(expected), len(commitIds))
+
+  def test_hugeMaxAge(self):
+    # A maxAge reaching back before 1970 is no limit at all, on the git walk
+    # of a fresh commit graph as much as anywhere else.
+    hugeMaxAge = 36500 * 24 * 60 * 60
+    self.assertEquals(None, WalkLimits(maxAge=hugeMaxAge).getMinDate())
+    expected = GitRisk(repo=self.mGitRepoPath, debug=False).checkMerge('d8bb7b3')
+    limited = GitRisk(repo=self.mGitRepoPath, debug=False).checkMerge('d8bb7b3', maxAge=hugeMaxAge)
+    self.assertEquals(expected, limited)
+    self.assertEquals((None, expected.commitCount), (limited.truncatedBy, limited.commitCount))
+    expectedRange = GitRisk(repo=self.mGitRepoPath, debug=False).checkCommitRange('6a5c7', 'd8bb7b3')
+    self.assertEquals(expectedRange, GitRisk(repo=self.mGitRepoPath, debug=False).checkCommitRange(
+      '6a5c7', 'd8bb7b3', maxAge=hugeMaxAge))
+
   def test_findSuspectCommits(self):
     suspectCommits = self.mGitRiskObj.findSuspectCommits(self.mGitRiskObj.getCommitFromHash('6a5c7'), self.mGitRiskObj.getCommitFromHash('c2a88'))
     self.assertEquals(len(suspectCommits), 3)
@@ -174,6 +314,58 @@ class GitRiskTest(unittest.TestCase):
       suspectShas.add(suspect.hexsha)
     self.assertEquals(expectedShas, suspectShas)
 
+  def test_iterAllSuspectCommitsFromOctopusMerge(self):
+    repo = self.mGitRiskObj.mRepo
+    configWriter = repo.config_writer()
+    configWriter.set_value('user', 'name', 'git-risk')
+    configWriter.set_value('user', 'email', 'git-risk@example.com')
+    configWriter.release()
+
+    parents = ['c2a881d4c5753a2e6e6e1130d0e27b17a44b4c4c',
+               '6ff49357e0f3b9fa991bbd9b42e520f91723436e',
+               'f5813f80a012eabe625ecf12dac9efc3964f2d3d']
+    octopusSha = repo.git.commit_tree('c2a881d^{tree}', '-p', parents[0], '-p', parents[1],
+                                      '-p', parents[2], m='Merge octopus')
+
+    # A single walk from all of the parents should find exactly the commits
+    # that walking from each parent separately would.
+    mergeBase = self.mGitRiskObj.getMergeBase(*parents)
+    self.assertEquals('7b9609a1cacce59b81963762f885d7a25453e72e', mergeBase.hexsha)
+    expectedShas = set([octopusSha])
+    for parent in parents:
+      for commit in self.mGitRiskObj.findSuspectCommits(self.mGitRiskObj.getCommitFromHash(parent), mergeBase):
+        expectedShas.add(commit.hexsha)
+
+    suspectShas = [suspect.hexsha for suspect in self.mGitRiskObj.iterAllSuspectCommitsFromMerge(octopusSha)]
+    self.assertEquals(len(suspectShas), len(set(suspectShas)))
+    self.assertEquals(expectedShas, set(suspectShas))
+    self.assertEquals(8, len(suspectShas))
+
+  def test_pathScopedSuspectCommits(self):
+    # Neither side of d8bb7b3 touched anything the other did, so only the
+    # merges and the merge base are left.
+    expectedShas = {
+      '9cfed13838c730c748c482be0ea78e65883e6b94': set(['9cfed13', '934d496', '767afe6', '0d75d6c']),
+      'd8bb7b32e43bf27f49a4dc3d27d9f799e829db9d': set(['d8bb7b3', 'ddcdb34', 'deb5eb3']),
+      'ddcdb34cd3dea82e47c50751d8b9b4b3b8c23e4e': set(['ddcdb34', 'c2a881d', '88f06c9', '7b9609a'])
+    }
+
+    # The result should be the same whether or not there are changed-path
+    # filters to rule commits out with.
+    for changedPaths in (False, True):
+      if changedPaths:
+        self.mGitRiskObj.mRepo.git.commit_graph('write', '--reachable', '--changed-paths')
+
+      gitRisk = GitRisk("^(\W)*([B|b][U|u][G|g])(\ )*(\#)*[0-9]+", self.mGitRepoPath, pathScoped=True)
+      self.assertEquals(changedPaths, gitRisk.getCommitGraph().hasChangedPathFilters())
+      for (mergeSha, shortShas) in expectedShas.items():
+        suspects = gitRisk.getAllSuspectCommitsFromMerge(mergeSha)
+        self.assertEquals(shortShas, set(suspect.hexsha[:7] for suspect in suspects))
+
+      (tickets, commitsWithoutTickets) = gitRisk.checkMerge('d8bb7b32e43bf27f49a4dc3d27d9f799e829db9d')
+      self.assertEquals(set(['Bug #14']), tickets)
+      gitRisk.close()
+
   def test_checkMerge(self):
     (tickets, commitsWithoutTickets) = self.mGitRiskObj.checkMerge('9cfed13838c730c748c482be0ea78e65883e6b94')
     expectedTickets = set(['Bug 143'])
@@ -185,11 +377,614 @@ class GitRiskTest(unittest.TestCase):
     self.assertEquals(expectedCommits, commitsWithoutTickets)
     self.assertEquals(expectedTickets, tickets)
 
+  def test_checkCommitRange(self):
+    (tickets, commitsWithoutTickets) = self.mGitRiskObj.checkCommitRange('HEAD', 'd8bb7b3')
+    expectedTickets = set(['Bug 143', 'Bug #98', 'Bug #27', 'Bug #72'])
+    expectedShortShas = set(['767afe', '0d75d', '836cee'])
+    expectedCommits = set()
+    for shortSha in expectedShortShas:
+      expectedCommits.add(self.mGitRiskObj.getCommitFromHash(shortSha))
+
+    self.assertEquals(expectedCommits, commitsWithoutTickets)
+    self.assertEquals(expectedTickets, tickets)
+
+  def test_ticketCache(self):
+    cachingGitRisk = GitRisk(repo=self.mGitRepoPath, debug=False, cacheMode='use')
+    expected = cachingGitRisk.checkMerge('9cfed13838c730c748c482be0ea78e65883e6b94')
+    self.assertTrue(os.path.exists(cachingGitRisk.getTicketCache().getPath()))
+    self.assertEquals(4, cachingGitRisk.getTicketCache().getEntryCount())
+
+    # A second run should be answered from the cache, with identical results.
+    cachingGitRisk = GitRisk(repo=self.mGitRepoPath, debug=False, cacheMode='use')
+    self.assertEquals(expected, cachingGitRisk.checkMerge('9cfed13838c730c748c482be0ea78e65883e6b94'))
+
+    verifyingGitRisk = GitRisk(repo=self.mGitRepoPath, debug=False, cacheMode='verify')
+    self.assertEquals(expected, verifyingGitRisk.checkMerge('9cfed13838c730c748c482be0ea78e65883e6b94'))
+    self.assertEquals([], verifyingGitRisk.getCacheMismatches())
+
+    # A different ticket configuration must not see entries extracted with
+    # the old one.
+    otherGitRisk = GitRisk("^(\\W)*(Bug)", self.mGitRepoPath, debug=False, cacheMode='use')
+    self.assertEquals(0, otherGitRisk.getTicketCache().getEntryCount())
+    (tickets, commitsWithoutTickets) = otherGitRisk.checkMerge('9cfed13838c730c748c482be0ea78e65883e6b94')
+    self.assertEquals(set(['Bug']), tickets)
+
+    # Nor do configurations used side by side see each other's entries, in
+    # whichever order they open the cache.
+    otherGitRisk.close()
+    cachingGitRisk = GitRisk(repo=self.mGitRepoPath, debug=False, cacheMode='use', resultCacheSize=0)
+    cachingGitRisk.getTicketCache()
+    otherGitRisk = GitRisk("^(\\W)*(Bug)", self.mGitRepoPath, debug=False, cacheMode='use', resultCacheSize=0)
+    otherGitRisk.getTicketCache()
+    cachingGitRisk.checkMerge('d8bb7b3')
+    otherGitRisk = GitRisk("^(\\W)*(Bug)", self.mGitRepoPath, debug=False, cacheMode='use', resultCacheSize=0)
+    bypassingGitRisk = GitRisk("^(\\W)*(Bug)", self.mGitRepoPath, debug=False, cacheMode='bypass')
+    self.assertEquals(bypassingGitRisk.checkMerge('d8bb7b3'), otherGitRisk.checkMerge('d8bb7b3'))
+
+    # Entries are kept even if extraction stops early.
+    cachingGitRisk = GitRisk("#[0-9]+", self.mGitRepoPath, debug=False, cacheMode='use')
+    graph = cachingGitRisk.getCommitGraph()
+    suspectShas = [graph.getBinSha(commitId) for commitId in cachingGitRisk._iterSuspectIdsFromMerge('d8bb7b3')]
+    records = cachingGitRisk._iterCommitTickets(suspectShas)
+    next(records)
+    records.close()
+    self.assertEquals(1, cachingGitRisk.getTicketCache().getEntryCount())
+
+  def test_resultCache(self):
+    cachingGitRisk = GitRisk(repo=self.mGitRepoPath, debug=False, cacheMode='use')
+    expected = cachingGitRisk.checkMerge('d8bb7b3')
+    self.assertEquals(expected, cachingGitRisk.checkMerge('d8bb7b3'))
+    self.assertEquals((1, 1), (cachingGitRisk.getResultCache().getHitCount(),
+                               cachingGitRisk.getResultCache().getMissCount()))
+
+    # A bounded check is only answered from the cache if the complete result
+    # fits within its limits.
+    # Results that were cut short are never kept.
+    self.assertTrue(cachingGitRisk.checkMerge('d8bb7b3', maxCommits=3).truncated)
+    self.assertTrue(cachingGitRisk.checkMerge('d8bb7b3', maxCommits=3).truncated)
+    self.assertEquals(expected, cachingGitRisk.checkMerge('d8bb7b3', maxCommits=8))
+    self.assertEquals(2, cachingGitRisk.getResultCache().getHitCount())
+    self.assertEquals(1, cachingGitRisk.getResultCache().getEntryCount())
+
+    # Results are stored by the SHAs they were resolved to, for the next run.
+    headSha = cachingGitRisk.getCommitFromHash('HEAD').hexsha
+    expectedRange = cachingGitRisk.checkCommitRange('HEAD', 'd8bb7b3')
+    cachingGitRisk.close()
+    cachingGitRisk = GitRisk(repo=self.mGitRepoPath, debug=False, cacheMode='use')
+    self.assertEquals(2, cachingGitRisk.getResultCache().getStore().getEntryCount())
+    self.assertEquals(expected, cachingGitRisk.checkMerge('d8bb7b3'))
+    self.assertEquals(expectedRange, cachingGitRisk.checkCommitRange(headSha, 'd8bb7b3'))
+    self.assertEquals(2, cachingGitRisk.getResultCache().getHitCount())
+    cachingGitRisk.close()
+
+    # Runs with another ticket configuration neither see nor wipe those results.
+    otherGitRisk = GitRisk("#[0-9]+", self.mGitRepoPath, debug=False, cacheMode='use')
+    self.assertEquals(0, otherGitRisk.getResultCache().getStore().getEntryCount())
+    otherGitRisk.checkMerge('d8bb7b3')
+    self.assertEquals((0, 1), (otherGitRisk.getResultCache().getHitCount(),
+                               otherGitRisk.getResultCache().getMissCount()))
+    otherGitRisk.close()
+    cachingGitRisk = GitRisk(repo=self.mGitRepoPath, debug=False, cacheMode='use')
+    self.assertEquals(2, cachingGitRisk.getResultCache().getStore().getEntryCount())
+    self.assertEquals(expected, cachingGitRisk.checkMerge('d8bb7b3'))
+    self.assertEquals(1, cachingGitRisk.getResultCache().getHitCount())
+    cachingGitRisk.close()
+
+    verifyingGitRisk = GitRisk(repo=self.mGitRepoPath, debug=False, cacheMode='verify')
+    self.assertEquals(expected, verifyingGitRisk.checkMerge('d8bb7b3'))
+    self.assertEquals([], verifyingGitRisk.getCacheMismatches())
+    verifyingGitRisk.close()
+
+    bypassingGitRisk = GitRisk(repo=self.mGitRepoPath, debug=False, cacheMode='bypass')
+    self.assertEquals(expected, bypassingGitRisk.checkMerge('d8bb7b3'))
+    self.assertEquals(None, bypassingGitRisk.getResultCache().getStore())
+    bypassingGitRisk.close()
+
+    self.assertEquals(None, GitRisk(repo=self.mGitRepoPath, debug=False, resultCacheSize=0).getResultCache())
+
+  def test_mmapObjectBackend(self):
+    gitGitRisk = GitRisk(repo=self.mGitRepoPath, debug=False, objectBackend='git')
+    repo = gitGitRisk.mRepo
+    commitShas = repo.git.rev_list('--all').split()
+    commitBinShas = [binascii.unhexlify(commitSha) for commitSha in commitShas]
+    expectedMessages = sorted(gitGitRisk._iterCommitMessages(commitBinShas))
+    expectedResults = [gitGitRisk.checkMerge(merge) for merge in gitGitRisk.getMergesInRange('HEAD')]
+
+    # Loose objects, then packs with their deltas given by offset and by SHA.
+    # Some commits are stored as deltas after an aggressive repack.
+    repackings = [None, ['-c', 'repack.useDeltaBaseOffset=true'], ['-c', 'repack.useDeltaBaseOffset=false']]
+    for repacking in repackings:
+      if repacking:
+        repo.git.execute(['git'] + repacking + ['repack', '-a', '-d', '-f', '-q', '--window=250'])
+
+      mmapGitRisk = GitRisk(repo=self.mGitRepoPath, debug=False, objectBackend='mmap')
+      self.assertEquals(expectedMessages, sorted(mmapGitRisk._iterCommitMessages(commitBinShas)))
+      self.assertEquals(expectedResults, [mmapGitRisk.checkMerge(merge) for merge in mmapGitRisk.getMergesInRange('HEAD')])
+
+      # Only commits are read by the ObjectReader.
+      reader = mmapGitRisk.getObjectReader()
+      self.assertTrue(reader.readCommit(commitBinShas[0]))
+      self.assertEquals(None, reader.readCommit(binascii.unhexlify(repo.git.rev_parse('HEAD^{tree}'))))
+      self.assertEquals(None, reader.readCommit(b'\0' * 20))
+      mmapGitRisk.close()
+
+  def test_objectReaderPackRefresh(self):
+    gitRisk = GitRisk(repo=self.mGitRepoPath, debug=False, objectBackend='mmap')
+    repo = gitRisk.mRepo
+    reader = gitRisk.getObjectReader()
+    refreshes = []
+    refreshPacks = reader._refreshPacks
+    reader._refreshPacks = lambda: (refreshes.append(True), refreshPacks())
+
+    # Objects that aren't there don't make the packs be looked for again...
+    for attempt in range(3):
+      self.assertEquals(None, reader.readCommit(b'\0' * 20))
+    self.assertEquals([], refreshes)
+
+    # ...but once the loose objects have been packed, the new pack is found.
+    headBinSha = binascii.unhexlify(repo.git.rev_parse('HEAD'))
+    repo.git.repack('-a', '-d', '-q')
+    self.assertTrue(reader.readCommit(headBinSha))
+    self.assertEquals([True], refreshes)
+    gitRisk.close()
+
+  def test_getMergesInRange(self):
+    self.assertEquals(['9cfed13838c730c748c482be0ea78e65883e6b94',
+                       'd8bb7b32e43bf27f49a4dc3d27d9f799e829db9d',
+                       'ddcdb34cd3dea82e47c50751d8b9b4b3b8c23e4e'],
+                      self.mGitRiskObj.getMergesInRange('7b9609a..HEAD'))
+    self.assertEquals(['9cfed13838c730c748c482be0ea78e65883e6b94'],
+                      self.mGitRiskObj.getMergesInRange('d8bb7b3..HEAD'))
+
+    # Symmetric ranges leave out what both sides have in common, as git does.
+    repo = self.mGitRiskObj.mRepo
+    for mergeRange in ['6ff4935...d8bb7b3', 'f5813f8...ddcdb34', 'HEAD...7b9609a', '...c2a881d']:
+      self.assertEquals(repo.git.rev_list('--merges', mergeRange).split(),
+                        self.mGitRiskObj.getMergesInRange(mergeRange))
+    self.assertEquals(['d8bb7b32e43bf27f49a4dc3d27d9f799e829db9d', 'ddcdb34cd3dea82e47c50751d8b9b4b3b8c23e4e'],
+                      self.mGitRiskObj.getMergesInRange('6ff4935...d8bb7b3'))
+
+  def test_checkCommits(self):
+    merges = self.mGitRiskObj.getMergesInRange('7b9609a..HEAD')
+    results = list(self.mGitRiskObj.checkCommits(merges))
+    self.assertEquals(merges, [commitHash for (commitHash, tickets, commitsWithoutTickets) in results])
+
+    # Each result should be the same as checking that merge on its own.
+    for (commitHash, tickets, commitsWithoutTickets) in results:
+      gitRisk = GitRisk("^(\W)*([B|b][U|u][G|g])(\ )*(\#)*[0-9]+", self.mGitRepoPath, debug=False)
+      self.assertEquals(gitRisk.checkMerge(commitHash), (tickets, commitsWithoutTickets))
+
+  def test_checkCommitsInParallel(self):
+    merges = self.mGitRiskObj.getMergesInRange('7b9609a..HEAD')
+    expectedResults = list(self.mGitRiskObj.checkCommits(merges))
+
+    parallelGitRisk = GitRisk("^(\W)*([B|b][U|u][G|g])(\ )*(\#)*[0-9]+", self.mGitRepoPath, debug=False, jobs=3)
+    try:
+      self.assertEquals(expectedResults, list(parallelGitRisk.checkCommits(merges)))
+    finally:
+      parallelGitRisk.close()
+
+  def test_checkCommitRangeInParallelShards(self):
+    expectedResult = self.mGitRiskObj.checkCommitRange('HEAD', '7b9609a')
+
+    shardSize = gitrisk.gitrisk.PARALLEL_SHARD_SIZE
+    gitrisk.gitrisk.PARALLEL_SHARD_SIZE = 2
+    parallelGitRisk = GitRisk("^(\W)*([B|b][U|u][G|g])(\ )*(\#)*[0-9]+", self.mGitRepoPath, debug=False, jobs=2)
+    try:
+      self.assertEquals(expectedResult, parallelGitRisk.checkCommitRange('HEAD', '7b9609a'))
+    finally:
+      parallelGitRisk.close()
+      gitrisk.gitrisk.PARALLEL_SHARD_SIZE = shardSize
+
+  def test_getOneLineCommitMessages(self):
+    shas = ['9cfed13838c730c748c482be0ea78e65883e6b94', '767afe6aeb9cdd79d0fcf09135f6fe993fad80c6']
+    summaries = self.mGitRiskObj.getOneLineCommitMessages(shas)
+    for sha in shas:
+      self.assertEquals(self.mGitRiskObj.getOneLineCommitMessage(sha), summaries[sha])
+
+  def test_getMergesInPush(self):
+    gitRisk = GitRisk(repo=self.mGitRepoPath, debug=False)
+    nullSha = gitrisk.gitrisk.NULL_SHA
+    masterSha = '9cfed13838c730c748c482be0ea78e65883e6b94'
+    oldMasterSha = gitRisk.getCommitFromHash('c2a881d').hexsha
+    releaseSha = gitRisk.getCommitFromHash('d8bb7b3').hexsha
+
+    # bug-27 and bug-143 already contain everything up to 836ceea, merges
+    # included, so only the last merge is new.
+    self.assertEquals([masterSha], gitRisk.getMergesInPush([(oldMasterSha, masterSha, 'refs/heads/master')]))
+    gitRisk.mRepo.git.branch('-D', 'bug-27', 'bug-143')
+
+    # A push that moved master on from c2a881d, and created a release branch
+    # from one of the merges it brought in. Each new merge is only reported
+    # once.
+    merges = gitRisk.getMergesInPush([(oldMasterSha, masterSha, 'refs/heads/master'),
+                                      (nullSha, releaseSha, 'refs/heads/release')])
+    expectedMerges = [gitRisk.getCommitFromHash(sha).hexsha for sha in ['9cfed13', 'd8bb7b3', 'ddcdb34']]
+    self.assertEquals(expectedMerges, merges)
+
+    # History that was already on another branch has been analysed before.
+    merges = gitRisk.getMergesInPush([(nullSha, masterSha, 'refs/heads/release')])
+    self.assertEquals([], merges)
+
+    # Deleting a branch doesn't introduce anything.
+    self.assertEquals([], gitRisk.getMergesInPush([(masterSha, nullSha, 'refs/heads/master')]))
+
+  def test_checkCommitsWithTimeBudget(self):
+    gitRisk = GitRisk(repo=self.mGitRepoPath, debug=False)
+    results = list(gitRisk.checkCommits(['9cfed13', 'd8bb7b3', 'ddcdb34'], timeBudget=0))
+    self.assertEquals(['9cfed13'], [commitHash for (commitHash, tickets, commitsWithoutTickets) in results])
+
+  def test_boundedChecks(self):
+    gitRisk = GitRisk(repo=self.mGitRepoPath, debug=False, jobs=2)
+    result = gitRisk.checkMerge('d8bb7b3')
+    self.assertFalse(result.truncated)
+    self.assertEquals(8, result.commitCount)
+
+    result = gitRisk.checkMerge('d8bb7b3', maxCommits=3)
+    (tickets, commitsWithoutTickets) = result
+    self.assertTrue(result.truncated)
+    self.assertEquals('max-commits', result.truncatedBy)
+    self.assertEquals(3, result.commitCount)
+    self.assertTrue(tickets.issubset(set(['#14', '#44'])))
+
+    # Every commit in the test repository is older than a day.
+    result = gitRisk.checkCommitRange('HEAD', 'd8bb7b3', maxAge=24 * 60 * 60)
+    self.assertEquals(('max-age', 0, set()), (result.truncatedBy, result.commitCount, result[0]))
+
+    result = gitRisk.checkMerge('d8bb7b3', timeBudget=0)
+    self.assertEquals(('time-budget', 0), (result.truncatedBy, result.commitCount))
+    self.assertEquals(result, pickle.loads(pickle.dumps(result)))
+    self.assertEquals('time-budget', pickle.loads(pickle.dumps(result)).truncatedBy)
+
+    # Limits apply to each commit checked in a batch, including in workers.
+    results = list(gitRisk.checkCommits(['9cfed13', 'd8bb7b3'], maxCommits=2))
+    self.assertEquals([('9cfed13', True, 2), ('d8bb7b3', True, 2)],
+                      [(result[0], result.truncated, result.commitCount) for result in results])
+    gitRisk.close()
+
+  def test_multipleRepositories(self):
+    otherRepoPath = os.path.join(self.mTempDir, 'otherrepo')
+    shutil.copytree(self.mGitRepoPath, otherRepoPath)
+    missingRepoPath = os.path.join(self.mTempDir, 'missing')
+
+    created = []
+    def createGitRisk(aRepoPath):
+      created.append(aRepoPath)
+      return GitRisk(repo=aRepoPath, debug=False, outputFormat='ndjson')
+
+    # With only one repository open at a time, each one is closed as soon as
+    # the next is needed.
+    pool = RepoPool(createGitRisk, maxOpen=1)
+    multiRepoRisk = MultiRepoRisk(pool, threads=2, outputFormat='ndjson')
+    repoResults = list(multiRepoRisk.iterRepoResults([self.mGitRepoPath, otherRepoPath, self.mGitRepoPath,
+                                                      missingRepoPath],
+                                                     lambda gitRisk: gitRisk.getMergesInRange('d8bb7b3..HEAD')))
+    self.assertEquals([self.mGitRepoPath, otherRepoPath, missingRepoPath],
+                      [repoPath for (repoPath, records, error) in repoResults])
+    for (repoPath, records, error) in repoResults[:2]:
+      self.assertEquals(None, error)
+      self.assertEquals([(repoPath, '9cfed13838c730c748c482be0ea78e65883e6b94', ['143'])],
+                        [(record['repository'], record['commit'], record['tickets']) for record in records])
+    self.assertTrue(repoResults[2][2])
+    self.assertTrue(len(pool.getOpenRepoPaths()) <= 1)
+
+    # The same repository is never handed out twice at once, and stays open
+    # between uses.
+    with pool.using(otherRepoPath) as gitRisk:
+      self.assertEquals([os.path.abspath(otherRepoPath)], pool.getOpenRepoPaths())
+    with pool.using(otherRepoPath) as sameGitRisk:
+      self.assertTrue(sameGitRisk is gitRisk)
+
+    output = StringIO()
+    errorOutput = StringIO()
+    (realStdout, realStderr) = (sys.stdout, sys.stderr)
+    (sys.stdout, sys.stderr) = (output, errorOutput)
+    try:
+      errors = multiRepoRisk.outputRepoResults(repoResults)
+    finally:
+      (sys.stdout, sys.stderr) = (realStdout, realStderr)
+
+    self.assertEquals([missingRepoPath], [repoPath for (repoPath, error) in errors])
+    self.assertTrue(missingRepoPath in errorOutput.getvalue())
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    self.assertEquals(3, len(records))
+    self.assertEquals([{'ticket': '143', 'repositories': sorted([self.mGitRepoPath, otherRepoPath])}],
+                      records[2]['tickets'])
+    pool.close()
+    self.assertEquals([], pool.getOpenRepoPaths())
+
+    # Profiling several repositories at once is refused, rather than ignored.
+    for profileArgs in [['--profile'], ['--profile-dump', os.path.join(self.mTempDir, 'profile')]]:
+      errorOutput = StringIO()
+      (realStderr, realArgv) = (sys.stderr, sys.argv)
+      (sys.stderr, sys.argv) = (errorOutput, ['git-risk', '-r', self.mGitRepoPath, '-r', otherRepoPath,
+                                              '--merges', 'd8bb7b3..HEAD'] + profileArgs)
+      try:
+        self.assertRaises(SystemExit, gitrisk.gitrisk.main)
+      finally:
+        (sys.stderr, sys.argv) = (realStderr, realArgv)
+      self.assertTrue('single repository' in errorOutput.getvalue())
+
+  def test_daemon(self):
+    import threading
+    daemon = RiskDaemon(lambda: GitRisk(repo=self.mGitRepoPath, debug=False, memoSize=2), self.mGitRepoPath)
+    listening = threading.Event()
+    thread = threading.Thread(target=daemon.serve, args=(listening.set,))
+    thread.start()
+    listening.wait(10)
+
+    def request(aRequest):
+      client = DaemonClient(daemon.getSocketPath())
+      self.assertTrue(client.connect())
+      try:
+        return list(client.iterResponses(aRequest))
+      finally:
+        client.close()
+
+    try:
+      # Checked once, then answered from the result cache. The commit records
+      # kept between requests are bounded.
+      for attempt in range(2):
+        responses = request({'command': 'check', 'commits': ['9cfed13', 'd8bb7b3']})
+        self.assertEquals([['143'], ['#14', '#44']], [response['record']['tickets'] for response in responses[:2]])
+        self.assertEquals({'done': True, 'unchecked': [], 'mismatches': []}, responses[2])
+      self.assertEquals((2, 2), (daemon.getResultCache().getEntryCount(), daemon.getResultCache().getHitCount()))
+      self.assertEquals(2, len(daemon.getGitRisk().mTicketMemo))
+
+      # A client wanting different results has to check the commits itself.
+      responses = request({'command': 'check', 'commits': ['9cfed13'], 'pathScoped': True})
+      self.assertTrue(responses[0]['fallback'])
+
+      # The command line uses the daemon when it's running.
+      output = StringIO()
+      (realStdout, realArgv) = (sys.stdout, sys.argv)
+      (sys.stdout, sys.argv) = (output, ['git-risk', '-r', self.mGitRepoPath, '-q', '-c', 'd8bb7b3'])
+      try:
+        self.assertEquals(0, gitrisk.gitrisk.main())
+      finally:
+        (sys.stdout, sys.argv) = (realStdout, realArgv)
+      self.assertEquals("#14\n#44\n", output.getvalue())
+
+      # Quiet results only leave the summaries out, so the same result is used.
+      self.assertEquals((2, 3), (daemon.getResultCache().getEntryCount(), daemon.getResultCache().getHitCount()))
+    finally:
+      request({'command': 'shutdown'})
+      thread.join(10)
+
+    self.assertFalse(os.path.exists(daemon.getSocketPath()))
+
+  def test_mainClosesOnError(self):
+    # The GitRisk object is closed even if checking fails.
+    closed = []
+    realClose = GitRisk.close
+    def close(aGitRisk):
+      closed.append(aGitRisk)
+      realClose(aGitRisk)
+
+    (realArgv, realStdout) = (sys.argv, sys.stdout)
+    (sys.argv, sys.stdout) = (['git-risk', '-r', self.mGitRepoPath, '--no-daemon', '-c', '0000000'], StringIO())
+    GitRisk.close = close
+    try:
+      self.assertRaises(Exception, gitrisk.gitrisk.main)
+    finally:
+      GitRisk.close = realClose
+      (sys.argv, sys.stdout) = (realArgv, realStdout)
+    self.assertEquals(1, len(closed))
+
+  def test_findGitDir(self):
+    # A client finds the git directory (and so the daemon's socket) just where
+    # git, and so the daemon, does, without running git.
+    import subprocess
+    bareRepoPath = os.path.join(self.mTempDir, 'bare.git')
+    subprocess.check_call(['git', 'clone', '-q', '--bare', self.mGitRepoPath, bareRepoPath])
+    worktreePath = os.path.join(self.mTempDir, 'worktree')
+    subprocess.check_call(['git', 'worktree', 'add', '-q', worktreePath, 'bug-44'], cwd=self.mGitRepoPath)
+    subDirPath = os.path.join(self.mGitRepoPath, 'subdir')
+    os.mkdir(subDirPath)
+
+    for path in [self.mGitRepoPath, subDirPath, bareRepoPath, worktreePath]:
+      self.assertEquals(os.path.realpath(getGitDir(path)), os.path.realpath(findGitDir(path)))
+    self.assertEquals(None, findGitDir(self.mTempDir))
+
+  def test_preReceiveHookWithDaemon(self):
+    # The objects being pushed are quarantined until pre-receive accepts them,
+    # so the hook checks them itself rather than asking the daemon (which can't
+    # see them), and the push goes through.
+    import subprocess
+    import threading
+    remotePath = os.path.join(self.mTempDir, 'remote.git')
+    subprocess.check_call(['git', 'clone', '-q', '--bare', self.mGitRepoPath, remotePath])
+    for name in ['gitrisk.ticketRegex', 'gitrisk.ticketNumberRegexGroup']:
+      value = subprocess.check_output(['git', 'config', name], cwd=self.mGitRepoPath).strip()
+      subprocess.check_call(['git', 'config', name, value], cwd=remotePath)
+
+    packageDir = os.path.dirname(os.path.dirname(os.path.abspath(gitrisk.gitrisk.__file__)))
+    hookPath = os.path.join(remotePath, 'hooks', 'pre-receive')
+    with open(hookPath, 'w') as hook:
+      hook.write("#!/bin/sh\nPYTHONPATH='%s' exec '%s' -c 'import sys; from gitrisk.gitrisk import main; "
+                 "sys.exit(main())' --hook pre-receive -q\n" % (packageDir, sys.executable))
+    os.chmod(hookPath, 0o755)
+
+    daemon = RiskDaemon(lambda: GitRisk(repo=remotePath, debug=False), remotePath)
+    listening = threading.Event()
+    thread = threading.Thread(target=daemon.serve, args=(listening.set,))
+    thread.start()
+    listening.wait(10)
+
+    try:
+      repo = self.mGitRiskObj.mRepo
+      mergeSha = repo.git.commit_tree('HEAD^{tree}', '-p', 'HEAD', '-p', 'bug-44', m='Merge bug-44 again',
+                                      env={'GIT_AUTHOR_NAME': 'git-risk', 'GIT_AUTHOR_EMAIL': 'git-risk@example.com',
+                                           'GIT_COMMITTER_NAME': 'git-risk',
+                                           'GIT_COMMITTER_EMAIL': 'git-risk@example.com'})
+      push = subprocess.Popen(['git', 'push', remotePath, mergeSha + ':refs/heads/master'], cwd=self.mGitRepoPath,
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+      output = push.communicate()[0].decode('utf-8')
+      self.assertEquals(0, push.returncode, output)
+      self.assertTrue('remote: #44' in output, output)
+      self.assertEquals(mergeSha, subprocess.check_output(['git', 'rev-parse', 'master'],
+                                                          cwd=remotePath).decode('ascii').strip())
+      self.assertEquals(0, daemon.getResultCache().getEntryCount())
+    finally:
+      client = DaemonClient(daemon.getSocketPath())
+      self.assertTrue(client.connect())
+      try:
+        list(client.iterResponses({'command': 'shutdown'}))
+      finally:
+        client.close()
+      thread.join(10)
+
+  def test_ticketIndex(self):
+    gitRisk = GitRisk(repo=self.mGitRepoPath, debug=False)
+    self.assertTrue(gitRisk.updateTicketIndex() > 0)
+
+    # Looking a ticket up finds exactly the merges for which checkMerge reports
+    # it.
+    merges = gitRisk.getMergesInRange('HEAD')
+    for ticket in ['#0', '#14', '#44', '143']:
+      (commitShas, mergeShas, relatedTickets) = gitRisk.lookupTicket(ticket)
+      self.assertTrue(commitShas)
+      expectedMerges = [merge for merge in merges if ticket in gitRisk.checkMerge(merge)[0]]
+      self.assertEquals(sorted(expectedMerges), mergeShas)
+
+    (commitShas, mergeShas, relatedTickets) = gitRisk.lookupTicket('#44')
+    self.assertEquals(['6a5c798', 'f5813f8'], sorted(sha[:7] for sha in commitShas))
+    self.assertEquals(['d8bb7b32e43bf27f49a4dc3d27d9f799e829db9d'], mergeShas)
+    self.assertEquals(['#14'], relatedTickets)
+    self.assertEquals(([], [], []), gitRisk.lookupTicket('#1234'))
+
+    # Nothing new has been committed, so there's nothing to add.
+    self.assertEquals(0, gitRisk.updateTicketIndex())
+
+    # Only the new merge is added to the index once it's committed.
+    repo = gitRisk.mRepo
+    configWriter = repo.config_writer()
+    configWriter.set_value('user', 'name', 'git-risk')
+    configWriter.set_value('user', 'email', 'git-risk@example.com')
+    configWriter.release()
+    mergeSha = repo.git.commit_tree('HEAD^{tree}', '-p', 'HEAD', '-p', 'bug-44', m='Merge bug-44 again')
+    repo.git.update_ref('refs/heads/master', mergeSha)
+    self.assertEquals(1, gitRisk.updateTicketIndex())
+    self.assertTrue(mergeSha in gitRisk.lookupTicket('#44', update=False)[1])
+
+    # Only suspects that reference a ticket are stored.
+    index = gitRisk.getTicketIndex()
+    self.assertEquals([], index.mConnection.execute(
+      'SELECT sha FROM merge_suspects WHERE sha NOT IN (SELECT sha FROM ticket_commits)').fetchall())
+
+    # Once the merge can't be reached any more, it's dropped from the index.
+    repo.git.update_ref('refs/heads/master', mergeSha + '^')
+    self.assertEquals(0, gitRisk.updateTicketIndex())
+    self.assertFalse(mergeSha in gitRisk.lookupTicket('#44', update=False)[1])
+    self.assertFalse(mergeSha in index.getIndexedCommits())
+
+    # A tip indexed earlier that no longer exists doesn't break the update, and
+    # whatever could only be reached from it is dropped as well.
+    goneSha = '1' * 40
+    index.addCommitTickets([(goneSha, ['#99'])])
+    index.setTips(index.getTips() + [goneSha])
+    self.assertEquals(0, gitRisk.updateTicketIndex())
+    self.assertEquals([], gitRisk.lookupTicket('#99', update=False)[0])
+    self.assertEquals(sorted(expectedMerges), gitRisk.lookupTicket('143', update=False)[1])
+    gitRisk.close()
+
+  def test_checkCommitsAsRecords(self):
+    gitRisk = GitRisk(repo=self.mGitRepoPath, debug=False)
+    [(commitHash, tickets, recordsWithoutTickets)] = list(gitRisk.checkCommits(['9cfed13'], asRecords=True))
+    self.assertEquals(set(['143']), tickets)
+    self.assertEquals(set(['0d75d6c25419313db8c7c85b19a2b7ae2e3020f7', '767afe6aeb9cdd79d0fcf09135f6fe993fad80c6']),
+                      set(record.hexsha for record in recordsWithoutTickets))
+
+    for record in recordsWithoutTickets:
+      self.assertTrue(isinstance(record, CommitRecord))
+      self.assertFalse(hasattr(record, '__dict__'))
+      self.assertFalse(record.isMerge)
+      self.assertEquals(None, record.tickets)
+      self.assertEquals(record, pickle.loads(pickle.dumps(record)))
+
+    # The public API still hands out GitPython commits.
+    (tickets, commitsWithoutTickets) = gitRisk.checkMerge('9cfed13')
+    self.assertEquals(set(record.hexsha for record in recordsWithoutTickets),
+                      set(commit.hexsha for commit in commitsWithoutTickets))
+    self.assertFalse(any(isinstance(commit, CommitRecord) for commit in commitsWithoutTickets))
+
+  def test_outputResultsAsNdjson(self):
+    gitRisk = GitRisk(repo=self.mGitRepoPath, debug=False, outputFormat='ndjson')
+    output = StringIO()
+    realStdout = sys.stdout
+    sys.stdout = output
+    try:
+      gitRisk.beginOutput()
+      for (commitHash, tickets, commitsWithoutTickets) in gitRisk.checkCommits(['9cfed13', 'd8bb7b3']):
+        gitRisk.outputResults(commitHash, tickets, commitsWithoutTickets)
+      gitRisk.endOutput()
+    finally:
+      sys.stdout = realStdout
+
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    self.assertEquals(2, len(records))
+    self.assertEquals('9cfed13838c730c748c482be0ea78e65883e6b94', records[0]['commit'])
+    self.assertEquals("9cfed13 Merge branch 'bug-143'", records[0]['summary'])
+    self.assertEquals(['143'], records[0]['tickets'])
+    self.assertEquals(['0d75d6c25419313db8c7c85b19a2b7ae2e3020f7', '767afe6aeb9cdd79d0fcf09135f6fe993fad80c6'],
+                      [commit['commit'] for commit in records[0]['commitsWithoutTickets']])
+    self.assertEquals(['#14', '#44'], records[1]['tickets'])
+
+  def test_profilePhases(self):
+    timings = []
+    profiler = PhaseProfiler(callback=timings.append)
+    gitRisk = GitRisk(repo=self.mGitRepoPath, debug=False, quiet=True, profiler=profiler)
+    (tickets, commitsWithoutTickets) = gitRisk.checkMerge('9cfed13')
+    output = StringIO()
+    realStdout = sys.stdout
+    sys.stdout = output
+    try:
+      gitRisk.outputResults('9cfed13', tickets, commitsWithoutTickets)
+    finally:
+      sys.stdout = realStdout
+    self.assertEquals('143', output.getvalue().strip())
+
+    # Commits are loaded into the commit graph (and timed as a phase of their
+    # own) whenever they're needed, so that phase is reported in between.
+    self.assertEquals(['config', 'mergeBase', 'walk', 'extract', 'output'],
+                      [timing.phase for timing in timings if timing.phase != 'graph'])
+    self.assertTrue('graph' in [timing.phase for timing in timings])
+    totals = profiler.getTotals()
+    self.assertEquals(4, totals['walk'][3])
+    self.assertEquals(4, totals['extract'][3])
+
+    # All of the commit messages are read by a single git process, and every
+    # git process is started inside some phase.
+    self.assertEquals(1, totals['extract'][2])
+    self.assertTrue(profiler.getSubprocessCount() >= 1)
+    self.assertEquals(profiler.getSubprocessCount(),
+                      sum(subprocesses for (calls, wallTime, subprocesses, commits) in totals.values()))
+    self.assertTrue(all(timing.wallTime >= 0 for timing in timings))
+    self.assertTrue('extract' in profiler.formatSummary())
+
   def test_getConfigFromRepo(self):
     expectedRegex = "^(\W)*(Bug)(\ )*((\#)*[0-9]+)"
     gitRiskObj = GitRisk(repo=self.mGitRepoPath, debug=False)
     self.assertEquals(expectedRegex, gitRiskObj.getTicketRegex())
 
+  def test_getNonAsciiConfigFromRepo(self):
+    # Escapes are undone as `git config` would, leaving everything else
+    # (including text that isn't ASCII) as it is.
+    configPath = os.path.join(self.mGitRepoPath, '.git', 'config')
+    with open(configPath, 'rb') as configFile:
+      config = configFile.read().decode('utf-8')
+    config = '\n'.join(line for line in config.split('\n') if 'ticketRegex' not in line and 'RegexGroup' not in line)
+    config = config.replace(u'[gitrisk]', u'[gitrisk]\n\tticketRegex = "L\xf6sung \\"#[0-9]+\\"\\t(\\\\d)"')
+    with open(configPath, 'wb') as configFile:
+      configFile.write(config.encode('utf-8'))
+
+    expectedRegex = u'L\xf6sung "#[0-9]+"\t(\\d)'
+    gitRisk = GitRisk(repo=self.mGitRepoPath, debug=False)
+    ticketRegex = gitRisk.getTicketRegex()
+    if not isinstance(ticketRegex, type(u'')):
+      ticketRegex = ticketRegex.decode('utf-8')
+    self.assertEquals(expectedRegex, ticketRegex)
+
   def test_ticketRegexGroup(self):
       gitRiskObj = GitRisk(repo=self.mGitRepoPath, debug=False)
       (tickets, commitsWithoutTickets) = gitRiskObj.checkMerge('9cfed13838c730c748c482be0ea78e65883e6b94')
@@ -0,0 +1,59 @@
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+# git-risk is typically run from a hook on every merge, so starting it up (and
+# in particular `git-risk --help`, which shouldn't need to touch a repository at
+# all) has to stay cheap. The budget is measured on top of the time it takes to
+# start a bare interpreter, and can be overridden with GITRISK_STARTUP_BUDGET (in
+# seconds) on slow machines.
+STARTUP_BUDGET = float(os.environ.get('GITRISK_STARTUP_BUDGET', '0.5'))
+STARTUP_RUNS = 3
+
+HELP_SCRIPT = '''
+import sys
+sys.argv = ['git-risk', '--help']
+from gitrisk.gitrisk import main
+try:
+  main()
+except SystemExit:
+  pass
+
+# None of the heavy dependencies should have been loaded just to show help.
+for module in ['git', 'pkg_resources', 'multiprocessing', 'sqlite3', 'configparser']:
+  if module in sys.modules:
+    sys.stderr.write('loaded ' + module + '\\n')
+    sys.exit(1)
+'''
+
+class StartupTest(unittest.TestCase):
+
+  def __timeScript(self, aScript):
+    # Take the fastest of a few runs, to smooth out noise from the machine.
+    fastest = None
+    for run in range(STARTUP_RUNS):
+      start = time.time()
+      proc = subprocess.Popen([sys.executable, '-c', aScript], stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE)
+      err = proc.communicate()[1]
+      elapsed = time.time() - start
+      self.assertEqual(0, proc.returncode, err)
+      if fastest is None or elapsed < fastest:
+        fastest = elapsed
+
+    return fastest
+
+  def test_helpDoesNotLoadHeavyModules(self):
+    self.__timeScript(HELP_SCRIPT)
+
+  def test_helpStartupBudget(self):
+    interpreterTime = self.__timeScript('pass')
+    helpTime = self.__timeScript(HELP_SCRIPT)
+    self.assertTrue(helpTime - interpreterTime < STARTUP_BUDGET,
+                    "import + --help took %.3fs over interpreter startup (budget %.3fs)"
+                    % (helpTime - interpreterTime, STARTUP_BUDGET))
+
+if __name__ == '__main__':
+  unittest.main()